@@ -3,6 +3,7 @@
 import click
 
 from ckanext.validation import common
+from ckanext.validation.settings import SIZE_CLASSES
 
 
 def get_commands():
@@ -55,6 +56,104 @@ def run_validation(yes, resource, dataset, search):
     common.run_validation(yes, resource, dataset, search)
 
 
+@validation.command()
+@click.argument(u'queues', nargs=-1)
+@click.option(u'-p', u'--processes', type=int, default=None,
+              help=u'Number of worker processes to run. '
+                   u'Defaults to `ckanext.validation.worker.processes`')
+@click.option(u'--max-jobs', type=int, default=None,
+              help=u'Recycle a worker process after this many jobs. '
+                   u'Defaults to `ckanext.validation.worker.max_jobs`')
+@click.option(u'--max-memory', type=int, default=None,
+              help=u'Recycle a worker process once it uses this many MB. '
+                   u'Defaults to `ckanext.validation.worker.max_memory`')
+@click.option(u'-b', u'--burst', is_flag=True,
+              help=u'Stop the workers when the queues are empty')
+@click.option(u'-s', u'--size-class', type=click.Choice(SIZE_CLASSES),
+              default=None,
+              help=u'Only run jobs of this size class, with its own number '
+                   u'of processes (`ckanext.validation.worker.<class>.processes`)')
+def worker(queues, processes, max_jobs, max_memory, burst, size_class):
+    '''Start a pool of long-lived validation workers. Unlike `ckan jobs
+    worker`, jobs run in already warmed up processes instead of a freshly
+    forked one each. Listens on the validation queue
+    (`ckanext.validation.queue`), or the queues of all size classes
+    smallest first if enabled, unless other QUEUES are given.
+    '''
+    common.worker(queues, processes, max_jobs, max_memory, burst, size_class)
+
+
+@validation.command()
+@click.option(u'-r', u'--rate', type=float, default=None,
+              help=u'Validations to enqueue per minute. '
+                   u'Defaults to `ckanext.validation.scheduler.rate`')
+@click.option(u'-b', u'--burst', is_flag=True,
+              help=u'Stop once no validation is due')
+def schedule(rate, burst):
+    '''Keep validations up to date by enqueueing the resources whose last
+    validation is older than its TTL (`ckanext.validation.scheduler.ttl`
+    and `ckanext.validation.scheduler.policies`), the most overdue first,
+    at a steady rate instead of all at once.
+    '''
+    common.schedule(rate, burst)
+
+
+@validation.command(name='compress-reports')
+@click.option(u'-c', u'--codec', type=click.Choice([u'gzip', u'zstd']),
+              default=None,
+              help=u'Codec to compress with. '
+                   u'Defaults to `ckanext.validation.report.compression`')
+@click.option(u'-b', u'--batch-size', type=int, default=500,
+              help=u'Reports to compress in each transaction')
+def compress_reports(codec, batch_size):
+    '''Compress the validation reports stored as JSON text. It can run
+    while the site is up, and be stopped and run again to carry on.
+    '''
+    common.compress_reports(codec, batch_size)
+
+
+@validation.command(name='prune-history')
+@click.option(u'-b', u'--batch-size', type=int, default=1000,
+              help=u'Runs to delete in each transaction')
+def prune_history(batch_size):
+    '''Delete the validation runs older than the history retention, set
+    with `ckanext.validation.history.runs` and
+    `ckanext.validation.history.days`. Meant to be run periodically.
+    '''
+    common.prune_history(batch_size)
+
+
+@validation.command(name='refresh-stats')
+def refresh_stats():
+    '''Rebuild the validation statistics by organization and format shown
+    to sysadmins and returned by `validation_stats`. Meant to be run
+    periodically.
+    '''
+    common.refresh_stats()
+
+
+@validation.command(name='flush-reindex')
+def flush_reindex():
+    '''Reindex now the datasets waiting for the validation of their
+    resources to be indexed (`ckanext.validation.reindex.window`), and
+    show how many reindexes were avoided by coalescing them.
+    '''
+    common.flush_reindex()
+
+
+@validation.command(name='benchmark-reports')
+@click.option(u'-n', u'--sample', type=int, default=50,
+              help=u'Number of recent reports to benchmark with')
+@click.option(u'-r', u'--rounds', type=int, default=5,
+              help=u'Times each report is written and read in each format')
+def benchmark_reports(sample, rounds):
+    '''Compare the size and the write and read times of existing reports
+    stored as JSON text and compressed with each available codec. No data
+    is changed.
+    '''
+    common.benchmark_reports(sample, rounds)
+
+
 @validation.command()
 @click.option(u'-o', u'--output',
               help=u'Location of the CSV validation report file on the relevant commands.',
@@ -1,17 +1,26 @@
 # encoding: utf-8
 
 import csv
+import itertools
 import logging
 import six
 import sys
 
-from ckantoolkit import (c, NotAuthorized,
-                         ObjectNotFound, abort, _,
-                         render, get_action, config)
+from flask import Response, g, make_response, request, stream_with_context
 
-from ckanext.validation import settings
-from ckanext.validation.logic.action import _search_datasets
+from ckan import model
+
+from ckantoolkit import (c, h, NotAuthorized,
+                         ObjectNotFound, ValidationError, abort, _,
+                         render, render_snippet, get_action, check_access,
+                         config)
+
+from ckanext.validation import (
+    export, settings, page_cache, report_storage, status_events)
+from ckanext.validation.logic.action import (
+    RAW_REPORT_FLAG, _list_param, _search_datasets)
 from ckanext.validation.model import create_tables
+from ckanext.validation.validation_status_helper import ValidationStatusHelper
 
 
 log = logging.getLogger(__name__)
@@ -23,9 +32,28 @@ log = logging.getLogger(__name__)
 
 def validation(resource_id, id=None):
     try:
+        check_access(u'resource_validation_show', {u'user': c.user},
+                     {u'resource_id': resource_id})
+
+        record = ValidationStatusHelper().getValidationJob(
+            model.Session, resource_id)
+        resource_obj = model.Resource.get(resource_id)
+        if not record or not resource_obj:
+            raise ObjectNotFound("No validation report for resource {}".format(resource_id))
+
+        # The page only changes when the resource is validated again or
+        # its metadata is edited, so browsers can keep their copy
+        page_etag = page_cache.etag(
+            record, c.user, h.lang(), id,
+            _isoformat(resource_obj.metadata_modified),
+            _isoformat(resource_obj.package.metadata_modified))
+        if request.if_none_match.contains(page_etag):
+            return _not_modified(page_etag)
+
+        # The errors are fetched by the page from the API, a page at a time
         validation = get_action(u'resource_validation_show')(
             {u'user': c.user},
-            {u'resource_id': resource_id})
+            {u'resource_id': resource_id, u'summary_only': True})
 
         resource = get_action(u'resource_show')(
             {u'user': c.user},
@@ -43,12 +71,26 @@ def validation(resource_id, id=None):
         c.package = c.pkg_dict = dataset
         c.resource = resource
 
-        return render(u'validation/validation_read.html', extra_vars={
-            u'validation': validation,
-            u'resource': resource,
-            u'pkg_dict': dataset,
-            u'dataset': dataset,
-        })
+        # The same for every user, unlike the rest of the page
+        fragment_key = page_cache.etag(
+            record, h.lang(), resource.get(u'metadata_modified'))
+        report_section = page_cache.get_fragment(fragment_key)
+        if report_section is None:
+            report_section = render_snippet(
+                u'validation/snippets/validation_report_section.html',
+                validation=validation, resource=resource)
+            page_cache.set_fragment(fragment_key, report_section)
+
+        response = make_response(render(
+            u'validation/validation_read.html', extra_vars={
+                u'validation': validation,
+                u'resource': resource,
+                u'pkg_dict': dataset,
+                u'dataset': dataset,
+                u'report_section': h.literal(report_section),
+            }))
+        response.set_etag(page_etag)
+        return response
 
     except NotAuthorized:
         return abort(403, _(u'Unauthorized to read this validation report'))
@@ -56,6 +98,163 @@ def validation(resource_id, id=None):
         return abort(404, _(u'No validation report exists for this resource'))
 
 
+def _isoformat(value):
+    return value.isoformat() if value else None
+
+
+def _not_modified(etag):
+    response = Response(status=304)
+    response.set_etag(etag)
+    return response
+
+
+def validation_report(resource_id, id=None):
+    try:
+        check_access(u'resource_validation_show', {u'user': c.user},
+                     {u'resource_id': resource_id})
+
+        resource = get_action(u'resource_show')(
+            {u'user': c.user},
+            {u'id': resource_id})
+
+        if id and id != resource[u'package_id']:
+            raise ObjectNotFound("Resource {} not found in package {}".format(resource_id, id))
+
+        record = ValidationStatusHelper().getValidationJob(
+            model.Session, resource_id)
+        if not record:
+            raise ObjectNotFound("No validation report for resource {}".format(resource_id))
+
+    except NotAuthorized:
+        return abort(403, _(u'Unauthorized to read this validation report'))
+    except ObjectNotFound:
+        return abort(404, _(u'No validation report exists for this resource'))
+
+    # Reports never change once the validation is finished
+    report_etag = page_cache.etag(record)
+    if request.if_none_match.contains(report_etag):
+        return _not_modified(report_etag)
+
+    if record.report_path:
+        body = report_storage.iter_body(record.report_path)
+        try:
+            # Fail here rather than halfway through the response
+            first = next(body)
+        except StopIteration:
+            first = b''
+        except (IOError, OSError, ImportError) as e:
+            log.error(u'Could not read the report of resource %s: %s',
+                      resource_id, e)
+        else:
+            response = Response(
+                stream_with_context(itertools.chain([first], body)),
+                mimetype=u'application/json')
+            response.set_etag(report_etag)
+            return response
+
+    # Not offloaded, or only the summary is left, sent as stored
+    response = Response(
+        report_storage.load_text(record, summary=True) or u'null',
+        mimetype=u'application/json')
+    response.set_etag(report_etag)
+    return response
+
+
+def validation_show_api(ver=None):
+    # Handled by the API of CKAN, only the report is sent as stored
+    # instead of being parsed and serialized again
+    from ckan.views.api import action, API_DEFAULT_VERSION
+
+    setattr(g, RAW_REPORT_FLAG, True)
+    return action(u'resource_validation_show', ver or API_DEFAULT_VERSION)
+
+
+def validation_export(resource_id, format, id=None):
+    # Repeated parameters or a single one with a comma separated list
+    filters = dict((key, request.args.getlist(key))
+                   for key in (u'error_types', u'fields')
+                   if key in request.args)
+    filters = dict((key, value[0] if len(value) == 1 else value)
+                   for key, value in filters.items())
+    try:
+        check_access(u'resource_validation_export', {u'user': c.user},
+                     {u'resource_id': resource_id})
+
+        resource = model.Resource.get(resource_id)
+        if not resource or (id and id != resource.package_id):
+            raise ObjectNotFound("Resource {} not found in package {}".format(resource_id, id))
+        if not ValidationStatusHelper().getValidationStatus(
+                model.Session, resource_id):
+            raise ObjectNotFound("No validation report for resource {}".format(resource_id))
+
+        types = _list_param(filters, u'error_types')
+        fields = _list_param(filters, u'fields')
+    except NotAuthorized:
+        return abort(403, _(u'Unauthorized to read this validation report'))
+    except ObjectNotFound:
+        return abort(404, _(u'No validation report exists for this resource'))
+    except ValidationError:
+        return abort(400, _(u'Invalid error types or fields'))
+
+    if format not in export.available_formats():
+        return abort(404, _(u'Errors cannot be exported as {}').format(format))
+
+    errors = export.iter_errors(export.query_errors(
+        model.Session, resource_id, types, fields))
+    response = Response(stream_with_context(export.stream(errors, format)),
+                        mimetype=export.MIMETYPES[format])
+    response.headers[u'Content-Disposition'] = \
+        u'attachment; filename="validation-errors-{}.{}"'.format(
+            resource_id, format)
+    return response
+
+
+def validation_events(resource_id, id=None):
+    timeout = settings.get_status_events_timeout()
+    if not timeout:
+        return abort(404, _(u'Validation status events are disabled'))
+    try:
+        check_access(u'resource_validation_show', {u'user': c.user},
+                     {u'resource_id': resource_id})
+
+        resource = model.Resource.get(resource_id)
+        if not resource or (id and id != resource.package_id):
+            raise ObjectNotFound("Resource {} not found in package {}".format(resource_id, id))
+    except NotAuthorized:
+        return abort(403, _(u'Unauthorized to read this validation report'))
+    except ObjectNotFound:
+        return abort(404, _(u'Resource not found'))
+
+    pubsub = status_events.subscribe(resource_id)
+    current = status_events.status_event(
+        resource_id, ValidationStatusHelper().getValidationStatus(
+            model.Session, resource_id))
+
+    # Not streamed with the request context, so the database connection
+    # is given back while the client waits for the next status
+    response = Response(status_events.stream(pubsub, current, timeout),
+                        mimetype=u'text/event-stream')
+    request.environ[u'__no_cache__'] = True
+    # Sent as they come, not buffered by nginx
+    response.headers[u'X-Accel-Buffering'] = u'no'
+    return response
+
+
+def validation_stats():
+    filters = {column: request.args.get(column)
+               for column in (u'organization', u'format', u'status')
+               if request.args.get(column)}
+    try:
+        stats = get_action(u'validation_stats')({u'user': c.user}, filters)
+    except NotAuthorized:
+        return abort(403, _(u'Need to be system administrator to administer'))
+
+    return render(u'admin/validation_stats.html', extra_vars={
+        u'stats': stats,
+        u'filters': filters,
+    })
+
+
 ###############################################################################
 #                                     CLI                                     #
 ###############################################################################
@@ -110,6 +309,81 @@ def run_validation(assume_yes, resource_ids, dataset_ids, search_params):
         print(result['output'])
 
 
+def worker(queues, processes, max_jobs, max_memory, burst, size_class=None):
+    # Imported here, the web application has no use for the worker module
+    from ckanext.validation import worker as validation_worker
+
+    validation_worker.run(queues, processes=processes, max_jobs=max_jobs,
+                          max_memory=max_memory, burst=burst,
+                          size_class=size_class)
+
+
+def schedule(rate, burst):
+    from ckanext.validation import scheduler
+
+    try:
+        scheduler.run(rate=rate, burst=burst)
+    except ValueError as e:
+        error(str(e))
+
+
+def compress_reports(codec, batch_size):
+    from ckanext.validation import report_storage
+
+    try:
+        total = 0
+        for compressed in report_storage.compress_existing(
+                codec, batch_size=batch_size):
+            total += compressed
+            print(u'{} reports compressed'.format(total))
+    except (ValueError, ImportError) as e:
+        error(str(e))
+    print(u'Done, {} reports compressed'.format(total))
+
+
+def prune_history(batch_size):
+    from ckanext.validation import history
+
+    total = 0
+    for deleted in history.prune(batch_size=batch_size):
+        total += deleted
+        print(u'{} runs deleted'.format(total))
+    print(u'Done, {} runs deleted'.format(total))
+
+
+def refresh_stats():
+    from ckanext.validation import stats
+
+    total = stats.refresh()
+    print(u'Validation statistics refreshed, {} resources counted'.format(total))
+
+
+def flush_reindex():
+    from ckanext.validation import reindex
+
+    total = reindex.flush(everything=True)
+    counters = reindex.get_counters()
+    print(u'{} datasets reindexed'.format(total))
+    print(u'{reindexed} datasets reindexed after their validation, '
+          u'{avoided} reindexes avoided'.format(**counters))
+
+
+def benchmark_reports(sample, rounds):
+    from ckanext.validation import report_storage
+
+    results = report_storage.benchmark(sample, rounds)
+    if not results or not results[0]['reports']:
+        error('No validation reports to benchmark with')
+
+    print(u'{} reports, {} rounds each'.format(results[0]['reports'], rounds))
+    print(u'{:<8}{:>14}{:>14}{:>14}'.format(
+        u'Format', u'Size (KB)', u'Write (ms)', u'Read (ms)'))
+    for result in results:
+        print(u'{:<8}{:>14.1f}{:>14.2f}{:>14.2f}'.format(
+            result['format'], result['bytes'] / 1024.0,
+            result['write_ms'], result['read_ms']))
+
+
 def _run_validation_on_resource(resource_id, dataset_id):
 
     get_action(u'resource_validation_run')(
@@ -0,0 +1,27 @@
+# encoding: utf-8
+
+import sqlalchemy as sa
+
+# CKAN 2.9 ships SQLAlchemy 1.3, later versions 1.4 or 2.0
+SQLALCHEMY_1_3 = tuple(
+    int(part) for part in sa.__version__.split(u'.')[:2]) < (1, 4)
+
+
+def case(*whens, **kwargs):
+    u'''
+    Returns a CASE expression, with the `(condition, value)` tuples of
+    `whens` given as arguments as SQLAlchemy 1.4 and later take them.
+    '''
+    if SQLALCHEMY_1_3:
+        return sa.case(list(whens), **kwargs)
+    return sa.case(*whens, **kwargs)
+
+
+def scalar_subquery(query):
+    u'''
+    Returns a query or select as a scalar subquery, to be used as a
+    column or a value.
+    '''
+    if SQLALCHEMY_1_3:
+        return query.as_scalar()
+    return query.scalar_subquery()
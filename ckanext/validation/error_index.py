@@ -0,0 +1,168 @@
+# encoding: utf-8
+
+import logging
+
+import sqlalchemy as sa
+from frictionless import errors, system, FrictionlessException
+
+from ckanext.validation.model import ValidationReportError
+
+log = logging.getLogger(__name__)
+
+# Columns errors can be filtered and grouped by
+GROUP_BY_COLUMNS = (u'type', u'field', u'resource_id')
+
+# Rows sent to the database in each INSERT
+INSERT_BATCH_SIZE = 1000
+
+
+def rows_from_report(resource_id, report):
+    u'''
+    Returns a dict for each error of the tables of `report`, with the
+    columns of the `validation_error` table.
+    '''
+    rows = []
+    for index, task in enumerate((report or {}).get(u'tasks', [])):
+        for error in task.get(u'errors', []):
+            rows.append({
+                u'resource_id': resource_id,
+                u'type': error.get(u'type') or u'unknown',
+                # Frictionless sets an empty name when the field is unknown
+                u'field': error.get(u'fieldName') or None,
+                u'row_number': error.get(u'rowNumber'),
+                u'message': error.get(u'message'),
+                u'task': index,
+                u'field_number': error.get(u'fieldNumber'),
+                u'note': error.get(u'note'),
+                u'cell': error.get(u'cell', error.get(u'label')),
+                u'cells': error.get(u'cells', error.get(u'labels')),
+            })
+    return rows
+
+
+_error_classes = {}
+
+
+def _error_class(type):
+    if type not in _error_classes:
+        try:
+            _error_classes[type] = system.select_error_class(type)
+        except FrictionlessException:
+            # Errors of checks no longer installed
+            _error_classes[type] = errors.Error
+    return _error_classes[type]
+
+
+def report_error(error):
+    u'''
+    Returns a stored error as it was in the report, with the title,
+    description and tags of its type.
+    '''
+    Class = _error_class(error.type)
+    out = {
+        u'type': error.type,
+        u'title': Class.title,
+        u'description': Class.description,
+        u'tags': list(Class.tags),
+        u'message': error.message,
+        u'note': error.note,
+    }
+    if error.row_number is not None:
+        out[u'rowNumber'] = error.row_number
+    if error.field is not None:
+        out[u'fieldName'] = error.field
+    if error.field_number is not None:
+        out[u'fieldNumber'] = error.field_number
+    # Header errors have labels instead of cells
+    header = u'#header' in Class.tags
+    if error.cell is not None:
+        out[u'label' if header else u'cell'] = error.cell
+    if error.cells is not None:
+        out[u'labels' if header else u'cells'] = error.cells
+    return out
+
+
+def report_errors(query, offset=0, limit=None):
+    u'''
+    Returns the number of errors of `query`, and a page of them as they
+    were in the report, each with the index of the table it is in.
+    '''
+    count = query.count()
+    page = query.offset(offset).limit(limit).all()
+    # Errors stored before the table was recorded are all in the first
+    return count, [(error.task or 0, report_error(error)) for error in page]
+
+
+def delete_errors(session, resource_id):
+    session.query(ValidationReportError).filter(
+        ValidationReportError.resource_id == resource_id
+    ).delete(synchronize_session=False)
+
+
+def replace_errors(session, resource_id, report):
+    u'''
+    Replace the errors stored for a resource with the ones in `report`,
+    in bulk and in a single transaction.
+
+    Returns the number of errors stored.
+    '''
+    rows = rows_from_report(resource_id, report)
+    delete_errors(session, resource_id)
+    table = ValidationReportError.__table__
+    for start in range(0, len(rows), INSERT_BATCH_SIZE):
+        session.execute(table.insert(), rows[start:start + INSERT_BATCH_SIZE])
+    session.commit()
+    return len(rows)
+
+
+def _filtered(query, filters):
+    for column in GROUP_BY_COLUMNS:
+        value = filters.get(column)
+        if value:
+            query = query.filter(
+                getattr(ValidationReportError, column) == value)
+    return query
+
+
+def aggregate(session, group_by=(u'type',), filters=None, limit=20):
+    u'''
+    Count the stored errors, grouped by `group_by` columns and matching
+    the `filters` given for any of them.
+
+    Returns a list of dicts with the grouped columns, the number of errors
+    and of resources with them, the most common first.
+    '''
+    columns = [getattr(ValidationReportError, column) for column in group_by]
+    count = sa.func.count(ValidationReportError.id).label(u'count')
+    resources = sa.func.count(
+        sa.distinct(ValidationReportError.resource_id)).label(u'resources')
+
+    query = session.query(*(columns + [count, resources]))
+    query = _filtered(query, filters or {})
+    query = query.group_by(*columns).order_by(
+        count.desc(), *columns).limit(limit)
+
+    return [dict(zip(list(group_by) + [u'count', u'resources'], row))
+            for row in query]
+
+
+def search(session, filters=None, limit=100, offset=0):
+    u'''
+    Returns the number of stored errors matching the `filters`, and a
+    page of them ordered by resource and row.
+    '''
+    query = _filtered(session.query(ValidationReportError), filters or {})
+    count = query.count()
+    errors = query.order_by(
+        ValidationReportError.resource_id,
+        ValidationReportError.row_number,
+        ValidationReportError.id,
+    ).offset(offset).limit(limit).all()
+
+    return count, [{
+        u'resource_id': error.resource_id,
+        u'type': error.type,
+        u'field': error.field,
+        u'row_number': error.row_number,
+        u'message': error.message,
+    } for error in errors]
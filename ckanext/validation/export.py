@@ -0,0 +1,159 @@
+# encoding: utf-8
+
+import csv
+import io
+import json
+import logging
+
+from ckanext.validation.model import ValidationReportError
+
+log = logging.getLogger(__name__)
+
+FORMATS = (u'csv', u'ndjson', u'parquet')
+MIMETYPES = {
+    u'csv': u'text/csv',
+    u'ndjson': u'application/x-ndjson',
+    u'parquet': u'application/vnd.apache.parquet',
+}
+COLUMNS = (u'resource_id', u'type', u'field', u'row_number', u'message')
+
+# Errors read from the database, and written to the output, at a time
+BATCH_SIZE = 1000
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        return None
+    return pyarrow
+
+
+def available_formats():
+    return [_format for _format in FORMATS
+            if _format != u'parquet' or _pyarrow()]
+
+
+def query_errors(session, resource_id, types=None, fields=None):
+    u'''
+    Returns a query on the errors stored for the last validation of a
+    resource, of the `types` and in the `fields` given if any, in the
+    order they were reported.
+    '''
+    query = session.query(ValidationReportError).filter(
+        ValidationReportError.resource_id == resource_id)
+    if types:
+        query = query.filter(ValidationReportError.type.in_(types))
+    if fields:
+        query = query.filter(ValidationReportError.field.in_(fields))
+    return query.order_by(ValidationReportError.id)
+
+
+def iter_errors(query):
+    u'''
+    Yields a dict with the `COLUMNS` of each error of `query`, fetching
+    them from the database in batches.
+    '''
+    query = query.execution_options(stream_results=True)
+    for error in query.yield_per(BATCH_SIZE):
+        yield dict((column, getattr(error, column)) for column in COLUMNS)
+
+
+def stream(errors, export_format):
+    u'''
+    Yields the `errors` (dicts with the `COLUMNS`) encoded in
+    `export_format` as chunks of bytes, a batch of errors at a time, so
+    exports use the same memory however many errors there are.
+    '''
+    if export_format == u'csv':
+        return _stream_csv(errors)
+    if export_format == u'ndjson':
+        return _stream_ndjson(errors)
+    if export_format == u'parquet':
+        if _pyarrow() is None:
+            raise ImportError(
+                u'The pyarrow package is needed to export errors as '
+                u'Parquet, install it with '
+                u'`pip install ckanext-validation[parquet]`')
+        return _stream_parquet(errors)
+    raise ValueError(u'Unknown export format: {}'.format(export_format))
+
+
+def _batches(errors):
+    batch = []
+    for error in errors:
+        batch.append(error)
+        if len(batch) == BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _stream_csv(errors):
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, fieldnames=COLUMNS)
+    writer.writeheader()
+    for batch in _batches(errors):
+        writer.writerows(batch)
+        yield buf.getvalue().encode(u'utf-8')
+        buf.seek(0)
+        buf.truncate()
+    # Only the header if there are no errors
+    if buf.tell():
+        yield buf.getvalue().encode(u'utf-8')
+
+
+def _stream_ndjson(errors):
+    for batch in _batches(errors):
+        yield u''.join(json.dumps(error) + u'\n'
+                       for error in batch).encode(u'utf-8')
+
+
+class _Sink(object):
+    # Write-only file that keeps what was written until it is taken, for
+    # the Parquet writer
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _stream_parquet(errors):
+    pyarrow = _pyarrow()
+    schema = pyarrow.schema([
+        (u'resource_id', pyarrow.string()),
+        (u'type', pyarrow.string()),
+        (u'field', pyarrow.string()),
+        (u'row_number', pyarrow.int64()),
+        (u'message', pyarrow.string()),
+    ])
+    sink = _Sink()
+    writer = pyarrow.parquet.ParquetWriter(
+        pyarrow.PythonFile(sink, mode=u'w'), schema)
+    for batch in _batches(errors):
+        # Each batch is a row group, written out before the next is read
+        writer.write_table(pyarrow.Table.from_pylist(batch, schema=schema))
+        yield sink.take()
+    writer.close()
+    yield sink.take()
@@ -1,6 +1,7 @@
 # encoding: utf-8
 import json
 
+from flask import g, has_request_context
 from six.moves.urllib.parse import urlparse
 from six import string_types
 from ckantoolkit import url_for, _, config, asbool, literal, h
@@ -11,6 +12,7 @@ from ckanext.validation.utils import get_default_schema
 def get_helpers():
     validators = (
         get_validation_badge,
+        validation_prefetch_badges,
         validation_extract_report_from_errors,
         dump_json_value,
         bootstrap_version,
@@ -23,20 +25,20 @@ def get_helpers():
 
 def get_validation_badge(resource, in_listing=False):
 
-    afterDate = config.get('ckanext.validation.show_badges_after_last_modified_date', "")
-    if afterDate and (not resource.get('last_modified')
-                      or h.date_str_to_datetime(afterDate)
-                      >= h.date_str_to_datetime(resource['last_modified'])):
+    badges = _badges_cache()
+    after_date = badges[u'after_date']
+    if after_date and (not resource.get('last_modified')
+                       or after_date
+                       >= h.date_str_to_datetime(resource['last_modified'])):
         return ''
 
-    if in_listing and not asbool(
-            config.get('ckanext.validation.show_badges_in_listings', True)):
+    if in_listing and not badges[u'in_listings']:
         return ''
 
     if not resource.get('validation_status'):
         return ''
 
-    if not _get_schema_or_default_schema(resource):
+    if not _has_schema(resource):
         return ''
 
     statuses = {
@@ -72,17 +74,72 @@ def get_validation_badge(resource, in_listing=False):
         title=resource.get('validation_timestamp', ''))
 
 
-def _get_schema_or_default_schema(resource):
+def validation_prefetch_badges(pkg_dict):
+    u'''
+    Finds out which resources of a dataset have a schema in one go, with
+    the default schema of the dataset taken from `pkg_dict` rather than
+    from the database, so the badges of its resources are rendered
+    without looking it up for each of them. Meant to be called from
+    templates before listing the resources, it returns an empty string.
+    '''
+    badges = _badges_cache()
+    badges[u'default_schemas'][pkg_dict['id']] = _default_schema(pkg_dict)
+    for resource in pkg_dict.get('resources', []):
+        _has_schema(dict(resource, package_id=pkg_dict['id']))
+    return ''
+
+
+def _badges_cache():
+    # Kept for the current request, as badges are rendered for every
+    # resource of listings. A new one is returned outside requests
+    if has_request_context() and 'validation_badges' in g:
+        return g.validation_badges
+
+    after_date = config.get(
+        'ckanext.validation.show_badges_after_last_modified_date', "")
+    badges = {
+        u'after_date': h.date_str_to_datetime(after_date)
+        if after_date else None,
+        u'in_listings': asbool(
+            config.get('ckanext.validation.show_badges_in_listings', True)),
+        # Default schema by dataset id
+        u'default_schemas': {},
+        # Whether a schema string is a URL or a non empty schema
+        u'schemas': {},
+    }
+    if has_request_context():
+        g.validation_badges = badges
+    return badges
+
+
+def _default_schema(pkg_dict):
+    if pkg_dict.get(u'default_data_schema'):
+        return pkg_dict[u'default_data_schema']
+    for extra in pkg_dict.get(u'extras') or []:
+        if extra.get(u'key') == u'default_data_schema':
+            return extra.get(u'value')
+    return None
+
+
+def _has_schema(resource):
+    badges = _badges_cache()
 
     if asbool(resource.get('align_default_schema')):
-        schema = get_default_schema(resource['package_id'])
+        default_schemas = badges[u'default_schemas']
+        if resource['package_id'] not in default_schemas:
+            default_schemas[resource['package_id']] = get_default_schema(
+                resource['package_id'])
+        schema = default_schemas[resource['package_id']]
     else:
         schema = resource.get('schema')
 
-    if schema and isinstance(schema, string_types):
-        schema = schema if is_url_valid(schema) else json.loads(schema)
+    if not schema or not isinstance(schema, string_types):
+        return bool(schema)
 
-    return schema
+    schemas = badges[u'schemas']
+    if schema not in schemas:
+        schemas[schema] = bool(is_url_valid(schema) or json.loads(schema))
+    return schemas[schema]
 
 
 def validation_extract_report_from_errors(errors):
@@ -0,0 +1,139 @@
+# encoding: utf-8
+
+import datetime
+import hashlib
+import json
+import logging
+
+import sqlalchemy as sa
+from six import string_types
+
+from ckan import model
+
+from ckanext.validation import settings as s
+from ckanext.validation.model import ValidationRun
+
+log = logging.getLogger(__name__)
+
+
+def _report_counts(report):
+    rows = 0
+    errors = 0
+    for task in report.get(u'tasks', []):
+        stats = task.get(u'stats', {})
+        rows += stats.get(u'rows') or 0
+        errors += stats.get(u'errors', len(task.get(u'errors', [])))
+    seconds = report.get(u'stats', {}).get(u'seconds')
+    return rows, errors, seconds
+
+
+def new_run(validation, report=None, text=None):
+    u'''
+    Returns a ValidationRun with the outcome of the job of a Validation
+    record that just finished.
+
+    `report` can be a dict or its JSON text, `text` is the JSON text of
+    the report if already known, to avoid serializing it again.
+    '''
+    if isinstance(report, string_types):
+        text = text or report
+        report = json.loads(report)
+
+    run = ValidationRun(
+        resource_id=validation.resource_id,
+        status=validation.status,
+        created=validation.created,
+        finished=validation.finished,
+        retries=validation.retries or 0)
+    if report is not None:
+        run.rows, run.errors, run.seconds = _report_counts(report)
+        if text is None:
+            text = json.dumps(report)
+        run.digest = hashlib.sha256(text.encode(u'utf-8')).hexdigest()
+    return run
+
+
+def runs(session, resource_id, limit=20):
+    u'''
+    Returns the last runs of a resource, the most recent first.
+    '''
+    return session.query(ValidationRun).filter(
+        ValidationRun.resource_id == resource_id
+    ).order_by(
+        ValidationRun.finished.desc(), ValidationRun.id.desc()
+    ).limit(limit).all()
+
+
+def run_dictize(run):
+    return {
+        u'status': run.status,
+        u'created': run.created.isoformat(),
+        u'finished': run.finished.isoformat(),
+        u'seconds': run.seconds,
+        u'rows': run.rows,
+        u'errors': run.errors,
+        u'retries': run.retries,
+        u'digest': run.digest,
+    }
+
+
+def _expired_by_age(session, days, now, batch_size):
+    cutoff = now - datetime.timedelta(days=days)
+    return [run_id for run_id, in session.query(ValidationRun.id).filter(
+        ValidationRun.finished < cutoff).limit(batch_size)]
+
+
+def _expired_by_count(session, runs, batch_size):
+    # Only resources over the limit are looked at, each with its index
+    over = session.query(ValidationRun.resource_id).group_by(
+        ValidationRun.resource_id
+    ).having(sa.func.count(ValidationRun.id) > runs)
+
+    ids = []
+    for resource_id, in over:
+        ids.extend(run_id for run_id, in session.query(
+            ValidationRun.id
+        ).filter(
+            ValidationRun.resource_id == resource_id
+        ).order_by(
+            ValidationRun.finished.desc(), ValidationRun.id.desc()
+        ).offset(runs).limit(batch_size - len(ids)))
+        if len(ids) >= batch_size:
+            break
+    return ids
+
+
+def prune(runs=None, days=None, batch_size=1000, now=None):
+    u'''
+    Delete the runs beyond the last `runs` of each resource and the ones
+    finished more than `days` ago, with the retention from the settings
+    by default.
+
+    Runs are deleted by id, `batch_size` at a time, committing after
+    each batch so pruning never holds long locks. Only the history table
+    is touched, not the one with the current validation of each resource.
+
+    Yields the number of runs deleted in each batch.
+    '''
+    retention = s.get_history_retention()
+    runs = retention[u'runs'] if runs is None else runs
+    days = retention[u'days'] if days is None else days
+    now = now or datetime.datetime.utcnow()
+
+    session = model.Session
+    policies = []
+    if days:
+        policies.append(lambda: _expired_by_age(session, days, now, batch_size))
+    if runs:
+        policies.append(lambda: _expired_by_count(session, runs, batch_size))
+
+    for expired in policies:
+        while True:
+            ids = expired()
+            if not ids:
+                break
+            deleted = session.query(ValidationRun).filter(
+                ValidationRun.id.in_(ids)
+            ).delete(synchronize_session=False)
+            session.commit()
+            yield deleted
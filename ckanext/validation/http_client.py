@@ -0,0 +1,208 @@
+# encoding: utf-8
+
+import contextlib
+import logging
+import os
+import threading
+import time
+import uuid
+
+import requests
+from requests.adapters import HTTPAdapter
+from six.moves.urllib.parse import urlparse
+
+import ckantoolkit as tk
+
+from ckanext.validation import settings as s
+from ckanext.validation.validation_status_helper import (
+    REDIS_PREFIX, redis_connection)
+
+log = logging.getLogger(__name__)
+
+# How long a worker may wait for a free slot or a token for a host before
+# going ahead anyway, and how long a slot is held at most if the worker
+# holding it dies without releasing it.
+LIMIT_WAIT = 10 * 60
+SLOT_LEASE = 60 * 60
+
+# Sorted set of the slot holders of a host, scored by lease expiry
+_ACQUIRE_SLOT = u'''
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+if redis.call('ZCARD', KEYS[1]) < tonumber(ARGV[2]) then
+    redis.call('ZADD', KEYS[1], ARGV[1] + ARGV[4], ARGV[3])
+    redis.call('EXPIRE', KEYS[1], ARGV[4])
+    return 1
+end
+return 0
+'''
+
+# Token bucket of a host. The token is taken (reserved) even when not yet
+# available, returns the seconds to wait until it is
+_TAKE_TOKEN = u'''
+local now = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local burst = tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or burst
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate) - 1
+local wait = 0
+if tokens < 0 then
+    wait = -tokens / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+-- Kept until the bucket is full again, debt of reserved tokens included
+redis.call('EXPIRE', KEYS[1], math.ceil((burst - tokens) / rate) + 1)
+return tostring(wait)
+'''
+
+
+class HostLimiter(object):
+    u'''
+    Per host concurrency caps and rate limits, kept in Redis so they apply
+    to all the workers together and not to each of them.
+    '''
+
+    def __init__(self, redis_conn):
+        self.redis = redis_conn
+        self._acquire_slot = redis_conn.register_script(_ACQUIRE_SLOT)
+        self._take_token = redis_conn.register_script(_TAKE_TOKEN)
+
+    def _key(self, kind, host):
+        return u'{}http:{}:{}'.format(REDIS_PREFIX, kind, host)
+
+    @contextlib.contextmanager
+    def slot(self, host):
+        u'''
+        Hold one of the concurrent download slots of `host`.
+        '''
+        concurrency = s.get_http_host_limits(host)[u'concurrency']
+        if not concurrency:
+            yield
+            return
+
+        key = self._key(u'slots', host)
+        token = uuid.uuid4().hex
+        deadline = time.time() + LIMIT_WAIT
+        acquired = False
+        while not acquired:
+            acquired = self._acquire_slot(
+                keys=[key], args=[time.time(), concurrency, token, SLOT_LEASE])
+            if not acquired:
+                if time.time() > deadline:
+                    log.warning(u'No free download slot for %s after %ss, '
+                                u'going ahead', host, LIMIT_WAIT)
+                    break
+                time.sleep(1)
+        try:
+            yield
+        finally:
+            if acquired:
+                self.redis.zrem(key, token)
+
+    def throttle(self, host):
+        u'''
+        Wait until a request to `host` is allowed by its rate limit.
+        '''
+        limits = s.get_http_host_limits(host)
+        if not limits[u'rate']:
+            return
+
+        key = self._key(u'rate', host)
+        wait = float(self._take_token(
+            keys=[key], args=[time.time(), limits[u'rate'], limits[u'burst']]))
+        if wait:
+            log.debug(u'Rate limit for %s, waiting %.2fs', host, wait)
+            time.sleep(min(wait, LIMIT_WAIT))
+
+
+class PooledSession(requests.Session):
+    u'''
+    Session that waits for the rate limit of the target host before each
+    request.
+    '''
+
+    def request(self, method, url, *args, **kwargs):
+        host = get_host(url)
+        if host:
+            get_limiter().throttle(host)
+        return super(PooledSession, self).request(method, url, *args, **kwargs)
+
+
+_state = {}
+_lock = threading.Lock()
+
+
+def _build_session():
+    session = PooledSession()
+    pool_size = s.get_http_pool_size()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount(u'http://', adapter)
+    session.mount(u'https://', adapter)
+
+    proxy = tk.config.get(u'ckan.download_proxy')
+    if proxy:
+        log.debug(u'Download resources for validation via proxy: %s', proxy)
+        session.proxies.update({u'http': proxy, u'https': proxy})
+    return session
+
+
+def _get_process_state():
+    # Connection pools can't be shared with forked processes, start afresh
+    # when running in a new one
+    with _lock:
+        if _state.get(u'pid') != os.getpid():
+            _state.clear()
+            _state[u'pid'] = os.getpid()
+            _state[u'session'] = _build_session()
+        return _state
+
+
+def get_session(headers=None):
+    u'''
+    Returns the HTTP session shared by all downloads of this process, so
+    connections (and TLS sessions) to the same hosts are kept alive and
+    reused between jobs.
+
+    If `headers` are given, a session sending them is returned, still
+    using the shared connection pools.
+    '''
+    session = _get_process_state()[u'session']
+    if not headers:
+        return session
+
+    with_headers = PooledSession()
+    with_headers.adapters = session.adapters
+    with_headers.proxies = session.proxies.copy()
+    with_headers.headers.update(headers)
+    return with_headers
+
+
+def get_limiter():
+    state = _get_process_state()
+    if u'limiter' not in state:
+        state[u'limiter'] = HostLimiter(redis_connection())
+    return state[u'limiter']
+
+
+def get_host(source):
+    u'''
+    Returns the host name of an HTTP(S) URL, or None for anything else,
+    like a local path.
+    '''
+    try:
+        url = urlparse(source)
+    except (ValueError, AttributeError, TypeError):
+        return None
+    return url.hostname if url.scheme in (u'http', u'https') else None
+
+
+def host_slot(source):
+    u'''
+    Context manager holding a download slot for the host of `source` for
+    as long as it is being read. Local paths are not limited.
+    '''
+    host = get_host(source)
+    if not host:
+        return contextlib.nullcontext()
+    return get_limiter().slot(host)
@@ -1,30 +1,131 @@
 # encoding: utf-8
 
+import copy
 import logging
 import json
+import random
 import re
+import time
 
-import requests
 from frictionless import validate, system, Report, Schema, Dialect, Check
-from six import string_types
+from rq import Queue, Worker, get_current_job
+from rq.timeouts import JobTimeoutException
+from six import ensure_text, string_types
+from sqlalchemy.exc import SQLAlchemyError
 
 from ckan.model import Session
 import ckan.lib.uploader as uploader
 
 import ckantoolkit as t
 
-from . import utils
+from . import utils, prefetch, http_client, settings, error_index, reindex, writeback
 from ckanext.validation.validation_status_helper import (ValidationStatusHelper, ValidationJobDoesNotExist,
-                                                         ValidationJobAlreadyRunning, StatusTypes)
+                                                         ValidationJobAlreadyRunning, StatusTypes,
+                                                         ValidationJobCancelled, ValidationJobTimeout,
+                                                         ValidationJobNotPending)
 
 log = logging.getLogger(__name__)
 
 
+class SchemaCache(object):
+    u'''
+    Keeps remote schemas in memory so a long-lived validation worker does
+    not download the same schema for every resource that links to it.
+
+    The cache is disabled until `enable` is called, so web requests and
+    forked job processes always fetch a fresh copy.
+    '''
+
+    max_entries = 256
+
+    def __init__(self):
+        self.ttl = 0
+        self._entries = {}
+
+    def enable(self, ttl):
+        self.ttl = ttl
+        self._entries.clear()
+
+    def get(self, url):
+        if self.ttl:
+            entry = self._entries.get(url)
+            if entry and time.time() - entry[0] < self.ttl:
+                return copy.deepcopy(entry[1])
+
+        schema = http_client.get_session().get(url).json()
+
+        if self.ttl:
+            if len(self._entries) >= self.max_entries:
+                oldest = min(self._entries, key=lambda k: self._entries[k][0])
+                del self._entries[oldest]
+            self._entries[url] = (time.time(), copy.deepcopy(schema))
+        return schema
+
+
+schema_cache = SchemaCache()
+
+
+class JobBudget(object):
+    u'''
+    Wall clock and CPU time a validation job can use, and whether it
+    was cancelled.
+
+    `check` is called for every row validated and between retries, and
+    raises `ValidationJobTimeout` or `ValidationJobCancelled` so the job
+    stops cooperatively instead of being killed by the worker. The
+    cancellation flag is in Redis, so it is only looked up every
+    `cancel_interval` seconds.
+    '''
+
+    cancel_interval = 1.0
+
+    def __init__(self, resource_id, timeout=0, cpu_budget=0):
+        self.resource_id = resource_id
+        self.timeout = timeout
+        self.cpu_budget = cpu_budget
+        self.started = time.time()
+        self.cpu_started = time.thread_time()
+        self._cancel_checked = self.started
+
+    def check(self):
+        now = time.time()
+        if self.timeout and now - self.started > self.timeout:
+            raise ValidationJobTimeout(
+                u'Validation took longer than {}s'.format(self.timeout))
+        if self.cpu_budget and \
+                time.thread_time() - self.cpu_started > self.cpu_budget:
+            raise ValidationJobTimeout(
+                u'Validation used more than {}s of CPU time'.format(
+                    self.cpu_budget))
+        if now - self._cancel_checked >= self.cancel_interval:
+            self._cancel_checked = now
+            if ValidationStatusHelper().isCancelRequested(self.resource_id):
+                raise ValidationJobCancelled(u'Validation job was cancelled')
+
+    def as_check(self):
+        u'''
+        Returns a Frictionless check calling `check` on every row.
+        '''
+        check = BudgetCheck()
+        check.budget = self
+        return check
+
+
+class BudgetCheck(Check):
+    # Does not report any error, raises to stop the validation
+    type = u'validation-budget'
+    budget = None
+
+    def validate_row(self, row):
+        self.budget.check()
+        return iter([])
+
+
 def _ensure_report_dict(report):
     return report.to_dict() if isinstance(report, Report) else report
 
 
-def run_validation_job(resource):
+def run_validation_job(resource, size_class=None):
     vsh = ValidationStatusHelper()
     # handle either a resource dict or just an ID
     # ID is more efficient, as resource dicts can be very large
@@ -37,17 +138,21 @@ def run_validation_job(resource):
         log.debug(u'Validating resource: %s', resource_id)
     else:
         log.debug(u'Validating resource dict: %s', resource)
-    validation_record = None
+
+    if vsh.isCancelRequested(resource['id']):
+        log.info(u'Validation job for %s was cancelled, not running it', resource['id'])
+        vsh.clearCancelRequest(resource['id'])
+        return
+
     try:
-        validation_record = vsh.updateValidationJobStatus(Session, resource_id, StatusTypes.running)
+        vsh.updateValidationJobStatus(Session, resource_id, StatusTypes.running)
     except ValidationJobAlreadyRunning as e:
         log.error("Won't run enqueued job %s as job is already running or in invalid state: %s", resource['id'], e)
         return
     except ValidationJobDoesNotExist:
-        validation_record = vsh.createValidationJob(Session, resource['id'])
-        validation_record = vsh.updateValidationJobStatus(
-            session=Session, resource_id=resource_id,
-            status=StatusTypes.running, validationRecord=validation_record)
+        vsh.createValidationJob(Session, resource['id'])
+        vsh.updateValidationJobStatus(
+            session=Session, resource_id=resource_id, status=StatusTypes.running)
 
     options = utils.get_resource_validation_options(resource)
 
@@ -65,29 +170,43 @@ def run_validation_job(resource):
             pass_auth_header = t.asbool(
                 t.config.get(u'ckanext.validation.pass_auth_header', True))
             if dataset[u'private'] and pass_auth_header:
-                s = requests.Session()
-                s.headers.update({
+                options[u'http_session'] = http_client.get_session({
                     u'Authorization': t.config.get(
                         u'ckanext.validation.pass_auth_header_value',
                         utils.get_site_user_api_key())
                 })
 
-                options[u'http_session'] = s
-
+    spooled = None
     if not source:
         source = resource[u'url']
+        # Use the copy downloaded ahead by the worker's prefetcher, if any
+        if prefetch.is_running():
+            spooled = prefetch.take(resource_id, source)
+        if spooled:
+            log.debug(u'Using prefetched source: %s', spooled)
+            source = spooled
 
     schema = resource.get(u'schema')
     if schema and isinstance(schema, string_types):
         if schema.startswith('http'):
-            r = requests.get(schema)
-            schema = r.json()
+            schema = schema_cache.get(schema)
         else:
             schema = json.loads(schema)
 
     _format = resource[u'format'].lower()
 
-    report = _ensure_report_dict(validate_table(source, _format=_format, schema=schema, **options))
+    job_options = settings.get_job_options(size_class)
+    budget = JobBudget(resource['id'], job_options[u'timeout'],
+                       job_options[u'cpu_budget'])
+    try:
+        report, retries, cause = _validate_with_retries(
+            resource_id, source, _format, schema, options, budget)
+    except (ValidationJobCancelled, ValidationJobTimeout, JobTimeoutException) as e:
+        _stop_job(vsh, resource['id'], e)
+        return
+    finally:
+        if spooled:
+            prefetch.discard(spooled)
 
     if 'tasks' in report:
         for table in report['tasks']:
@@ -112,17 +231,178 @@ def run_validation_job(resource):
         else:
             error_payload = {'message': ['Errors validating the data']}
 
-    validation_record = vsh.updateValidationJobStatus(Session, resource['id'], status, json.dumps(report), error_payload, validation_record)
+    try:
+        validation_record = vsh.updateValidationJobStatus(Session, resource['id'], status, report, error_payload,
+                                                          retries=retries, cause=cause)
+    except ValidationJobNotPending as e:
+        # Eg cancelled while finishing, the result is not wanted anymore
+        log.warning(u'Discarding the validation result of %s: %s', resource['id'], e)
+        return
 
-    # Store result status in resource
-    t.get_action('resource_patch')(
-        {'ignore_auth': True,
-         'user': t.get_action('get_site_user')({'ignore_auth': True})['name'],
-         '_validation_performed': True},
-        {'id': resource['id'],
-         'validation_status': validation_record.status,
-         'validation_timestamp': validation_record.finished.isoformat()})
-    utils.send_validation_report(utils.validation_dictize(validation_record))
+    # Index the errors for querying across resources
+    try:
+        error_index.replace_errors(Session, resource['id'], report)
+    except SQLAlchemyError:
+        Session.rollback()
+        log.exception(u'Could not store the validation errors of %s', resource['id'])
+
+    # Store result status in resource, its dataset is reindexed together
+    # with the validations of its other resources finished meanwhile
+    writeback.write_status(resource['id'], validation_record.status, validation_record.finished)
+    # Datasets whose window is over are reindexed after every job, all the
+    # pending ones once the queues are drained
+    reindex.flush(everything=_queue_drained())
+    # The report in memory is sent, rather than parsing the stored one again
+    utils.send_validation_report(utils.validation_dictize(validation_record, report=report))
+
+
+def _in_background_job():
+    return get_current_job() is not None
+
+
+def _queue_drained():
+    # Once no more jobs are waiting there is nothing to coalesce pending
+    # reindexes with, so they are not left waiting for the next job
+    job = get_current_job()
+    if job is None:
+        return True
+    queue_names = [job.origin]
+    # All the queues of the worker running the job, on RQ versions that
+    # record it
+    worker_name = getattr(job, u'worker_name', None)
+    if worker_name:
+        queues = job.connection.hget(
+            Worker.redis_worker_namespace_prefix + worker_name, u'queues')
+        if queues:
+            queue_names = ensure_text(queues).split(u',')
+    return not any(Queue(name, connection=job.connection).count
+                   for name in queue_names)
+
+
+def _stop_job(vsh, resource_id, exception):
+    if isinstance(exception, ValidationJobCancelled):
+        status = StatusTypes.cancelled
+    else:
+        status = StatusTypes.timeout
+    log.warning(u'Validation of %s stopped (%s): %s', resource_id, status, exception)
+    vsh.clearCancelRequest(resource_id)
+    # The resource keeps the status of its last finished validation
+    try:
+        vsh.updateValidationJobStatus(
+            Session, resource_id, status, error={'message': [str(exception) or u'Validation job timed out']})
+    except ValidationJobNotPending as e:
+        log.warning(u'Could not mark the validation of %s as %s: %s', resource_id, status, e)
+
+
+# Failures reading a source that are likely to go away if tried again later
+TRANSIENT_CAUSES = (
+    (u'timeout', re.compile(r'timed? ?out', re.IGNORECASE)),
+    (u'server-error', re.compile(r'\b5\d\d (Server Error|Service Unavailable)', re.IGNORECASE)),
+    (u'rate-limited', re.compile(r'\b429 Client Error', re.IGNORECASE)),
+    (u'connection-error', re.compile(
+        r'connection (reset|aborted|refused)|remote ?(end closed|disconnected)',
+        re.IGNORECASE)),
+)
+
+
+def get_transient_cause(message):
+    u'''
+    Returns the kind of transient failure described by an error message,
+    or None if it does not look like one.
+    '''
+    for cause, pattern in TRANSIENT_CAUSES:
+        if pattern.search(message or u''):
+            return cause
+    return None
+
+
+def _report_transient_cause(report):
+    for task in report.get(u'tasks', []):
+        for error in task.get(u'errors', []):
+            if error.get(u'type') in (u'scheme-error', u'source-error'):
+                cause = get_transient_cause(
+                    u'{} {}'.format(error.get(u'note'), error.get(u'message')))
+                if cause:
+                    return cause
+    return None
+
+
+def _backoff_delay(retry, options):
+    # Exponential backoff, with jitter so workers that failed on the same
+    # host at the same time do not all come back together
+    delay = min(options[u'max_delay'], options[u'backoff'] * 2 ** (retry - 1))
+    return delay / 2.0 + random.uniform(0, delay / 2.0)
+
+
+def _validate_with_retries(resource_id, source, _format, schema, options, budget=None):
+    u'''
+    Validate `source`, trying again with exponential backoff while it can't
+    be read because of a transient failure, like a timeout, a server error
+    or a dropped connection.
+
+    Before a retry, remote sources are downloaded to the job's spool, so
+    later attempts validate the local copy and the remote server is only
+    hit once per attempt.
+
+    If a `budget` is given, it is checked while validating and before
+    and after waiting for a retry.
+
+    Returns the report, the number of retries and the last transient
+    failure seen, if any.
+
+    Sources are not retried outside of a background job, eg when
+    validating synchronously during a web request.
+    '''
+    retry_options = settings.get_retry_options()
+    if not _in_background_job():
+        retry_options[u'max'] = 0
+    timeout = settings.get_prefetch_options()[u'timeout']
+    http_session = options.get(u'http_session')
+    retries = 0
+    cause = None
+    spooled = None
+    try:
+        report = _validate_source(source, _format, schema, options, budget)
+        transient = _report_transient_cause(report)
+        while transient and retries < retry_options[u'max']:
+            cause = transient
+            retries += 1
+            delay = _backoff_delay(retries, retry_options)
+            log.warning(u'Transient failure (%s) reading %s, retry %s of %s in %.1fs',
+                        cause, source, retries, retry_options[u'max'], delay)
+            if budget:
+                budget.check()
+            time.sleep(delay)
+            if budget:
+                budget.check()
+
+            if http_client.get_host(source):
+                path = prefetch.spool_path(resource_id, source)
+                try:
+                    prefetch.download(source, path, timeout, session=http_session)
+                except Exception as e:
+                    transient = get_transient_cause(str(e))
+                    if transient:
+                        continue
+                    # Let the validation report the permanent failure
+                else:
+                    source = spooled = path
+
+            report = _validate_source(source, _format, schema, options, budget)
+            transient = _report_transient_cause(report)
+        if transient:
+            cause = transient
+    finally:
+        if spooled:
+            prefetch.discard(spooled)
+    return report, retries, cause
+
+
+def _validate_source(source, _format, schema, options, budget=None):
+    # validate_table consumes the options, keep them for any retry
+    with http_client.host_slot(source):
+        return _ensure_report_dict(validate_table(
+            source, _format=_format, schema=schema, budget=budget, **dict(options)))
 
 
 def contains_major_error(data):
@@ -151,16 +431,12 @@ def _report_has_encoding_error(report):
     return False
 
 
-def validate_table(source, _format=u'csv', schema=None, **options):
+def validate_table(source, _format=u'csv', schema=None, budget=None, **options):
 
     # This option is needed to allow Frictionless Framework to validate absolute paths
     frictionless_context = {'trusted': True}
-    http_session = options.pop('http_session', None) or requests.Session()
-
-    proxy = t.config.get('ckan.download_proxy', None)
-    if proxy is not None:
-        log.debug(u'Download resource for validation via proxy: %s', proxy)
-        http_session.proxies.update({'http': proxy, 'https': proxy})
+    # The shared session already has any `ckan.download_proxy` set
+    http_session = options.pop('http_session', None) or http_client.get_session()
 
     frictionless_context['http_session'] = http_session
     resource_schema = Schema.from_descriptor(schema) if schema else None
@@ -191,6 +467,9 @@ def validate_table(source, _format=u'csv', schema=None, **options):
         checklist = [Check.from_descriptor(c) for c in options['checks']]
         options['checks'] = checklist
 
+    if budget:
+        options['checks'] = options.get('checks', []) + [budget.as_check()]
+
     with system.use_context(**frictionless_context):
         log.debug(u'Validating source: %s', source)
         report = validate(source, format=_format, schema=resource_schema, **options)
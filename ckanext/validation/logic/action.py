@@ -1,16 +1,20 @@
 # encoding: utf-8
 
+import datetime
 import logging
 import json
 
 import ckantoolkit as tk
+import flask
 from six import string_types
 
 from ckanext.validation.jobs import run_validation_job
-from ckanext.validation import settings
+from ckanext.validation import (
+    settings, error_index, export, history, pipeline, summary, stats)
 from ckanext.validation.validation_status_helper import (
-    ValidationStatusHelper, ValidationJobAlreadyEnqueued)
-from ckanext.validation.utils import validation_dictize
+    ValidationStatusHelper, ValidationJobAlreadyEnqueued, ValidationJobNotPending,
+    StatusTypes, PENDING_WINDOW)
+from ckanext.validation.utils import validation_dictize, get_size_class
 
 log = logging.getLogger(__name__)
 
@@ -19,8 +23,17 @@ def get_actions():
     validators = (
         resource_validation_run,
         resource_validation_show,
+        resource_validation_show_many,
+        package_validation_summary,
         resource_validation_delete,
+        resource_validation_cancel,
+        resource_validation_history,
+        resource_validation_export,
+        resource_validation_deliveries,
         resource_validation_run_batch,
+        validation_errors_aggregate,
+        validation_errors_search,
+        validation_stats,
         package_patch,
         resource_show,
     )
@@ -89,12 +102,18 @@ def resource_validation_run(context, data_dict):
 
     if async_job:
         package_id = resource['package_id']
-        enqueue_validation_job(package_id, resource_id)
+        enqueue_validation_job(package_id, resource_id,
+                               size_class=get_size_class(resource))
     else:
         run_validation_job(resource)
 
 
-def enqueue_validation_job(package_id, resource_id):
+# Seconds a job can go over its `ckanext.validation.job.timeout` before
+# being killed by the worker
+JOB_TIMEOUT_GRACE = 60
+
+
+def enqueue_validation_job(package_id, resource_id, size_class=None):
     job_title = "run_validation_job: package_id: {} resource: {}".format(
         package_id, resource_id),
 
@@ -105,15 +124,24 @@ def enqueue_validation_job(package_id, resource_id):
             'resource': resource_id,
         }
     }
+    if size_class:
+        # Small sources are not held up behind large ones, each size class
+        # has its own queue, timeout and workers
+        enqueue_args['kwargs']['size_class'] = size_class
 
-    ttl = 24 * 60 * 60  # 24 hour ttl.
+    job_options = settings.get_job_options(size_class)
+    ttl = job_options['ttl']
     rq_kwargs = {
         'ttl': ttl, 'failure_ttl': ttl
     }
+    if job_options['timeout']:
+        # The job stops itself once over its budget, the worker only kills
+        # it if it does not get to do so
+        rq_kwargs['job_timeout'] = job_options['timeout'] + JOB_TIMEOUT_GRACE
     enqueue_args['rq_kwargs'] = rq_kwargs
 
     # Optional variable, if not set, default queue is used
-    queue = tk.config.get('ckanext.validation.queue', None)
+    queue = settings.get_queue_name(size_class)
 
     if queue:
         enqueue_args['queue'] = queue
@@ -136,9 +164,42 @@ def resource_validation_show(context, data_dict):
         could not be downloaded or there was an error reading it
     * `success`: Validation was performed, and no issues were found
     * `failure`: Validation was performed, and there were issues found
+    * `cancelled`: The validation job was cancelled before finishing
+    * `timeout`: The validation job took longer than allowed and was stopped
+
+    Large reports can be stored outside the database (see
+    `ckanext.validation.report.offload_size`), `report_offloaded` is then
+    true. Their full report is read unless only a summary, with the first
+    errors of each table, is asked for.
+
+    Through the API, the report is sent as stored, without parsing it
+    and serializing it again.
+
+    Errors can be paged through and filtered, the report then only has
+    the matching errors of the page asked for, in the order they were
+    reported, and `errors_count` is the number of errors matching. Pages
+    are read from the errors stored for the resource, not from its
+    report.
 
     :param resource_id: id of the resource to validate
     :type resource_id: string
+    :param summary: only return a summary of offloaded reports
+        (optional, default: ``False``)
+    :type summary: bool
+    :param summary_only: return the report without any errors, eg to show
+        its stats (optional, default: ``False``)
+    :type summary_only: bool
+    :param errors_offset: number of matching errors to skip
+        (optional, default: 0)
+    :type errors_offset: int
+    :param errors_limit: maximum number of errors returned (optional,
+        default: 1000, maximum: 1000)
+    :type errors_limit: int
+    :param error_types: only return errors of these types, eg
+        ``type-error`` (optional)
+    :type error_types: list of strings
+    :param fields: only return errors in these fields (optional)
+    :type fields: list of strings
 
     :rtype: dict
 
@@ -151,13 +212,210 @@ def resource_validation_show(context, data_dict):
 
     session = context['model'].Session
     validation = ValidationStatusHelper().getValidationJob(
-        session, data_dict['resource_id'])
+        session, data_dict['resource_id'], payload=True)
 
     if not validation:
         raise tk.ObjectNotFound(
             'No validation report exists for this resource')
 
-    return validation_dictize(validation)
+    summary = tk.asbool(data_dict.get(u'summary', False))
+    page = _errors_page(data_dict)
+    if page is None and not tk.asbool(data_dict.get(u'summary_only', False)):
+        return validation_dictize(validation, summary=summary,
+                                  raw=_raw_report(context))
+
+    # The summary of offloaded reports has all but their errors
+    out = validation_dictize(validation, summary=True)
+    if not out[u'report']:
+        if page is not None:
+            out[u'errors_count'] = 0
+        return out
+    tasks = out[u'report'][u'tasks'] = [
+        dict(task, errors=[]) for task in out[u'report'].get(u'tasks', [])]
+    if page is None:
+        return out
+
+    # Pages are read from the errors table, not from the report
+    query = export.query_errors(
+        session, validation.resource_id, page[u'types'], page[u'fields'])
+    out[u'errors_count'], errors = error_index.report_errors(
+        query, page[u'offset'], page[u'limit'])
+    for task, error in errors:
+        if task < len(tasks):
+            tasks[task][u'errors'].append(error)
+    return out
+
+
+# Set on `flask.g` by the API view of resource_validation_show only
+RAW_REPORT_FLAG = u'validation_raw_report'
+
+
+def _raw_report(context):
+    # Python callers, even with the context of an API call, get the report
+    # as a dict
+    if not context.get(u'api_version') or not flask.has_app_context():
+        return False
+    return bool(flask.g.pop(RAW_REPORT_FLAG, False))
+
+
+# Maximum number of errors of a report returned in a page
+MAX_ERRORS_LIMIT = 1000
+
+ERRORS_PAGE_PARAMS = (u'errors_offset', u'errors_limit', u'error_types', u'fields')
+
+
+def _errors_page(data_dict):
+    if not any(key in data_dict for key in ERRORS_PAGE_PARAMS):
+        return None
+    return {
+        u'offset': _int_param(data_dict, u'errors_offset', 0),
+        u'limit': _int_param(data_dict, u'errors_limit', MAX_ERRORS_LIMIT,
+                             maximum=MAX_ERRORS_LIMIT),
+        u'types': _list_param(data_dict, u'error_types'),
+        u'fields': _list_param(data_dict, u'fields'),
+    }
+
+
+# Maximum number of resources or packages asked for in a single call
+MAX_BULK_IDS = 1000
+
+
+def _list_param(data_dict, key):
+    value = data_dict.get(key)
+    if isinstance(value, string_types):
+        try:
+            decoded = json.loads(value)
+        except ValueError:
+            decoded = None
+        # Only a JSON list of strings, eg `2020` is a field name
+        if isinstance(decoded, list) and all(
+                isinstance(item, string_types) for item in decoded):
+            value = decoded
+        else:
+            value = value.split(u',')
+    elif value is not None and not isinstance(value, (list, tuple)):
+        raise tk.ValidationError({key: u'Must be a list of strings'})
+    if any(not isinstance(item, string_types) for item in value or []):
+        raise tk.ValidationError({key: u'Must be a list of strings'})
+    value = [item.strip() for item in value or [] if item and item.strip()]
+    if len(value) > MAX_BULK_IDS:
+        raise tk.ValidationError(
+            {key: u'No more than {} ids can be given'.format(MAX_BULK_IDS)})
+    return value
+
+
+def _readable_packages(context, package_ids):
+    u'''
+    Returns the ids of the packages the user can read, checking each
+    package once however many of its resources are asked for.
+    '''
+    readable = set()
+    for package_id in set(package_ids):
+        # The package is cached in the context by the auth functions
+        package_context = dict(context)
+        package_context.pop(u'package', None)
+        try:
+            tk.check_access(u'package_show', package_context, {u'id': package_id})
+        except (tk.NotAuthorized, tk.ObjectNotFound):
+            continue
+        readable.add(package_id)
+    return readable
+
+
+def resource_validation_show_many(context, data_dict):
+    u'''
+    Display the validation status of many resources at once, with a
+    single query and one authorization check per dataset.
+
+    Returns a dict with the resource ids as keys. Each value has the
+    status, timestamps, retries and number of errors found in the last
+    validation (`error_count`, only set once the validation is finished).
+    Resources that don't exist or that the user can't read are left out,
+    and resources never validated have a `null` status.
+
+    :param resource_ids: ids of the resources, up to 1000
+    :type resource_ids: list
+    :param include_report: include the validation report of each resource
+        (optional, default: ``False``)
+    :type include_report: bool
+
+    :rtype: dict
+
+    '''
+
+    tk.check_access(u'resource_validation_show_many', context, data_dict)
+
+    resource_ids = _list_param(data_dict, u'resource_ids')
+    if not resource_ids:
+        raise tk.ValidationError({u'resource_ids': u'Missing value'})
+    include_report = tk.asbool(data_dict.get(u'include_report', False))
+
+    rows = summary.validation_rows(resource_ids=resource_ids,
+                                   include_report=include_report)
+    readable = _readable_packages(context, [row.package_id for row in rows])
+
+    return {row.resource_id: summary.row_dictize(row, include_report)
+            for row in rows if row.package_id in readable}
+
+
+def package_validation_summary(context, data_dict):
+    u'''
+    Summarize the validation of the resources of a dataset, or of many
+    datasets at once, with a single query.
+
+    Each summary has the number of resources in each validation status
+    (`none` for resources never validated), the total number of errors
+    found and the status of each resource, as returned by
+    `resource_validation_show_many`.
+
+    With `id`, returns the summary of that dataset. With `ids`, returns
+    a dict with the dataset ids as keys, leaving out the datasets that
+    don't exist, that the user can't read or with no resources.
+
+    :param id: id or name of the dataset
+    :type id: string
+    :param ids: ids or names of the datasets, up to 1000
+    :type ids: list
+    :param include_report: include the validation report of each resource
+        (optional, default: ``False``)
+    :type include_report: bool
+
+    :rtype: dict
+
+    '''
+
+    tk.check_access(u'package_validation_summary', context, data_dict)
+
+    package_id = data_dict.get(u'id')
+    package_ids = [package_id] if package_id else _list_param(data_dict, u'ids')
+    if not package_ids:
+        raise tk.ValidationError({u'id': u'Missing value'})
+    include_report = tk.asbool(data_dict.get(u'include_report', False))
+
+    rows = summary.validation_rows(package_ids=package_ids,
+                                   include_report=include_report)
+    by_package = {}
+    for row in rows:
+        by_package.setdefault((row.package_id, row.package_name), []).append(row)
+
+    if package_id:
+        if not by_package:
+            # A dataset with no resources, if there is one
+            package = context['model'].Package.get(package_id)
+            if not package:
+                raise tk.ObjectNotFound(u'Dataset not found')
+            by_package[(package.id, package.name)] = []
+        (found_id, name), package_rows = list(by_package.items())[0]
+        tk.check_access(u'package_show', context, {u'id': found_id})
+        return summary.package_summary(found_id, name, package_rows,
+                                       include_report)
+
+    readable = _readable_packages(
+        context, [found_id for found_id, _name in by_package])
+    return {found_id: summary.package_summary(found_id, name, package_rows,
+                                              include_report)
+            for (found_id, name), package_rows in by_package.items()
+            if found_id in readable}
 
 
 def resource_validation_delete(context, data_dict):
@@ -188,6 +446,182 @@ def resource_validation_delete(context, data_dict):
     ValidationStatusHelper().deleteValidationJob(session, validation)
 
 
+def resource_validation_cancel(context, data_dict):
+    u'''
+    Cancel the validation job of a resource.
+
+    A job still in the queue is marked as `cancelled` straight away and
+    will not run. A running job is stopped by the worker shortly after,
+    and marked as `cancelled` then. A job running for longer than its
+    worker is expected to be alive (an hour) is marked as `cancelled`
+    straight away too.
+
+    :param resource_id: id of the resource to cancel the validation of
+    :type resource_id: string
+
+    :rtype: dict
+
+    '''
+
+    tk.check_access(u'resource_validation_cancel', context, data_dict)
+
+    if not data_dict.get(u'resource_id'):
+        raise tk.ValidationError({u'resource_id': u'Missing value'})
+
+    session = context['model'].Session
+    vsh = ValidationStatusHelper()
+    resource_id = data_dict['resource_id']
+    validation_status = vsh.getValidationStatus(session, resource_id)
+
+    if not validation_status:
+        raise tk.ObjectNotFound(
+            'No validation report exists for this resource')
+
+    if validation_status.status not in (StatusTypes.created,
+                                        StatusTypes.running):
+        raise tk.ValidationError({
+            u'status': u'Validation job is not queued or running: {}'.format(
+                validation_status.status)})
+
+    vsh.requestCancel(resource_id, settings.get_job_options()['ttl'])
+    live = validation_status.status == StatusTypes.running and \
+        validation_status.created > datetime.datetime.utcnow() - PENDING_WINDOW
+    if not live:
+        # Queued, or its worker died and nothing will read the request
+        try:
+            validation = vsh.updateValidationJobStatus(
+                session, resource_id, StatusTypes.cancelled,
+                error={'message': ['Validation job was cancelled']})
+        except ValidationJobNotPending as e:
+            # Finished in the meantime
+            raise tk.ValidationError({u'status': str(e)})
+    else:
+        validation = vsh.getValidationJob(session, resource_id)
+
+    return validation_dictize(validation)
+
+
+def resource_validation_history(context, data_dict):
+    u'''
+    List the past validation runs of a resource, the most recent first,
+    with their final status, timings, number of rows and errors and a
+    digest of the report, to follow how the data changes over time.
+
+    Runs are kept for a limited time, see `ckanext.validation.history.runs`
+    and `ckanext.validation.history.days`.
+
+    :param resource_id: id of the resource
+    :type resource_id: string
+    :param limit: maximum number of runs returned (optional,
+        default: 20, maximum: 1000)
+    :type limit: int
+
+    :rtype: list
+
+    '''
+
+    tk.check_access(u'resource_validation_history', context, data_dict)
+
+    if not data_dict.get(u'resource_id'):
+        raise tk.ValidationError({u'resource_id': u'Missing value'})
+
+    runs = history.runs(
+        context['model'].Session, data_dict['resource_id'],
+        limit=_int_param(data_dict, u'limit', 20, maximum=1000))
+
+    return [history.run_dictize(run) for run in runs]
+
+
+def resource_validation_export(context, data_dict):
+    u'''
+    Link to download the errors found in the last validation of a
+    resource, one per row, as CSV, NDJSON or Parquet.
+
+    The export is streamed from the `validation_error` table, so it can be
+    downloaded whatever the size of the report. It has the resource id,
+    error type, field, row number and message of each error, in the order
+    they were reported.
+
+    :param resource_id: id of the resource
+    :type resource_id: string
+    :param format: ``csv``, ``ndjson`` or ``parquet``, which needs the
+        ``pyarrow`` package (optional, default: ``csv``)
+    :type format: string
+    :param error_types: only export errors of these types, eg
+        ``type-error`` (optional)
+    :type error_types: list of strings
+    :param fields: only export errors in these fields (optional)
+    :type fields: list of strings
+
+    :returns: a dict with the ``url`` of the export, its ``format`` and
+        the number of errors in it (``count``)
+    :rtype: dict
+
+    '''
+
+    tk.check_access(u'resource_validation_export', context, data_dict)
+
+    resource_id = data_dict.get(u'resource_id')
+    if not resource_id:
+        raise tk.ValidationError({u'resource_id': u'Missing value'})
+
+    export_format = data_dict.get(u'format') or u'csv'
+    if export_format not in export.available_formats():
+        raise tk.ValidationError({u'format': u'Must be one of {}'.format(
+            u', '.join(export.available_formats()))})
+
+    session = context['model'].Session
+    resource = context['model'].Resource.get(resource_id)
+    if not resource or not ValidationStatusHelper().getValidationStatus(
+            session, resource_id):
+        raise tk.ObjectNotFound(
+            'No validation report exists for this resource')
+
+    filters = {
+        u'error_types': _list_param(data_dict, u'error_types'),
+        u'fields': _list_param(data_dict, u'fields'),
+    }
+    count = export.query_errors(
+        session, resource_id, filters[u'error_types'], filters[u'fields']
+    ).count()
+
+    return {
+        u'url': tk.url_for(
+            u'validation.export', id=resource.package_id,
+            resource_id=resource_id, format=export_format, _external=True,
+            **dict((key, value) for key, value in filters.items() if value)),
+        u'format': export_format,
+        u'count': count,
+    }
+
+
+def resource_validation_deliveries(context, data_dict):
+    u'''
+    Show whether the report of the last validation of a resource was
+    delivered to each of the `IPipeValidation` observers.
+
+    The status of each observer can be `queued`, `delivered`, `failed`
+    (with the error raised) or `superseded`, if the resource was
+    validated again before the report was delivered. It is kept for
+    `ckanext.validation.job.ttl` seconds.
+
+    Only sysadmins are allowed to run this action.
+
+    :param resource_id: id of the resource
+    :type resource_id: string
+
+    :rtype: list
+
+    '''
+
+    tk.check_access(u'resource_validation_deliveries', context, data_dict)
+
+    if not data_dict.get(u'resource_id'):
+        raise tk.ValidationError({u'resource_id': u'Missing value'})
+
+    return pipeline.get_statuses(data_dict[u'resource_id'])
+
+
 def resource_validation_run_batch(context, data_dict):
     u'''
     Start asynchronous data validation on the site resources. If no
@@ -307,6 +741,145 @@ def resource_validation_run_batch(context, data_dict):
     return {'output': msg}
 
 
+def _error_filters(data_dict):
+    return {column: data_dict.get(column)
+            for column in error_index.GROUP_BY_COLUMNS
+            if data_dict.get(column)}
+
+
+def _int_param(data_dict, key, default, maximum=None):
+    try:
+        value = int(data_dict.get(key, default))
+    except (TypeError, ValueError):
+        raise tk.ValidationError({key: u'Must be an integer'})
+    if value < 0:
+        raise tk.ValidationError({key: u'Must be a positive integer'})
+    return min(value, maximum) if maximum else value
+
+
+def validation_errors_aggregate(context, data_dict):
+    u'''
+    Count the errors found in the last validation of all resources,
+    grouped by error type, field and/or resource. Counting is done by the
+    database on the `validation_error` table, reports are not read.
+
+    Only sysadmins are allowed to run this action.
+
+    Examples::
+
+       curl -X POST http://localhost:5001/api/action/validation_errors_aggregate \
+            -d '{"group_by": ["type", "field"], "type": "type-error"}' \
+            -H Content-type:application/json \
+            -H Authorization:API_KEY
+
+    :param group_by: columns to group the errors by, any of ``type``,
+        ``field`` and ``resource_id`` (optional, default: ``type``)
+    :type group_by: string or list
+    :param type: only count errors of this type (optional)
+    :type type: string
+    :param field: only count errors in fields with this name (optional)
+    :type field: string
+    :param resource_id: only count errors of this resource (optional)
+    :type resource_id: string
+    :param limit: maximum number of groups returned (optional,
+        default: 20)
+    :type limit: int
+
+    :returns: a list of dicts with the grouped columns, the number of
+        errors (``count``) and of resources with them (``resources``),
+        the most common first
+    :rtype: list
+
+    '''
+
+    tk.check_access(u'validation_errors_aggregate', context, data_dict)
+
+    group_by = data_dict.get(u'group_by') or [u'type']
+    if isinstance(group_by, string_types):
+        group_by = [column.strip() for column in group_by.split(u',')]
+    invalid = [column for column in group_by
+               if column not in error_index.GROUP_BY_COLUMNS]
+    if invalid:
+        raise tk.ValidationError({u'group_by': u'Unknown columns: {}'.format(
+            u', '.join(invalid))})
+
+    return error_index.aggregate(
+        context['model'].Session, group_by, _error_filters(data_dict),
+        limit=_int_param(data_dict, u'limit', 20))
+
+
+def validation_errors_search(context, data_dict):
+    u'''
+    List the errors found in the last validation of all resources, from
+    the `validation_error` table, filtered by error type, field and/or
+    resource.
+
+    Only sysadmins are allowed to run this action.
+
+    :param type: only list errors of this type (optional)
+    :type type: string
+    :param field: only list errors in fields with this name (optional)
+    :type field: string
+    :param resource_id: only list errors of this resource (optional)
+    :type resource_id: string
+    :param limit: maximum number of errors returned (optional,
+        default: 100, maximum: 1000)
+    :type limit: int
+    :param offset: number of errors to skip (optional, default: 0)
+    :type offset: int
+
+    :returns: a dict with the number of matching errors (``count``) and
+        a page of them (``results``), ordered by resource and row
+    :rtype: dict
+
+    '''
+
+    tk.check_access(u'validation_errors_search', context, data_dict)
+
+    count, results = error_index.search(
+        context['model'].Session, _error_filters(data_dict),
+        limit=_int_param(data_dict, u'limit', 100, maximum=1000),
+        offset=_int_param(data_dict, u'offset', 0))
+
+    return {u'count': count, u'results': results}
+
+
+def validation_stats(context, data_dict):
+    u'''
+    Number of resources of the supported formats in each validation
+    status, by organization and format, with their total size.
+
+    The statistics are read from the `validation_stats` table, which is
+    rebuilt by the `validation refresh-stats` command, so they are as
+    recent as its last run (``last_updated``).
+
+    Only sysadmins are allowed to run this action.
+
+    :param organization: only return the statistics of this organization
+        name, an empty name is used for datasets without one (optional)
+    :type organization: string
+    :param format: only return the statistics of this format (optional)
+    :type format: string
+    :param status: only return the statistics of this status, ``none``
+        for resources never validated (optional)
+    :type status: string
+
+    :returns: a dict with the statistics (``stats``), the number of
+        resources by status (``totals``) and when they were refreshed
+        (``last_updated``)
+    :rtype: dict
+
+    '''
+
+    tk.check_access(u'validation_stats', context, data_dict)
+
+    filters = {column: data_dict.get(column) for column in stats.FILTER_COLUMNS
+               if data_dict.get(column)}
+    if filters.get(u'format'):
+        filters[u'format'] = filters[u'format'].lower()
+    return stats.get_stats(filters)
+
+
 def _search_datasets(page=1,
                      page_size=100,
                      dataset_ids=None,
@@ -5,8 +5,17 @@ def get_auth_functions():
     validators = (
         resource_validation_run,
         resource_validation_delete,
+        resource_validation_cancel,
         resource_validation_show,
+        resource_validation_show_many,
+        package_validation_summary,
+        resource_validation_history,
+        resource_validation_export,
+        resource_validation_deliveries,
         resource_validation_run_batch,
+        validation_errors_aggregate,
+        validation_errors_search,
+        validation_stats,
     )
 
     return {"{}".format(func.__name__): func for func in validators}
@@ -26,6 +35,13 @@ def resource_validation_delete(context, data_dict):
     return {u'success': False}
 
 
+def resource_validation_cancel(context, data_dict):
+    if tk.check_access(u'resource_update', context,
+                       {u'id': data_dict[u'resource_id']}):
+        return {u'success': True}
+    return {u'success': False}
+
+
 @tk.auth_allow_anonymous_access
 def resource_validation_show(context, data_dict):
     if tk.check_access(u'resource_show', context,
@@ -34,6 +50,54 @@ def resource_validation_show(context, data_dict):
     return {u'success': False}
 
 
+@tk.auth_allow_anonymous_access
+def resource_validation_show_many(context, data_dict):
+    u'''Access to each dataset is checked by the action'''
+    return {u'success': True}
+
+
+@tk.auth_allow_anonymous_access
+def package_validation_summary(context, data_dict):
+    u'''Access to each dataset is checked by the action'''
+    return {u'success': True}
+
+
+@tk.auth_allow_anonymous_access
+def resource_validation_history(context, data_dict):
+    if tk.check_access(u'resource_show', context,
+                       {u'id': data_dict[u'resource_id']}):
+        return {u'success': True}
+    return {u'success': False}
+
+
+@tk.auth_allow_anonymous_access
+def resource_validation_export(context, data_dict):
+    if tk.check_access(u'resource_show', context,
+                       {u'id': data_dict[u'resource_id']}):
+        return {u'success': True}
+    return {u'success': False}
+
+
+def resource_validation_deliveries(context, data_dict):
+    '''u Sysadmins only'''
+    return {u'success': False}
+
+
 def resource_validation_run_batch(context, data_dict):
     '''u Sysadmins only'''
     return {u'success': False}
+
+
+def validation_errors_aggregate(context, data_dict):
+    '''u Sysadmins only'''
+    return {u'success': False}
+
+
+def validation_errors_search(context, data_dict):
+    '''u Sysadmins only'''
+    return {u'success': False}
+
+
+def validation_stats(context, data_dict):
+    '''u Sysadmins only'''
+    return {u'success': False}
@@ -0,0 +1,38 @@
+"""Create validation table
+
+Revision ID: 01a6b058cb7f
+Revises:
+Create Date: 2026-10-19 09:12:44.118352
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import JSON
+
+# revision identifiers, used by Alembic.
+revision = '01a6b058cb7f'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Sites set up before migrations existed created the table with the
+    # `validation init-db` command
+    if 'validation' in sa.inspect(op.get_bind()).get_table_names():
+        return
+
+    op.create_table(
+        'validation',
+        sa.Column('id', sa.Unicode, primary_key=True),
+        sa.Column('resource_id', sa.Unicode, nullable=False),
+        sa.Column('status', sa.Unicode, nullable=False),
+        sa.Column('created', sa.DateTime, nullable=False),
+        sa.Column('finished', sa.DateTime, nullable=True),
+        sa.Column('report', JSON, nullable=True),
+        sa.Column('error', JSON, nullable=True),
+    )
+
+
+def downgrade():
+    op.drop_table('validation')
@@ -0,0 +1,34 @@
+"""Add retries and cause to validation
+
+Revision ID: 4c1fd6ee2b30
+Revises: 01a6b058cb7f
+Create Date: 2026-10-19 09:40:02.570814
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '4c1fd6ee2b30'
+down_revision = '01a6b058cb7f'
+branch_labels = None
+depends_on = None
+
+
+def _columns():
+    return [c['name'] for c in sa.inspect(op.get_bind()).get_columns('validation')]
+
+
+def upgrade():
+    columns = _columns()
+    if 'retries' not in columns:
+        op.add_column('validation', sa.Column(
+            'retries', sa.Integer, nullable=False, server_default='0'))
+    if 'cause' not in columns:
+        op.add_column('validation', sa.Column(
+            'cause', sa.Unicode, nullable=True))
+
+
+def downgrade():
+    op.drop_column('validation', 'cause')
+    op.drop_column('validation', 'retries')
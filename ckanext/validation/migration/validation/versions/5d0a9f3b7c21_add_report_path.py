@@ -0,0 +1,29 @@
+"""Add offloaded report path to validation
+
+Revision ID: 5d0a9f3b7c21
+Revises: c3f81a2d6e94
+Create Date: 2026-10-19 13:05:51.940263
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '5d0a9f3b7c21'
+down_revision = 'c3f81a2d6e94'
+branch_labels = None
+depends_on = None
+
+
+def _columns():
+    return [c['name'] for c in sa.inspect(op.get_bind()).get_columns('validation')]
+
+
+def upgrade():
+    if 'report_path' not in _columns():
+        op.add_column('validation', sa.Column(
+            'report_path', sa.Unicode, nullable=True))
+
+
+def downgrade():
+    op.drop_column('validation', 'report_path')
@@ -0,0 +1,50 @@
+"""Add validation indexes and one record per resource
+
+Revision ID: 9b2e7c4d1a53
+Revises: 4c1fd6ee2b30
+Create Date: 2026-10-19 11:02:47.183920
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '9b2e7c4d1a53'
+down_revision = '4c1fd6ee2b30'
+branch_labels = None
+depends_on = None
+
+
+def _indexes():
+    inspector = sa.inspect(op.get_bind())
+    return [i['name'] for i in inspector.get_indexes('validation')] + \
+        [c['name'] for c in inspector.get_unique_constraints('validation')]
+
+
+def upgrade():
+    # Older versions could leave several records for the same resource,
+    # keep only the most recent one
+    op.execute('''
+        DELETE FROM validation AS older
+        USING validation AS newer
+        WHERE older.resource_id = newer.resource_id
+        AND (older.created < newer.created
+             OR (older.created = newer.created AND older.id < newer.id))
+    ''')
+
+    existing = _indexes()
+    if 'uq_validation_resource_id' not in existing:
+        op.create_unique_constraint(
+            'uq_validation_resource_id', 'validation', ['resource_id'])
+    if 'idx_validation_resource_id_created' not in existing:
+        op.create_index(
+            'idx_validation_resource_id_created', 'validation',
+            ['resource_id', sa.text('created DESC')])
+    if 'idx_validation_status' not in existing:
+        op.create_index('idx_validation_status', 'validation', ['status'])
+
+
+def downgrade():
+    op.drop_index('idx_validation_status', 'validation')
+    op.drop_index('idx_validation_resource_id_created', 'validation')
+    op.drop_constraint('uq_validation_resource_id', 'validation')
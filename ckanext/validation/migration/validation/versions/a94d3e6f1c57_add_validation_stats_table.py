@@ -0,0 +1,33 @@
+"""Add validation_stats table
+
+Revision ID: a94d3e6f1c57
+Revises: f2a7c19e4b80
+Create Date: 2026-10-19 16:48:20.361905
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'a94d3e6f1c57'
+down_revision = 'f2a7c19e4b80'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if 'validation_stats' in sa.inspect(op.get_bind()).get_table_names():
+        return
+    op.create_table(
+        'validation_stats',
+        sa.Column('organization', sa.Unicode, primary_key=True),
+        sa.Column('format', sa.Unicode, primary_key=True),
+        sa.Column('status', sa.Unicode, primary_key=True),
+        sa.Column('count', sa.Integer, nullable=False, server_default='0'),
+        sa.Column('bytes', sa.BigInteger, nullable=False, server_default='0'),
+        sa.Column('last_updated', sa.DateTime, nullable=False),
+    )
+
+
+def downgrade():
+    op.drop_table('validation_stats')
@@ -0,0 +1,48 @@
+"""Add error details to validation_error
+
+Revision ID: b5e2d8f4a610
+Revises: a94d3e6f1c57
+Create Date: 2026-10-19 18:12:44.903127
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import JSON
+
+# revision identifiers, used by Alembic.
+revision = 'b5e2d8f4a610'
+down_revision = 'a94d3e6f1c57'
+branch_labels = None
+depends_on = None
+
+
+def _columns():
+    return [c['name'] for c in
+            sa.inspect(op.get_bind()).get_columns('validation_error')]
+
+
+def upgrade():
+    columns = _columns()
+    if 'task' not in columns:
+        op.add_column('validation_error', sa.Column(
+            'task', sa.Integer, nullable=True))
+    if 'field_number' not in columns:
+        op.add_column('validation_error', sa.Column(
+            'field_number', sa.Integer, nullable=True))
+    if 'note' not in columns:
+        op.add_column('validation_error', sa.Column(
+            'note', sa.UnicodeText, nullable=True))
+    if 'cell' not in columns:
+        op.add_column('validation_error', sa.Column(
+            'cell', sa.UnicodeText, nullable=True))
+    if 'cells' not in columns:
+        op.add_column('validation_error', sa.Column(
+            'cells', JSON, nullable=True))
+
+
+def downgrade():
+    op.drop_column('validation_error', 'cells')
+    op.drop_column('validation_error', 'cell')
+    op.drop_column('validation_error', 'note')
+    op.drop_column('validation_error', 'field_number')
+    op.drop_column('validation_error', 'task')
@@ -0,0 +1,29 @@
+"""Add compressed report data to validation
+
+Revision ID: c3f81a2d6e94
+Revises: 9b2e7c4d1a53
+Create Date: 2026-10-19 12:14:36.502117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'c3f81a2d6e94'
+down_revision = '9b2e7c4d1a53'
+branch_labels = None
+depends_on = None
+
+
+def _columns():
+    return [c['name'] for c in sa.inspect(op.get_bind()).get_columns('validation')]
+
+
+def upgrade():
+    if 'report_data' not in _columns():
+        op.add_column('validation', sa.Column(
+            'report_data', sa.LargeBinary, nullable=True))
+
+
+def downgrade():
+    op.drop_column('validation', 'report_data')
@@ -0,0 +1,37 @@
+"""Add validation_error table
+
+Revision ID: e8b14c7a9d02
+Revises: 5d0a9f3b7c21
+Create Date: 2026-10-19 14:21:37.118604
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'e8b14c7a9d02'
+down_revision = '5d0a9f3b7c21'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if 'validation_error' in sa.inspect(op.get_bind()).get_table_names():
+        return
+    op.create_table(
+        'validation_error',
+        sa.Column('id', sa.Integer, primary_key=True, autoincrement=True),
+        sa.Column('resource_id', sa.Unicode, nullable=False),
+        sa.Column('type', sa.Unicode, nullable=False),
+        sa.Column('field', sa.Unicode, nullable=True),
+        sa.Column('row_number', sa.Integer, nullable=True),
+        sa.Column('message', sa.UnicodeText, nullable=True),
+    )
+    op.create_index('idx_validation_error_resource_id', 'validation_error',
+                    ['resource_id'])
+    op.create_index('idx_validation_error_type_field', 'validation_error',
+                    ['type', 'field'])
+
+
+def downgrade():
+    op.drop_table('validation_error')
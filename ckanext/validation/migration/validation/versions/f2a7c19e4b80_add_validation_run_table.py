@@ -0,0 +1,42 @@
+"""Add validation_run history table
+
+Revision ID: f2a7c19e4b80
+Revises: e8b14c7a9d02
+Create Date: 2026-10-19 15:02:11.407215
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'f2a7c19e4b80'
+down_revision = 'e8b14c7a9d02'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if 'validation_run' in sa.inspect(op.get_bind()).get_table_names():
+        return
+    op.create_table(
+        'validation_run',
+        sa.Column('id', sa.Integer, primary_key=True, autoincrement=True),
+        sa.Column('resource_id', sa.Unicode, nullable=False),
+        sa.Column('status', sa.Unicode, nullable=False),
+        sa.Column('created', sa.DateTime, nullable=False),
+        sa.Column('finished', sa.DateTime, nullable=False),
+        sa.Column('seconds', sa.Float, nullable=True),
+        sa.Column('rows', sa.Integer, nullable=True),
+        sa.Column('errors', sa.Integer, nullable=True),
+        sa.Column('retries', sa.Integer, nullable=False, server_default='0'),
+        sa.Column('digest', sa.Unicode, nullable=True),
+    )
+    op.create_index('idx_validation_run_resource_id_finished',
+                    'validation_run',
+                    ['resource_id', sa.text('finished DESC')])
+    op.create_index('idx_validation_run_finished', 'validation_run',
+                    ['finished'])
+
+
+def downgrade():
+    op.drop_table('validation_run')
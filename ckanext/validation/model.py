@@ -2,8 +2,10 @@
 import datetime
 import logging
 
-from sqlalchemy import Column, Unicode, DateTime
+from sqlalchemy import (Column, Unicode, UnicodeText, DateTime, Integer, BigInteger, Float, Index,
+                        UniqueConstraint, LargeBinary)
 from sqlalchemy.dialects.postgresql import JSON
+from sqlalchemy.orm import deferred
 
 from ckan import model
 from ckan.model import types as _types
@@ -22,6 +24,10 @@ log = logging.getLogger(__name__)
 
 class Validation(Base):
     __tablename__ = u'validation'
+    # A resource has a single validation record, reset on each new job
+    __table_args__ = (
+        UniqueConstraint('resource_id', name='uq_validation_resource_id'),
+    )
 
     id = Column('id', Unicode, primary_key=True, default=_types.make_uuid)
     resource_id = Column('resource_id', Unicode, nullable=False)
@@ -31,15 +37,106 @@ class Validation(Base):
     #     success: Validation Successful and report attached
     #     failure: Validation Failed and report attached
     #     error: Validation Job could not create validation report
+    #     cancelled: Validation Job was cancelled before finishing
+    #     timeout: Validation Job went over its time budget
     status = Column('status', Unicode, default=u'created', nullable=False)
     # created is when job was added
     created = Column('created', DateTime, default=datetime.datetime.utcnow, nullable=False)
     # finished is when report was generated, is None when new or restarted
     finished = Column('finished', DateTime, nullable=True)
     # json object of report, can be None
-    report = Column('report', JSON, nullable=True)
+    # report and error can be large, they are only loaded when accessed,
+    # or with the `payload` group undeferred
+    report = deferred(Column('report', JSON, nullable=True), group='payload')
+    # report compressed with gzip or zstd, used instead of report when set
+    report_data = deferred(Column('report_data', LargeBinary, nullable=True), group='payload')
+    # path of the file with the full report, relative to the offload path,
+    # when too large to be kept here. report is then a summary of it
+    report_path = Column('report_path', Unicode, nullable=True)
     # json object of error, can be None
-    error = Column('error', JSON, nullable=True)
+    error = deferred(Column('error', JSON, nullable=True), group='payload')
+    # times the source was retried after a transient failure reading it
+    retries = Column('retries', Integer, default=0, server_default='0', nullable=False)
+    # last transient failure seen (eg timeout, server-error), can be None
+    cause = Column('cause', Unicode, nullable=True)
+
+
+Index('idx_validation_resource_id_created',
+      Validation.resource_id, Validation.created.desc())
+Index('idx_validation_status', Validation.status)
+
+
+class ValidationReportError(Base):
+    # One row per error in the last report of each resource, so errors can
+    # be queried across resources without reading the reports
+    __tablename__ = u'validation_error'
+
+    id = Column('id', Integer, primary_key=True, autoincrement=True)
+    resource_id = Column('resource_id', Unicode, nullable=False)
+    # Frictionless error type, eg type-error, blank-row
+    type = Column('type', Unicode, nullable=False)
+    # name of the field the error is in, None for row or table errors
+    field = Column('field', Unicode, nullable=True)
+    # number of the row the error is in, None for table errors
+    row_number = Column('row_number', Integer, nullable=True)
+    message = Column('message', UnicodeText, nullable=True)
+    # index of the table of the report the error is in, None for errors
+    # stored before it was recorded
+    task = Column('task', Integer, nullable=True)
+    field_number = Column('field_number', Integer, nullable=True)
+    note = Column('note', UnicodeText, nullable=True)
+    # value of the cell, or of the label of header errors, with the error
+    cell = Column('cell', UnicodeText, nullable=True)
+    # cells of the row, or labels of the header, with the error
+    cells = Column('cells', JSON, nullable=True)
+
+
+Index('idx_validation_error_resource_id', ValidationReportError.resource_id)
+Index('idx_validation_error_type_field',
+      ValidationReportError.type, ValidationReportError.field)
+
+
+class ValidationRun(Base):
+    # One row per finished validation job, kept after the Validation record
+    # is reset for the next one. Old rows are pruned, see history.prune
+    __tablename__ = u'validation_run'
+
+    id = Column('id', Integer, primary_key=True, autoincrement=True)
+    resource_id = Column('resource_id', Unicode, nullable=False)
+    # final status of the job, see Validation.status
+    status = Column('status', Unicode, nullable=False)
+    created = Column('created', DateTime, nullable=False)
+    finished = Column('finished', DateTime, nullable=False)
+    # time spent validating the data as reported by Frictionless, can be None
+    seconds = Column('seconds', Float, nullable=True)
+    # rows and errors in the report, None if there is no report
+    rows = Column('rows', Integer, nullable=True)
+    errors = Column('errors', Integer, nullable=True)
+    retries = Column('retries', Integer, nullable=False, default=0)
+    # sha256 of the JSON text of the report, to tell when it changed
+    digest = Column('digest', Unicode, nullable=True)
+
+
+Index('idx_validation_run_resource_id_finished',
+      ValidationRun.resource_id, ValidationRun.finished.desc())
+Index('idx_validation_run_finished', ValidationRun.finished)
+
+
+class ValidationStat(Base):
+    # Number of resources in each validation status, by organization and
+    # format. Rebuilt from the other tables by stats.refresh
+    __tablename__ = u'validation_stats'
+
+    # name of the organization, empty for datasets without one
+    organization = Column('organization', Unicode, primary_key=True)
+    # lower case resource format
+    format = Column('format', Unicode, primary_key=True)
+    # validation status, `none` for resources never validated
+    status = Column('status', Unicode, primary_key=True)
+    count = Column('count', Integer, nullable=False, default=0)
+    # total size of the resources, as far as it is known
+    bytes = Column('bytes', BigInteger, nullable=False, default=0)
+    last_updated = Column('last_updated', DateTime, nullable=False)
 
 
 def create_tables():
@@ -0,0 +1,58 @@
+# encoding: utf-8
+
+import hashlib
+import logging
+
+from six import ensure_text
+
+from ckanext.validation import settings
+from ckanext.validation.validation_status_helper import (
+    REDIS_PREFIX, redis_connection)
+
+log = logging.getLogger(__name__)
+
+# Rendered report of the validation report page, by ETag
+FRAGMENT_KEY = REDIS_PREFIX + u'page:{}'
+
+
+def etag(validation, *parts):
+    u'''
+    Returns a strong ETag for a validation record, which changes when the
+    resource is validated again. The `parts` that the response also
+    depends on, eg the user or the language, are hashed with it.
+    '''
+    finished = validation.finished.isoformat() if validation.finished \
+        else u''
+    key = u'\n'.join([validation.id, finished, validation.status or u'']
+                     + [ensure_text(part or u'') for part in parts])
+    return hashlib.sha1(key.encode(u'utf-8')).hexdigest()
+
+
+def get_fragment(key):
+    u'''
+    Returns the HTML cached for `key`, or None if it is not cached or the
+    cache is off (`ckanext.validation.report.page_cache`).
+    '''
+    if not settings.get_report_page_cache():
+        return None
+    try:
+        html = redis_connection().get(FRAGMENT_KEY.format(key))
+    except Exception as e:
+        log.warning(u'Could not read the validation page cache: %s', e)
+        return None
+    return ensure_text(html) if html is not None else None
+
+
+def set_fragment(key, html):
+    u'''
+    Caches the HTML rendered for `key`, if the cache is on. Entries are
+    not invalidated, a new validation gets a new key and the old ones
+    expire.
+    '''
+    ttl = settings.get_report_page_cache()
+    if not ttl:
+        return
+    try:
+        redis_connection().setex(FRAGMENT_KEY.format(key), ttl, html)
+    except Exception as e:
+        log.warning(u'Could not write the validation page cache: %s', e)
@@ -0,0 +1,169 @@
+# encoding: utf-8
+
+import datetime
+import json
+import logging
+
+from six import ensure_text
+
+import ckantoolkit as tk
+
+from ckan import model, plugins
+
+from ckanext.validation import settings
+from ckanext.validation.interfaces import IPipeValidation
+from ckanext.validation.validation_status_helper import (
+    REDIS_PREFIX, ValidationStatusHelper, redis_connection)
+
+log = logging.getLogger(__name__)
+
+# Delivery status of the last report of a resource, by observer
+STATUS_KEY = REDIS_PREFIX + u'pipeline:{}'
+# Held while a report of a resource is delivered to an observer
+LOCK_KEY = REDIS_PREFIX + u'pipeline-lock:{}:{}'
+
+QUEUED = u'queued'
+DELIVERED = u'delivered'
+FAILED = u'failed'
+SUPERSEDED = u'superseded'
+
+# Seconds a delivery can wait for the previous one to the same observer,
+# on top of the observer timeout
+LOCK_GRACE = 60
+
+
+def observer_name(observer):
+    return getattr(observer, u'name', None) or type(observer).__name__
+
+
+def get_observers():
+    return [(observer_name(observer), observer)
+            for observer in plugins.PluginImplementations(IPipeValidation)]
+
+
+def dispatch(validation_report):
+    u'''
+    Send a validation report to the `IPipeValidation` observers.
+
+    In `sync` mode (`ckanext.validation.pipeline.mode`) they are called
+    one after the other, and an exception raised by any of them is
+    raised again. In `async` mode a background job is enqueued for each
+    of them, with its own timeout, so a slow or failing observer does
+    not hold up or fail the validation job.
+    '''
+    options = settings.get_pipeline_options()
+    for name, observer in get_observers():
+        if options[u'mode'] == settings.SYNC_MODE:
+            _deliver(name, observer, validation_report)
+        else:
+            _enqueue(name, validation_report)
+
+
+def _enqueue(name, validation_report):
+    options = settings.get_pipeline_options(name)
+    ttl = settings.get_job_options()[u'ttl']
+    resource_id = validation_report[u'resource_id']
+    _set_status(resource_id, name, QUEUED, validation_report[u'finished'])
+
+    enqueue_args = {
+        u'fn': deliver,
+        u'title': u'validation pipeline: {} resource: {}'.format(
+            name, resource_id),
+        u'kwargs': {
+            u'resource_id': resource_id,
+            u'observer': name,
+            u'finished': validation_report[u'finished'],
+        },
+        u'rq_kwargs': {
+            u'ttl': ttl,
+            u'failure_ttl': ttl,
+            u'job_timeout': options[u'timeout'],
+        },
+    }
+    if options[u'queue']:
+        enqueue_args[u'queue'] = options[u'queue']
+    tk.enqueue_job(**enqueue_args)
+
+
+def deliver(resource_id, observer, finished):
+    u'''
+    Background job sending to an observer the report of the validation of
+    a resource that finished at `finished`.
+
+    The reports of a resource are delivered to each observer one at a
+    time, and a report is skipped as superseded if the resource was
+    validated again since, so observers always get them in order.
+    '''
+    from ckanext.validation import utils
+
+    observers = dict(get_observers())
+    if observer not in observers:
+        log.warning(u'Validation pipeline observer %s is not loaded', observer)
+        return
+
+    wait = settings.get_pipeline_options(observer)[u'timeout'] + LOCK_GRACE
+    lock = redis_connection().lock(LOCK_KEY.format(resource_id, observer),
+                                   timeout=wait, blocking_timeout=wait)
+    if not lock.acquire():
+        _set_status(resource_id, observer, FAILED, finished,
+                    error=u'Timed out waiting for the previous delivery')
+        return
+    try:
+        validation = ValidationStatusHelper().getValidationJob(
+            model.Session, resource_id)
+        if not validation or not validation.finished \
+                or validation.finished.isoformat() != finished:
+            log.debug(u'Report of %s for %s superseded', resource_id, observer)
+            # Unless the status is already the one of the newer report
+            if _get_status(resource_id, observer).get(u'finished') == finished:
+                _set_status(resource_id, observer, SUPERSEDED, finished)
+            return
+        _deliver(observer, observers[observer],
+                 utils.validation_dictize(validation))
+    finally:
+        lock.release()
+
+
+def _deliver(name, observer, validation_report):
+    try:
+        observer.receive_validation_report(validation_report)
+    except Exception as e:
+        log.exception(u'Validation pipeline observer %s failed', name)
+        _set_status(validation_report[u'resource_id'], name, FAILED,
+                    validation_report[u'finished'],
+                    error=str(e) or type(e).__name__)
+        # We reraise all exceptions so they are obvious there
+        # is something wrong
+        raise
+    _set_status(validation_report[u'resource_id'], name, DELIVERED,
+                validation_report[u'finished'])
+
+
+def _set_status(resource_id, observer, status, finished, error=None):
+    key = STATUS_KEY.format(resource_id)
+    pipe = redis_connection().pipeline()
+    pipe.hset(key, observer, json.dumps({
+        u'status': status,
+        u'finished': finished,
+        u'error': error,
+        u'updated': datetime.datetime.utcnow().isoformat(),
+    }))
+    pipe.expire(key, settings.get_job_options()[u'ttl'])
+    pipe.execute()
+
+
+def _get_status(resource_id, observer):
+    value = redis_connection().hget(STATUS_KEY.format(resource_id), observer)
+    return json.loads(ensure_text(value)) if value else {}
+
+
+def get_statuses(resource_id):
+    u'''
+    Returns the delivery status of the last report of a resource to each
+    observer: `queued`, `delivered`, `failed` (with the error) or
+    `superseded` by a newer report.
+    '''
+    statuses = redis_connection().hgetall(STATUS_KEY.format(resource_id))
+    return [dict(json.loads(ensure_text(value)),
+                 observer=ensure_text(observer))
+            for observer, value in sorted(statuses.items())]
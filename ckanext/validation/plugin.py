@@ -19,6 +19,7 @@ log = logging.getLogger(__name__)
 
 class ValidationPlugin(p.SingletonPlugin, DefaultTranslation):
     p.implements(p.IConfigurer)
+    p.implements(p.IConfigurable)
     p.implements(p.IActions)
     p.implements(p.IAuthFunctions)
     p.implements(p.IResourceController, inherit=True)
@@ -52,6 +53,13 @@ class ValidationPlugin(p.SingletonPlugin, DefaultTranslation):
     def update_config(self, config_):
         tk.add_template_directory(config_, u'templates')
         tk.add_resource(u'webassets', 'ckanext-validation')
+        tk.add_ckan_admin_tab(config_, u'validation.stats', u'Validation')
+
+    # IConfigurable
+
+    def configure(self, config_):
+        # Fail on startup rather than on each download
+        s.get_http_limits_by_host()
 
     # IActions
 
@@ -123,7 +131,7 @@ class ValidationPlugin(p.SingletonPlugin, DefaultTranslation):
     # CKAN >= 2.10
     def before_resource_update(self, context, current_resource, updated_resource):
         context['_resource_validation'] = True
-        # avoid circular update, because validation job calls `resource_patch`
+        # avoid circular update, because validation job can call `resource_patch`
         # (which calls package_update)
         if context.get('_validation_performed'):
             return
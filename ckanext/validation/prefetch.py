@@ -0,0 +1,206 @@
+# encoding: utf-8
+
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from six.moves.urllib.parse import urlparse
+
+from ckan import model
+
+from ckanext.validation import settings as s, http_client
+
+log = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+
+# Spooled files older than this are not used, and are removed as leftovers
+# of jobs that did not run or of a stopped worker
+SPOOL_MAX_AGE = 60 * 60
+
+# Prefetchers started in this process and not stopped yet
+_started = set()
+
+
+def is_running():
+    u'''
+    Returns whether a prefetcher runs in this process, ie the jobs are
+    run by a validation worker that downloads their sources ahead.
+    '''
+    return bool(_started)
+
+
+def spool_path(resource_id, url):
+    u'''
+    Path of the spooled copy of `url`. The URL is part of the name, so
+    a resource whose URL changed after being queued is not validated
+    against a stale download, and the original extension is kept for
+    Frictionless to detect any compression.
+    '''
+    extension = os.path.splitext(urlparse(url).path)[1]
+    if not re.match(r'^\.[\w]{1,8}$', extension):
+        extension = u''
+    digest = hashlib.sha1(url.encode(u'utf-8')).hexdigest()[:16]
+    return os.path.join(s.get_spool_dir(), u'{}-{}{}'.format(
+        resource_id, digest, extension))
+
+
+def take(resource_id, url):
+    u'''
+    Returns the path of the spooled copy of a resource source, or None
+    if it has not been downloaded (yet) or the copy is too old.
+    '''
+    path = spool_path(resource_id, url)
+    try:
+        if time.time() - os.path.getmtime(path) < SPOOL_MAX_AGE:
+            return path
+    except OSError:
+        pass
+    return None
+
+
+def discard(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def remote_sources(resource_ids):
+    u'''
+    Returns a list of `(resource_id, url)` for the resources that are
+    linked rather than uploaded, and so can be downloaded in advance.
+    '''
+    if not resource_ids:
+        return []
+    query = model.Session.query(
+        model.Resource.id, model.Resource.url, model.Resource.url_type
+    ).filter(model.Resource.id.in_(resource_ids),
+             model.Resource.state == u'active')
+    by_id = {
+        resource_id: url for resource_id, url, url_type in query
+        if url_type != u'upload' and http_client.get_host(url)
+    }
+    # Keep the queue order
+    return [(resource_id, by_id[resource_id])
+            for resource_id in resource_ids if resource_id in by_id]
+
+
+def download(url, path, timeout, session=None):
+    u'''
+    Download `url` to `path`, giving up after `timeout` seconds. The file
+    is written under a temporary name and only renamed once complete, so
+    a half downloaded source is never picked up.
+    '''
+    session = session or http_client.get_session()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Worker processes may race to download the same source
+    partial = u'{}.{}.part'.format(path, os.getpid())
+    try:
+        with http_client.host_slot(url):
+            deadline = time.time() + timeout
+            with session.get(url, stream=True, timeout=timeout) as response:
+                response.raise_for_status()
+                with open(partial, u'wb') as f:
+                    for chunk in response.iter_content(CHUNK_SIZE):
+                        if time.time() > deadline:
+                            raise requests.exceptions.Timeout(
+                                u'Download took over {}s'.format(timeout))
+                        f.write(chunk)
+        os.rename(partial, path)
+    except Exception:
+        discard(partial)
+        raise
+
+
+class Prefetcher(object):
+    u'''
+    Downloads the sources of upcoming validation jobs in the background,
+    so the worker validates local files instead of waiting on the
+    publisher's server.
+
+    Downloads are coordinated by an asyncio event loop running in its own
+    thread, with at most `per_host` concurrent downloads from each host.
+    The transfers themselves use blocking calls on the shared HTTP session
+    in a thread pool, so they also respect the limits of `http_client`.
+    '''
+
+    def __init__(self, depth, per_host=2, timeout=60):
+        self.depth = depth
+        self.per_host = per_host
+        self.timeout = timeout
+        self.loop = asyncio.new_event_loop()
+        self.executor = ThreadPoolExecutor(
+            max_workers=max(depth, 1),
+            thread_name_prefix=u'validation-prefetch')
+        self._thread = threading.Thread(
+            target=self._run, name=u'validation-prefetch-loop')
+        self._thread.daemon = True
+        self._hosts = {}
+        # Paths being downloaded, added by the worker thread and discarded
+        # by the loop thread
+        self._pending = set()
+        self._pending_lock = threading.Lock()
+
+    def start(self):
+        spool_dir = s.get_spool_dir()
+        os.makedirs(spool_dir, exist_ok=True)
+        self._clean_spool(spool_dir)
+        self._thread.start()
+        _started.add(self)
+
+    def stop(self):
+        _started.discard(self)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.executor.shutdown(wait=False)
+
+    def submit(self, sources):
+        u'''
+        Schedule the download of `(resource_id, url)` pairs not already
+        spooled or being downloaded. Can be called from any thread.
+        '''
+        for resource_id, url in sources:
+            path = spool_path(resource_id, url)
+            with self._pending_lock:
+                if path in self._pending or os.path.isfile(path):
+                    continue
+                self._pending.add(path)
+            asyncio.run_coroutine_threadsafe(
+                self._fetch(url, path), self.loop)
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    async def _fetch(self, url, path):
+        host = urlparse(url).netloc
+        if host not in self._hosts:
+            self._hosts[host] = asyncio.Semaphore(self.per_host)
+        try:
+            async with self._hosts[host]:
+                await self.loop.run_in_executor(
+                    self.executor, download, url, path, self.timeout)
+            log.debug(u'Prefetched %s to %s', url, path)
+        except Exception as e:
+            # The job will download the source itself
+            log.warning(u'Could not prefetch %s: %s', url, e)
+        finally:
+            with self._pending_lock:
+                self._pending.discard(path)
+
+    def _clean_spool(self, spool_dir):
+        now = time.time()
+        for name in os.listdir(spool_dir):
+            path = os.path.join(spool_dir, name)
+            try:
+                if now - os.path.getmtime(path) > SPOOL_MAX_AGE:
+                    discard(path)
+            except OSError:
+                pass
@@ -0,0 +1,133 @@
+# encoding: utf-8
+
+import logging
+import time
+
+from six import ensure_text
+
+import ckantoolkit as tk
+
+from ckan import model
+from ckan.lib import search
+
+from ckanext.validation import settings
+from ckanext.validation.validation_status_helper import (
+    REDIS_PREFIX, redis_connection)
+
+log = logging.getLogger(__name__)
+
+# Datasets waiting to be reindexed, scored by when they were first touched
+PENDING_KEY = REDIS_PREFIX + u'reindex:pending'
+# Number of datasets reindexed and of reindexes avoided by coalescing
+COUNTERS_KEY = REDIS_PREFIX + u'reindex:counters'
+
+
+def touch(package_id, now=None):
+    u'''
+    Queue the reindex of a dataset after the validation of one of its
+    resources finished.
+
+    The dataset is reindexed once its window
+    (`ckanext.validation.reindex.window`) is over, counted from the first
+    touch, so a steady flow of validations does not keep postponing it.
+    Touches while it is waiting are absorbed and counted as avoided
+    reindexes. With no window it is reindexed straight away.
+    '''
+    if not settings.get_reindex_window():
+        indexed, failed = reindex([package_id])
+        if failed:
+            # Retried by the next flush
+            redis_connection().zadd(PENDING_KEY, {package_id: now or time.time()})
+        return
+    conn = redis_connection()
+    if not conn.zadd(PENDING_KEY, {package_id: now or time.time()}, nx=True):
+        conn.hincrby(COUNTERS_KEY, u'avoided', 1)
+
+
+def flush(everything=False, now=None):
+    u'''
+    Reindex the datasets whose window is over, or all the pending ones if
+    `everything` is set, committing the search index once for all of
+    them.
+
+    Each dataset is claimed before it is indexed, so several processes
+    can flush at the same time without indexing it twice. Datasets that
+    could not be indexed are queued again with their first touch time,
+    to be retried by the next flush.
+
+    Returns the number of datasets reindexed.
+    '''
+    conn = redis_connection()
+    if everything:
+        due = conn.zrange(PENDING_KEY, 0, -1, withscores=True)
+    else:
+        cutoff = (now or time.time()) - settings.get_reindex_window()
+        due = conn.zrangebyscore(PENDING_KEY, u'-inf', cutoff,
+                                 withscores=True)
+    claimed = dict((ensure_text(package_id), score) for package_id, score in due
+                   if conn.zrem(PENDING_KEY, package_id))
+    if not claimed:
+        return 0
+
+    try:
+        indexed, failed = reindex(list(claimed))
+    except Exception:
+        conn.zadd(PENDING_KEY, claimed)
+        raise
+    if failed:
+        conn.zadd(PENDING_KEY, dict(
+            (package_id, claimed[package_id]) for package_id in failed))
+    conn.hincrby(COUNTERS_KEY, u'reindexed', indexed)
+    log.info(u'Reindexed %s datasets after their validation, %s reindexes '
+             u'avoided so far', indexed, get_counters()[u'avoided'])
+    return indexed
+
+
+def get_counters():
+    u'''
+    Returns the number of datasets waiting to be reindexed, reindexed
+    by `flush`, and of reindexes avoided by coalescing validations.
+    '''
+    conn = redis_connection()
+    counters = conn.hgetall(COUNTERS_KEY)
+    counters = dict((ensure_text(key), int(value))
+                    for key, value in counters.items())
+    return {
+        u'pending': conn.zcard(PENDING_KEY),
+        u'reindexed': counters.get(u'reindexed', 0),
+        u'avoided': counters.get(u'avoided', 0),
+    }
+
+
+def reindex(package_ids):
+    u'''
+    Updates the search index documents of datasets, committing the index
+    once at the end. Datasets that cannot be indexed, or all of them if
+    the index can't be committed, are logged and skipped.
+
+    Returns the number of datasets indexed, and the ids of the ones that
+    could not be, to retry them.
+    '''
+    package_index = search.index_for(model.Package)
+    indexed = []
+    failed = []
+    for package_id in package_ids:
+        try:
+            package_index.update_dict(tk.get_action(u'package_show')(
+                {u'model': model, u'ignore_auth': True, u'validate': False,
+                 u'use_cache': False},
+                {u'id': package_id}), defer_commit=True)
+            indexed.append(package_id)
+        except tk.ObjectNotFound:
+            log.warning(u'Dataset %s to reindex does not exist', package_id)
+        except search.SearchIndexError:
+            log.exception(u'Could not reindex dataset %s', package_id)
+            failed.append(package_id)
+    if indexed:
+        try:
+            package_index.commit()
+        except search.SearchIndexError:
+            log.exception(u'Could not commit the reindex of %s datasets',
+                          len(indexed))
+            return 0, failed + indexed
+    return len(indexed), failed
@@ -0,0 +1,388 @@
+# encoding: utf-8
+
+import gzip
+import json
+import logging
+import os
+import time
+import uuid
+
+import sqlalchemy as sa
+from six import string_types
+from sqlalchemy.orm import undefer_group
+
+from ckan import model
+
+from ckanext.validation import settings as s
+from ckanext.validation.model import Validation
+
+log = logging.getLogger(__name__)
+
+# Compressed reports are stored as bytes, the codec is told by the first ones
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+CHUNK_SIZE = 64 * 1024
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        return None
+    return zstandard
+
+
+def _orjson():
+    try:
+        import orjson
+    except ImportError:
+        return None
+    return orjson
+
+
+def dumps(report):
+    u'''
+    Returns the JSON text of a report, with orjson if it is installed,
+    which is several times faster than the json module on large reports.
+    '''
+    orjson = _orjson()
+    if orjson is not None:
+        return orjson.dumps(
+            report, option=orjson.OPT_NON_STR_KEYS).decode(u'utf-8')
+    return json.dumps(report)
+
+
+def loads(text):
+    u'''
+    Returns the report of a JSON text, parsed with orjson if installed.
+    '''
+    orjson = _orjson()
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
+
+def available_codecs():
+    return [codec for codec in s.REPORT_CODECS
+            if codec != u'zstd' or _zstandard()]
+
+
+def compress(text, codec, level=None):
+    u'''
+    Returns the JSON `text` of a report compressed with `codec`.
+    '''
+    data = text.encode(u'utf-8')
+    if codec == u'gzip':
+        # mtime is fixed so the same report always gives the same bytes
+        return gzip.compress(data, compresslevel=level or 6, mtime=0)
+    if codec == u'zstd':
+        zstandard = _zstandard()
+        if zstandard is None:
+            raise ImportError(
+                u'The zstandard package is needed to compress reports with '
+                u'zstd, install it with `pip install ckanext-validation[zstd]`')
+        return zstandard.ZstdCompressor(level=level or 3).compress(data)
+    raise ValueError(u'Unknown report codec: {}'.format(codec))
+
+
+def decompress(data):
+    u'''
+    Returns the JSON text of a report compressed by `compress`.
+    '''
+    data = bytes(data)
+    if data.startswith(GZIP_MAGIC):
+        return gzip.decompress(data).decode(u'utf-8')
+    if data.startswith(ZSTD_MAGIC):
+        zstandard = _zstandard()
+        if zstandard is None:
+            raise ImportError(
+                u'The zstandard package is needed to read reports '
+                u'compressed with zstd')
+        return zstandard.ZstdDecompressor().decompress(data).decode(u'utf-8')
+    raise ValueError(u'Unknown compressed report format')
+
+
+def store(validation, report, codec=None, level=None, offload=True):
+    u'''
+    Set the report of a Validation record, as JSON text or compressed
+    with the configured codec. `report` can be a dict or its JSON text.
+
+    Reports larger than the offload size are written to a file, and only
+    a summary and the path of the file are kept in the record. Any file
+    of the previous report is removed.
+
+    Returns the full JSON text of the report, or None if there is none.
+    '''
+    if codec is None:
+        codec, level = s.get_report_compression()
+    previous_path = validation.report_path
+    validation.report_path = None
+
+    text = report
+    if report is not None:
+        # Serialized once, the text is returned for the caller to reuse
+        data = None
+        if not isinstance(report, string_types):
+            data = report
+            text = report = dumps(data)
+        size = offload and s.get_report_offload()[u'size']
+        if size and len(report) >= size:
+            validation.report_path = write_body(
+                validation.resource_id, report, codec, level)
+            report = dumps(summarize(loads(report) if data is None else data))
+            codec = u'none'
+
+    if report is None or codec == u'none':
+        validation.report = report
+        validation.report_data = None
+    else:
+        validation.report = None
+        validation.report_data = compress(report, codec, level)
+
+    if previous_path and previous_path != validation.report_path:
+        delete_body(previous_path)
+    return text
+
+
+def load(validation, summary=False):
+    u'''
+    Returns the report of a Validation record as a dict, whichever way it
+    was stored, or None if it has none.
+
+    For offloaded reports, the full report is read from its file unless
+    only the `summary` is wanted, or the file can't be read.
+    '''
+    if validation.report_path is None and validation.report_data is None \
+            and (validation.report is None or isinstance(validation.report, dict)):
+        return validation.report
+    text = load_text(validation, summary=summary)
+    return None if text is None else loads(text)
+
+
+def load_text(validation, summary=False):
+    u'''
+    Returns the JSON text of the report of a Validation record, or None
+    if it has none, as `load` does but without parsing it, eg to send it
+    as is in a response.
+    '''
+    if validation.report_path and not summary:
+        try:
+            return read_body(validation.report_path)
+        except (IOError, OSError, ImportError) as e:
+            # eg zstd compressed with zstandard not installed
+            log.error(u'Could not read the report of resource %s: %s',
+                      validation.resource_id, e)
+
+    if validation.report_data is not None:
+        return decompress(validation.report_data)
+
+    report = validation.report
+    if report is None or isinstance(report, string_types):
+        return report
+    return dumps(report)
+
+
+# Errors of each table kept in the summary of an offloaded report
+SUMMARY_ERRORS = 10
+
+
+def summarize(report):
+    u'''
+    Returns a copy of `report` with only the first errors of each table.
+    '''
+    summary = dict(report)
+    summary[u'tasks'] = []
+    for task in report.get(u'tasks', []):
+        task = dict(task)
+        task[u'errors'] = task.get(u'errors', [])[:SUMMARY_ERRORS]
+        summary[u'tasks'].append(task)
+    return summary
+
+
+def _body_path(path):
+    offload_path = s.get_report_offload()[u'path']
+    if not offload_path:
+        raise IOError(u'No path to read offloaded reports from')
+    return os.path.join(offload_path, path)
+
+
+def write_body(resource_id, text, codec=u'none', level=None):
+    u'''
+    Write the JSON `text` of a report to a new file in the offload path,
+    compressed with `codec`. Returns the path of the file, relative to
+    the offload path.
+    '''
+    if codec == u'none':
+        data, extension = text.encode(u'utf-8'), u'.json'
+    else:
+        data = compress(text, codec, level)
+        extension = u'.json.gz' if codec == u'gzip' else u'.json.zst'
+    # A new name each time, a report being read is never overwritten
+    path = os.path.join(resource_id[:3], u'{}-{}{}'.format(
+        resource_id, uuid.uuid4().hex, extension))
+    full_path = _body_path(path)
+    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+    partial = full_path + u'.part'
+    with open(partial, u'wb') as f:
+        f.write(data)
+    os.rename(partial, full_path)
+    return path
+
+
+def iter_body(path):
+    u'''
+    Yields the JSON text of an offloaded report in chunks, decompressing
+    it on the fly.
+    '''
+    with open(_body_path(path), u'rb') as f:
+        magic = f.read(len(ZSTD_MAGIC))
+        f.seek(0)
+        if magic.startswith(GZIP_MAGIC):
+            stream = gzip.GzipFile(fileobj=f)
+        elif magic.startswith(ZSTD_MAGIC):
+            zstandard = _zstandard()
+            if zstandard is None:
+                raise ImportError(
+                    u'The zstandard package is needed to read reports '
+                    u'compressed with zstd')
+            stream = zstandard.ZstdDecompressor().stream_reader(f)
+        else:
+            stream = f
+        while True:
+            chunk = stream.read(CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+
+
+def read_body(path):
+    return b''.join(iter_body(path)).decode(u'utf-8')
+
+
+def delete_body(path):
+    try:
+        os.remove(_body_path(path))
+    except (IOError, OSError) as e:
+        log.warning(u'Could not remove offloaded report %s: %s', path, e)
+
+
+def _stored_as_text():
+    # Reports were stored as JSON, SQL NULL or JSON null mean there is none
+    return sa.and_(
+        Validation.report_path.is_(None),
+        Validation.report_data.is_(None),
+        Validation.report.isnot(None),
+        sa.cast(Validation.report, sa.UnicodeText) != u'null')
+
+
+def compress_existing(codec=None, level=None, batch_size=500):
+    u'''
+    Compress the reports stored as JSON text, `batch_size` records at a
+    time, committing after each batch so it can run on a live site and be
+    stopped and resumed at any time.
+
+    Yields the number of reports compressed in each batch.
+    '''
+    if codec is None:
+        codec, level = s.get_report_compression()
+    if codec == u'none':
+        raise ValueError(u'Set a compression codec to compress reports')
+
+    session = model.Session
+    last_id = u''
+    while True:
+        batch = session.query(
+            Validation.id, Validation.created, Validation.finished,
+            Validation.report
+        ).filter(
+            _stored_as_text(), Validation.id > last_id
+        ).order_by(Validation.id).limit(batch_size).all()
+        if not batch:
+            return
+
+        compressed = 0
+        for validation_id, created, finished, report in batch:
+            if not isinstance(report, string_types):
+                report = dumps(report)
+            # Skip records a job updated since they were read
+            compressed += session.query(Validation).filter(
+                Validation.id == validation_id,
+                Validation.created == created,
+                Validation.finished == finished,
+                Validation.report_data.is_(None),
+            ).update({
+                Validation.report: sa.null(),
+                Validation.report_data: compress(report, codec, level),
+            }, synchronize_session=False)
+        session.commit()
+        last_id = batch[-1][0]
+        yield compressed
+
+
+def benchmark(sample_size=50, rounds=5):
+    u'''
+    Measure how long it takes to store and read back existing reports in
+    each of the available formats, and how much space they take.
+
+    Reports are written to their own records, inside a transaction that
+    is rolled back, so the database and its indexes do the same work as
+    for real jobs without changing any data.
+
+    Returns a list of dicts with the format, total size in bytes and
+    median write and read times in milliseconds.
+    '''
+    session = model.Session
+    sample = session.query(Validation).options(
+        undefer_group(u'payload')
+    ).filter(sa.or_(
+        _stored_as_text(), Validation.report_data.isnot(None)
+    )).order_by(Validation.finished.desc()).limit(sample_size).all()
+    reports = [(validation.id, load(validation)) for validation in sample]
+    session.rollback()
+
+    results = []
+    for codec in available_codecs():
+        writes = []
+        reads = []
+        size = 0
+        for validation_id, report in reports:
+            for _i in range(rounds):
+                validation = session.query(Validation).filter(
+                    Validation.id == validation_id).one()
+
+                started = time.perf_counter()
+                store(validation, json.dumps(report), codec, offload=False)
+                session.flush()
+                writes.append(time.perf_counter() - started)
+
+                session.expunge(validation)
+                started = time.perf_counter()
+                validation = session.query(Validation).options(
+                    undefer_group(u'payload')
+                ).filter(Validation.id == validation_id).one()
+                load(validation)
+                reads.append(time.perf_counter() - started)
+
+            size += len(validation.report_data) if codec != u'none' \
+                else len(json.dumps(report).encode(u'utf-8'))
+            session.rollback()
+
+        results.append({
+            u'format': codec,
+            u'reports': len(reports),
+            u'bytes': size,
+            u'write_ms': _median(writes) * 1000,
+            u'read_ms': _median(reads) * 1000,
+        })
+    return results
+
+
+def _median(values):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
@@ -0,0 +1,132 @@
+# encoding: utf-8
+
+import datetime
+import logging
+import time
+
+from sqlalchemy import case, extract, func, literal
+
+import ckantoolkit as tk
+from ckan import model
+
+from ckanext.validation import compat, settings
+from ckanext.validation.model import Validation
+from ckanext.validation.validation_status_helper import FINAL_STATUSES
+
+log = logging.getLogger(__name__)
+
+
+def _ttl_expression(options):
+    # Validations are due after the shortest TTL of the policies matching
+    # their resource, or the default one
+    default = options[u'ttl']
+    policies = options[u'policies']
+    source = compat.case(
+        (model.Resource.url_type == u'upload', u'upload'), else_=u'url')
+    ttls = [literal(default)]
+    for kind, column in ((u'format', func.lower(model.Resource.format)),
+                         (u'organization', model.Group.name),
+                         (u'source', source)):
+        if policies[kind]:
+            ttls.append(case(policies[kind], value=column, else_=default))
+    return func.least(*ttls) if len(ttls) > 1 else ttls[0]
+
+
+def stale_resources(limit, options=None, now=None, exclude=None):
+    u'''
+    Returns up to `limit` `(resource_id, package_id, overdue)` tuples for
+    the resources whose last validation is older than their TTL, the
+    most overdue (in seconds) first, leaving out the resource ids in
+    `exclude`.
+
+    Only finished validations are considered, so resources already in the
+    queue are not picked again.
+    '''
+    options = options or settings.get_scheduler_options()
+    now = now or datetime.datetime.utcnow()
+    age = extract(u'epoch', literal(now) - Validation.finished)
+    overdue = (age - _ttl_expression(options)).label(u'overdue')
+
+    query = model.Session.query(
+        Validation.resource_id, model.Resource.package_id, overdue
+    ).join(
+        model.Resource, model.Resource.id == Validation.resource_id
+    ).join(
+        model.Package, model.Package.id == model.Resource.package_id
+    ).outerjoin(
+        model.Group, model.Group.id == model.Package.owner_org
+    ).filter(
+        model.Resource.state == u'active',
+        model.Package.state == u'active',
+        Validation.status.in_(FINAL_STATUSES),
+        Validation.finished.isnot(None),
+        func.lower(model.Resource.format).in_(
+            settings.get_supported_formats()),
+        overdue > 0,
+    )
+    if exclude:
+        query = query.filter(Validation.resource_id.notin_(list(exclude)))
+    query = query.order_by(overdue.desc()).limit(limit)
+
+    return [(resource_id, package_id, float(seconds))
+            for resource_id, package_id, seconds in query]
+
+
+def _enqueue(resource_id, package_id):
+    try:
+        tk.get_action(u'resource_validation_run')(
+            {u'ignore_auth': True},
+            {u'resource_id': resource_id, u'async': True})
+    except (tk.ValidationError, tk.ObjectNotFound) as e:
+        log.warning(u'Could not schedule the validation of resource %s: %s',
+                    resource_id, e)
+        return False
+    log.debug(u'Resource %s from dataset %s sent to the validation queue',
+              resource_id, package_id)
+    return True
+
+
+def run(rate=None, burst=False):
+    u'''
+    Enqueue the validation of stale resources, `rate` per minute, for as
+    long as it runs, or until none is due if `burst` is set.
+
+    Resources are looked up in batches of about `interval` seconds worth
+    of jobs, so the most overdue ones go first even as others become due.
+    Resources that could not be enqueued are not tried again in the same
+    run, so they don't fill every batch.
+    '''
+    options = settings.get_scheduler_options()
+    rate = options[u'rate'] if rate is None else rate
+    if rate <= 0:
+        raise ValueError(u'The scheduler rate must be greater than 0')
+    gap = 60.0 / rate
+    batch = max(1, int(rate * options[u'interval'] / 60.0))
+    log.info(u'Scheduling stale validations at %s per minute', rate)
+
+    failed = set()
+    while True:
+        due = stale_resources(batch, options, exclude=failed)
+        # Do not keep a transaction open while pacing the batch
+        model.Session.remove()
+
+        if not due:
+            if burst:
+                log.info(u'No validations due, exiting')
+                return
+            time.sleep(options[u'interval'])
+            continue
+
+        log.info(u'%s validations due, the most overdue by %ds',
+                 len(due), due[0][2])
+        enqueued = 0
+        for resource_id, package_id, _overdue in due:
+            started = time.time()
+            if _enqueue(resource_id, package_id):
+                enqueued += 1
+            else:
+                failed.add(resource_id)
+            time.sleep(max(0, gap - (time.time() - started)))
+        if burst and not enqueued:
+            log.info(u'No validations could be enqueued, exiting')
+            return
@@ -1,5 +1,7 @@
 # encoding: utf-8
 import json
+import os
+import tempfile
 
 import ckantoolkit as tk
 
@@ -48,6 +50,101 @@ PASS_AUTH_HEADER_DEFAULT = True
 
 PASS_AUTH_HEADER_VALUE = u"ckanext.validation.pass_auth_header_value"
 
+QUEUE_KEY = u"ckanext.validation.queue"
+
+SIZE_CLASSES = (u'small', u'medium', u'large')
+SIZE_CLASSES_KEY = u"ckanext.validation.queue.size_classes"
+SIZE_MEDIUM_KEY = u"ckanext.validation.queue.medium_size"
+SIZE_MEDIUM_DEFAULT = 5 * 1024 * 1024
+SIZE_LARGE_KEY = u"ckanext.validation.queue.large_size"
+SIZE_LARGE_DEFAULT = 100 * 1024 * 1024
+SIZE_UNKNOWN_CLASS_KEY = u"ckanext.validation.queue.unknown_size_class"
+SIZE_UNKNOWN_CLASS_DEFAULT = u'medium'
+# Per size class overrides, eg `ckanext.validation.queue.large.timeout`
+SIZE_CLASS_TIMEOUT_KEY = u"ckanext.validation.queue.{}.timeout"
+SIZE_CLASS_PROCESSES_KEY = u"ckanext.validation.worker.{}.processes"
+
+WORKER_PROCESSES_KEY = u"ckanext.validation.worker.processes"
+WORKER_PROCESSES_DEFAULT = 1
+WORKER_MAX_JOBS_KEY = u"ckanext.validation.worker.max_jobs"
+WORKER_MAX_JOBS_DEFAULT = 500
+WORKER_MAX_MEMORY_KEY = u"ckanext.validation.worker.max_memory"
+WORKER_MAX_MEMORY_DEFAULT = 1024
+SCHEMA_CACHE_TTL_KEY = u"ckanext.validation.worker.schema_cache_ttl"
+SCHEMA_CACHE_TTL_DEFAULT = 300
+
+SPOOL_DIR_KEY = u"ckanext.validation.spool_dir"
+PREFETCH_DEPTH_KEY = u"ckanext.validation.prefetch.depth"
+PREFETCH_DEPTH_DEFAULT = 0
+PREFETCH_PER_HOST_KEY = u"ckanext.validation.prefetch.per_host"
+PREFETCH_PER_HOST_DEFAULT = 2
+PREFETCH_TIMEOUT_KEY = u"ckanext.validation.prefetch.timeout"
+PREFETCH_TIMEOUT_DEFAULT = 60
+
+HTTP_POOL_SIZE_KEY = u"ckanext.validation.http.pool_size"
+HTTP_POOL_SIZE_DEFAULT = 10
+HTTP_MAX_PER_HOST_KEY = u"ckanext.validation.http.max_per_host"
+HTTP_MAX_PER_HOST_DEFAULT = 0
+HTTP_RATE_PER_HOST_KEY = u"ckanext.validation.http.rate_per_host"
+HTTP_RATE_PER_HOST_DEFAULT = 0
+HTTP_HOST_LIMITS_KEY = u"ckanext.validation.http.host_limits"
+
+JOB_TTL_KEY = u"ckanext.validation.job.ttl"
+JOB_TTL_DEFAULT = 24 * 60 * 60
+JOB_TIMEOUT_KEY = u"ckanext.validation.job.timeout"
+JOB_TIMEOUT_DEFAULT = 0
+JOB_CPU_BUDGET_KEY = u"ckanext.validation.job.cpu_budget"
+JOB_CPU_BUDGET_DEFAULT = 0
+
+SCHEDULER_TTL_KEY = u"ckanext.validation.scheduler.ttl"
+SCHEDULER_TTL_DEFAULT = 7 * 24 * 60 * 60
+SCHEDULER_POLICIES_KEY = u"ckanext.validation.scheduler.policies"
+SCHEDULER_RATE_KEY = u"ckanext.validation.scheduler.rate"
+SCHEDULER_RATE_DEFAULT = 60
+SCHEDULER_INTERVAL_KEY = u"ckanext.validation.scheduler.interval"
+SCHEDULER_INTERVAL_DEFAULT = 300
+
+REPORT_CODECS = (u'none', u'gzip', u'zstd')
+REPORT_COMPRESSION_KEY = u"ckanext.validation.report.compression"
+REPORT_COMPRESSION_DEFAULT = u'none'
+REPORT_COMPRESSION_LEVEL_KEY = u"ckanext.validation.report.compression_level"
+REPORT_OFFLOAD_SIZE_KEY = u"ckanext.validation.report.offload_size"
+REPORT_OFFLOAD_SIZE_DEFAULT = 0
+REPORT_OFFLOAD_PATH_KEY = u"ckanext.validation.report.offload_path"
+
+HISTORY_RUNS_KEY = u"ckanext.validation.history.runs"
+HISTORY_RUNS_DEFAULT = 100
+HISTORY_DAYS_KEY = u"ckanext.validation.history.days"
+HISTORY_DAYS_DEFAULT = 365
+
+STATUS_WRITEBACKS = (u'direct', u'patch')
+STATUS_WRITEBACK_KEY = u"ckanext.validation.status_writeback"
+STATUS_WRITEBACK_DEFAULT = u'patch'
+REINDEX_WINDOW_KEY = u"ckanext.validation.reindex.window"
+REINDEX_WINDOW_DEFAULT = 10
+
+PIPELINE_MODES = (SYNC_MODE, ASYNC_MODE)
+PIPELINE_MODE_KEY = u"ckanext.validation.pipeline.mode"
+PIPELINE_MODE_DEFAULT = SYNC_MODE
+PIPELINE_QUEUE_KEY = u"ckanext.validation.pipeline.queue"
+PIPELINE_TIMEOUT_KEY = u"ckanext.validation.pipeline.timeout"
+PIPELINE_TIMEOUT_DEFAULT = 300
+# Per observer overrides, eg `ckanext.validation.pipeline.xloader.timeout`
+PIPELINE_OBSERVER_TIMEOUT_KEY = u"ckanext.validation.pipeline.{}.timeout"
+
+REPORT_PAGE_CACHE_KEY = u"ckanext.validation.report.page_cache"
+REPORT_PAGE_CACHE_DEFAULT = 0
+
+STATUS_EVENTS_TIMEOUT_KEY = u"ckanext.validation.status_events.timeout"
+STATUS_EVENTS_TIMEOUT_DEFAULT = 60
+
+RETRY_MAX_KEY = u"ckanext.validation.retry.max"
+RETRY_MAX_DEFAULT = 3
+RETRY_BACKOFF_KEY = u"ckanext.validation.retry.backoff"
+RETRY_BACKOFF_DEFAULT = 2
+RETRY_MAX_DELAY_KEY = u"ckanext.validation.retry.max_delay"
+RETRY_MAX_DELAY_DEFAULT = 60
+
 
 def get_default_validation_options():
     """Return a default validation options
@@ -59,6 +156,369 @@ def get_default_validation_options():
     return json.loads(default_options) if default_options else {}
 
 
+def get_queue_name(size_class=None):
+    """Returns the name of the queue validation jobs are sent to, or None
+    to use the default background jobs queue.
+
+    With a `size_class`, the name of the queue for jobs of that class,
+    suffixed to the validation queue, eg `validation-large`.
+
+    Returns:
+        str: queue name
+    """
+    queue = tk.config.get(QUEUE_KEY) or None
+    if size_class:
+        return u'{}-{}'.format(queue or u'validation', size_class)
+    return queue
+
+
+def get_size_classes():
+    """Returns the minimum source size in bytes of the `medium` and
+    `large` size classes, and the class of sources of unknown size, or
+    None if jobs are not sent to a queue per size class.
+
+    Returns:
+        dict[str, Any]: size classes dictionary
+    """
+    if not tk.asbool(tk.config.get(SIZE_CLASSES_KEY, False)):
+        return None
+    unknown = tk.config.get(SIZE_UNKNOWN_CLASS_KEY, SIZE_UNKNOWN_CLASS_DEFAULT)
+    if unknown not in SIZE_CLASSES:
+        raise ValueError(u'{} must be one of {}'.format(
+            SIZE_UNKNOWN_CLASS_KEY, u', '.join(SIZE_CLASSES)))
+    return {
+        u'medium': tk.asint(tk.config.get(
+            SIZE_MEDIUM_KEY, SIZE_MEDIUM_DEFAULT)),
+        u'large': tk.asint(tk.config.get(SIZE_LARGE_KEY, SIZE_LARGE_DEFAULT)),
+        u'unknown': unknown,
+    }
+
+
+def get_worker_options(size_class=None):
+    """Returns the settings of the validation worker pool: number of
+    processes, and the number of jobs and megabytes of memory after
+    which a process is recycled. 0 disables the limit.
+
+    With a `size_class`, the number of processes can be set for the pool
+    of that class.
+
+    Returns:
+        dict[str, int]: worker options dictionary
+    """
+    processes = tk.config.get(WORKER_PROCESSES_KEY, WORKER_PROCESSES_DEFAULT)
+    if size_class:
+        processes = tk.config.get(
+            SIZE_CLASS_PROCESSES_KEY.format(size_class), processes)
+    return {
+        u'processes': tk.asint(processes),
+        u'max_jobs': tk.asint(tk.config.get(
+            WORKER_MAX_JOBS_KEY, WORKER_MAX_JOBS_DEFAULT)),
+        u'max_memory': tk.asint(tk.config.get(
+            WORKER_MAX_MEMORY_KEY, WORKER_MAX_MEMORY_DEFAULT)),
+    }
+
+
+def get_schema_cache_ttl():
+    """Returns for how many seconds the validation worker keeps remote
+    schemas in memory before fetching them again.
+
+    Returns:
+        int: time to live in seconds
+    """
+    return tk.asint(tk.config.get(
+        SCHEMA_CACHE_TTL_KEY, SCHEMA_CACHE_TTL_DEFAULT))
+
+
+def get_spool_dir():
+    """Returns the directory where source files downloaded ahead of their
+    validation job are kept.
+
+    Returns:
+        str: spool directory path
+    """
+    return tk.config.get(SPOOL_DIR_KEY) or os.path.join(
+        tempfile.gettempdir(), u'ckanext-validation-spool')
+
+
+def get_prefetch_options():
+    """Returns the settings of the source prefetcher: how many queued jobs
+    to download ahead (0 disables it), how many concurrent downloads to
+    allow per host and the timeout in seconds of each download.
+
+    Returns:
+        dict[str, int]: prefetch options dictionary
+    """
+    return {
+        u'depth': tk.asint(tk.config.get(
+            PREFETCH_DEPTH_KEY, PREFETCH_DEPTH_DEFAULT)),
+        u'per_host': tk.asint(tk.config.get(
+            PREFETCH_PER_HOST_KEY, PREFETCH_PER_HOST_DEFAULT)),
+        u'timeout': tk.asint(tk.config.get(
+            PREFETCH_TIMEOUT_KEY, PREFETCH_TIMEOUT_DEFAULT)),
+    }
+
+
+def get_http_pool_size():
+    """Returns how many connections to keep open per host in the shared
+    HTTP session used to download sources and schemas.
+
+    Returns:
+        int: connection pool size
+    """
+    return tk.asint(tk.config.get(HTTP_POOL_SIZE_KEY, HTTP_POOL_SIZE_DEFAULT))
+
+
+def get_http_host_limits(host):
+    """Returns the limits that apply to downloads from `host`: the maximum
+    number of concurrent downloads across all workers, and the rate of
+    requests per second with the burst allowed above it. 0 means no limit.
+
+    Limits for specific hosts can be set as a JSON object, eg
+    `{"data.example.com": {"concurrency": 2, "rate": 0.5, "burst": 1}}`,
+    hosts not listed use the general settings.
+
+    Returns:
+        dict[str, Any]: host limits dictionary
+    """
+    limits = {
+        u'concurrency': tk.asint(tk.config.get(
+            HTTP_MAX_PER_HOST_KEY, HTTP_MAX_PER_HOST_DEFAULT)),
+        u'rate': float(tk.config.get(
+            HTTP_RATE_PER_HOST_KEY, HTTP_RATE_PER_HOST_DEFAULT)),
+    }
+    limits.update(get_http_limits_by_host().get(host, {}))
+    limits.setdefault(u'burst', max(limits[u'rate'], 1))
+    return limits
+
+
+# Parsed host limits, by the JSON text they were parsed from
+_limits_by_host = {}
+
+
+def get_http_limits_by_host():
+    """Returns the limits set for specific hosts, parsed once per
+    process. Checked when the plugin is loaded, so invalid JSON stops the
+    site from starting rather than failing every download.
+
+    Returns:
+        dict[str, dict]: limits dictionary by host
+    """
+    host_limits = tk.config.get(HTTP_HOST_LIMITS_KEY)
+    if not host_limits:
+        return {}
+    if host_limits not in _limits_by_host:
+        try:
+            parsed = json.loads(host_limits)
+        except ValueError:
+            parsed = None
+        if not isinstance(parsed, dict) or not all(
+                isinstance(limits, dict) for limits in parsed.values()):
+            raise ValueError(u'{} must be a JSON object with the limits of '
+                             u'each host'.format(HTTP_HOST_LIMITS_KEY))
+        _limits_by_host.clear()
+        _limits_by_host[host_limits] = parsed
+    return _limits_by_host[host_limits]
+
+
+def get_job_options(size_class=None):
+    """Returns the limits of validation jobs, in seconds: how long a job
+    can wait in the queue (`ttl`), and how much wall clock time
+    (`timeout`) and CPU time (`cpu_budget`) it can take to run. 0 means
+    no limit for the last two.
+
+    With a `size_class`, the timeout can be set for jobs of that class.
+
+    Returns:
+        dict[str, int]: job options dictionary
+    """
+    timeout = tk.config.get(JOB_TIMEOUT_KEY, JOB_TIMEOUT_DEFAULT)
+    if size_class:
+        timeout = tk.config.get(
+            SIZE_CLASS_TIMEOUT_KEY.format(size_class), timeout)
+    return {
+        u'ttl': tk.asint(tk.config.get(JOB_TTL_KEY, JOB_TTL_DEFAULT)),
+        u'timeout': tk.asint(timeout),
+        u'cpu_budget': tk.asint(tk.config.get(
+            JOB_CPU_BUDGET_KEY, JOB_CPU_BUDGET_DEFAULT)),
+    }
+
+
+def get_scheduler_options():
+    """Returns the options of the re-validation scheduler: how old
+    (in seconds) a validation can get before being run again (`ttl`),
+    the number of validations to enqueue per minute (`rate`) and the
+    seconds to wait before looking again when none is due (`interval`).
+
+    `policies` override the TTL for particular resource formats,
+    organizations (by name) or sources (`upload` or `url`), set as a JSON
+    object like `{"format": {"csv": 86400}, "organization": {"my-org":
+    3600}, "source": {"upload": 2592000}}`. When several apply to a
+    resource, the shortest one is used.
+
+    Returns:
+        dict[str, Any]: scheduler options dictionary
+    """
+    policies = tk.config.get(SCHEDULER_POLICIES_KEY)
+    policies = json.loads(policies) if policies else {}
+    return {
+        u'ttl': tk.asint(tk.config.get(
+            SCHEDULER_TTL_KEY, SCHEDULER_TTL_DEFAULT)),
+        u'policies': {
+            kind: {key.lower(): int(ttl) for key, ttl in policies.get(kind, {}).items()}
+            for kind in (u'format', u'organization', u'source')
+        },
+        u'rate': float(tk.config.get(
+            SCHEDULER_RATE_KEY, SCHEDULER_RATE_DEFAULT)),
+        u'interval': tk.asint(tk.config.get(
+            SCHEDULER_INTERVAL_KEY, SCHEDULER_INTERVAL_DEFAULT)),
+    }
+
+
+def get_retry_options():
+    """Returns how a source that could not be read because of a transient
+    failure is retried: the maximum number of retries (0 disables them),
+    and the initial and maximum delay in seconds between them.
+
+    Returns:
+        dict[str, int]: retry options dictionary
+    """
+    return {
+        u'max': tk.asint(tk.config.get(RETRY_MAX_KEY, RETRY_MAX_DEFAULT)),
+        u'backoff': tk.asint(tk.config.get(
+            RETRY_BACKOFF_KEY, RETRY_BACKOFF_DEFAULT)),
+        u'max_delay': tk.asint(tk.config.get(
+            RETRY_MAX_DELAY_KEY, RETRY_MAX_DELAY_DEFAULT)),
+    }
+
+
+def get_report_compression():
+    """Returns how new validation reports are stored: `none` for JSON
+    text, or the codec (`gzip` or `zstd`) used to compress them, and the
+    compression level, None for the codec default.
+
+    Returns:
+        tuple[str, int]: codec and level
+    """
+    codec = tk.config.get(
+        REPORT_COMPRESSION_KEY, REPORT_COMPRESSION_DEFAULT) or u'none'
+    if codec not in REPORT_CODECS:
+        raise ValueError(u'{} must be one of {}'.format(
+            REPORT_COMPRESSION_KEY, u', '.join(REPORT_CODECS)))
+    level = tk.config.get(REPORT_COMPRESSION_LEVEL_KEY)
+    return codec, tk.asint(level) if level else None
+
+
+def get_report_offload():
+    """Returns the size in bytes of the JSON text of a report above which
+    it is stored as a file instead of in the database (0 to keep all of
+    them in the database), and the directory the files go to, by default
+    `validation_reports` in the CKAN storage path.
+
+    Returns:
+        dict[str, Any]: offload options dictionary
+    """
+    size = tk.asint(tk.config.get(
+        REPORT_OFFLOAD_SIZE_KEY, REPORT_OFFLOAD_SIZE_DEFAULT))
+    path = tk.config.get(REPORT_OFFLOAD_PATH_KEY)
+    if not path and tk.config.get(u'ckan.storage_path'):
+        path = os.path.join(
+            tk.config.get(u'ckan.storage_path'), u'validation_reports')
+    if size and not path:
+        raise ValueError(u'{} or ckan.storage_path must be set to '
+                         u'offload reports'.format(REPORT_OFFLOAD_PATH_KEY))
+    return {u'size': size, u'path': path}
+
+
+def get_history_retention():
+    """Returns how many runs of each resource are kept in the validation
+    history, and for how many days. 0 means no limit.
+
+    Returns:
+        dict[str, int]: retention options dictionary
+    """
+    return {
+        u'runs': tk.asint(tk.config.get(
+            HISTORY_RUNS_KEY, HISTORY_RUNS_DEFAULT)),
+        u'days': tk.asint(tk.config.get(
+            HISTORY_DAYS_KEY, HISTORY_DAYS_DEFAULT)),
+    }
+
+
+def get_status_writeback():
+    """Returns how the status of a finished job is stored in the
+    `validation_status` and `validation_timestamp` fields of its
+    resource: `patch` to call `resource_patch`, or `direct` to write them
+    to the resource table and reindex the dataset.
+
+    Returns:
+        str: status write-back mode
+    """
+    mode = tk.config.get(STATUS_WRITEBACK_KEY, STATUS_WRITEBACK_DEFAULT)
+    if mode not in STATUS_WRITEBACKS:
+        raise ValueError(u'{} must be one of {}'.format(
+            STATUS_WRITEBACK_KEY, u', '.join(STATUS_WRITEBACKS)))
+    return mode
+
+
+def get_reindex_window():
+    """Returns for how many seconds the reindex of a dataset whose
+    resources were validated is delayed, so the validations finished in
+    the meantime are indexed together. 0 reindexes it after every job.
+
+    Returns:
+        int: reindex window in seconds
+    """
+    return tk.asint(tk.config.get(REINDEX_WINDOW_KEY, REINDEX_WINDOW_DEFAULT))
+
+
+def get_pipeline_options(observer=None):
+    """Returns how validation reports are sent to the `IPipeValidation`
+    observers: `sync` to call them in the validation job, or `async` to
+    send them to each observer in its own background job, in the queue
+    given (the default one if not set) and with the timeout in seconds
+    of `observer`, if given, or else the default one.
+
+    Returns:
+        dict[str, Any]: pipeline options dictionary
+    """
+    mode = tk.config.get(PIPELINE_MODE_KEY, PIPELINE_MODE_DEFAULT)
+    if mode not in PIPELINE_MODES:
+        raise ValueError(u'{} must be one of {}'.format(
+            PIPELINE_MODE_KEY, u', '.join(PIPELINE_MODES)))
+    timeout = tk.config.get(PIPELINE_TIMEOUT_KEY, PIPELINE_TIMEOUT_DEFAULT)
+    if observer:
+        timeout = tk.config.get(
+            PIPELINE_OBSERVER_TIMEOUT_KEY.format(observer), timeout)
+    return {
+        u'mode': mode,
+        u'queue': tk.config.get(PIPELINE_QUEUE_KEY),
+        u'timeout': tk.asint(timeout),
+    }
+
+
+def get_report_page_cache():
+    """Returns for how many seconds the rendered report of the validation
+    report page is cached, 0 to render it on every request.
+
+    Returns:
+        int: cache time to live in seconds
+    """
+    return tk.asint(tk.config.get(
+        REPORT_PAGE_CACHE_KEY, REPORT_PAGE_CACHE_DEFAULT))
+
+
+def get_status_events_timeout():
+    """Returns for how many seconds a client is sent the status changes
+    of a validation job before it has to connect again, 0 to disable
+    the status events endpoint.
+
+    Returns:
+        int: timeout in seconds
+    """
+    return tk.asint(tk.config.get(
+        STATUS_EVENTS_TIMEOUT_KEY, STATUS_EVENTS_TIMEOUT_DEFAULT))
+
+
 def get_supported_formats():
     """Returns a list of supported formats to validate.
     We use a tabulator to parse the file contents, so only those formats for
@@ -0,0 +1,95 @@
+# encoding: utf-8
+
+import datetime
+import logging
+
+from sqlalchemy import func, literal
+
+from ckan import model
+
+from ckanext.validation import settings
+from ckanext.validation.model import Validation, ValidationStat
+
+log = logging.getLogger(__name__)
+
+# Columns the statistics can be filtered by
+FILTER_COLUMNS = (u'organization', u'format', u'status')
+
+
+def refresh(now=None):
+    u'''
+    Rebuild the validation statistics of the site with a single
+    INSERT ... SELECT, grouping the active resources of the supported
+    formats by organization, format and validation status.
+
+    The old statistics are replaced in the same transaction, so they
+    can be read while they are being refreshed.
+
+    Returns the number of resources counted.
+    '''
+    now = now or datetime.datetime.utcnow()
+    session = model.Session
+
+    organization = func.coalesce(model.Group.name, u'')
+    _format = func.lower(model.Resource.format)
+    status = func.coalesce(Validation.status, u'none')
+    counts = session.query(
+        organization, _format, status,
+        func.count(model.Resource.id),
+        func.coalesce(func.sum(model.Resource.size), 0),
+        literal(now),
+    ).join(
+        model.Package, model.Package.id == model.Resource.package_id
+    ).outerjoin(
+        model.Group, model.Group.id == model.Package.owner_org
+    ).outerjoin(
+        Validation, Validation.resource_id == model.Resource.id
+    ).filter(
+        model.Resource.state == u'active',
+        model.Package.state == u'active',
+        _format.in_(settings.get_supported_formats()),
+    ).group_by(organization, _format, status)
+
+    table = ValidationStat.__table__
+    session.execute(table.delete())
+    session.execute(table.insert().from_select(
+        [table.c.organization, table.c.format, table.c.status,
+         table.c.count, table.c.bytes, table.c.last_updated],
+        counts))
+    total = session.query(
+        func.coalesce(func.sum(ValidationStat.count), 0)).scalar()
+    session.commit()
+    log.info(u'Validation statistics refreshed, %s resources', total)
+    return total
+
+
+def get_stats(filters=None):
+    u'''
+    Returns the stored statistics matching the `filters` given for any
+    of the organization, format and status, with the totals by status
+    and when they were last refreshed.
+    '''
+    query = model.Session.query(ValidationStat)
+    for column in FILTER_COLUMNS:
+        value = (filters or {}).get(column)
+        if value:
+            query = query.filter(getattr(ValidationStat, column) == value)
+    rows = query.order_by(ValidationStat.organization, ValidationStat.format,
+                          ValidationStat.status).all()
+
+    totals = {}
+    for row in rows:
+        totals[row.status] = totals.get(row.status, 0) + row.count
+    last_updated = max([row.last_updated for row in rows] or [None])
+
+    return {
+        u'last_updated': last_updated.isoformat() if last_updated else None,
+        u'totals': totals,
+        u'stats': [{
+            u'organization': row.organization,
+            u'format': row.format,
+            u'status': row.status,
+            u'count': row.count,
+            u'bytes': row.bytes,
+        } for row in rows],
+    }
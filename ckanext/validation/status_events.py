@@ -0,0 +1,78 @@
+# encoding: utf-8
+
+import json
+import logging
+import time
+
+from six import ensure_text
+
+from ckanext.validation.validation_status_helper import (
+    FINAL_STATUSES, ValidationStatusHelper, redis_connection)
+
+log = logging.getLogger(__name__)
+
+# Seconds between the comments sent to keep an idle connection open
+KEEPALIVE = 15
+# Milliseconds browsers wait before connecting again
+RETRY = 3000
+
+
+def subscribe(resource_id):
+    u'''
+    Returns a Redis pub/sub subscribed to the status changes of the job of
+    a resource. Subscribe before reading the current status, so no change
+    is missed in between.
+    '''
+    pubsub = redis_connection().pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(ValidationStatusHelper().statusChannel(resource_id))
+    return pubsub
+
+
+def status_event(resource_id, record):
+    u'''
+    Returns the event for the status of the validation `record` of a
+    resource, as published by `ValidationStatusHelper.publishStatus`.
+    '''
+    if record is None:
+        return {u'resource_id': resource_id, u'status': None,
+                u'finished': None}
+    return {
+        u'resource_id': resource_id,
+        u'status': record.status,
+        u'finished': record.finished.isoformat() if record.finished else None,
+    }
+
+
+def stream(pubsub, current, timeout):
+    u'''
+    Yields the server-sent events of the status changes of a job: the
+    `current` status first, then each change published on `pubsub`,
+    until the job is over or `timeout` seconds went by. Browsers
+    connect again after the timeout, clients should stop once they get a
+    final status.
+    '''
+    try:
+        yield u'retry: {}\n\n'.format(RETRY)
+        yield _format(current)
+        deadline = time.time() + timeout
+        while current[u'status'] not in FINAL_STATUSES:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return
+            message = pubsub.get_message(timeout=min(KEEPALIVE, remaining))
+            if message is None:
+                yield u': keepalive\n\n'
+                continue
+            if message.get(u'type') != u'message':
+                continue
+            event = json.loads(ensure_text(message[u'data']))
+            # Already sent if published while the status was being read
+            if event != current:
+                current = event
+                yield _format(current)
+    finally:
+        pubsub.close()
+
+
+def _format(event):
+    return u'event: status\ndata: {}\n\n'.format(json.dumps(event))
@@ -0,0 +1,106 @@
+# encoding: utf-8
+
+import logging
+
+from sqlalchemy import func, or_
+
+from ckan import model
+
+from ckanext.validation import compat, report_storage
+from ckanext.validation.model import Validation, ValidationReportError
+from ckanext.validation.validation_status_helper import StatusTypes
+
+log = logging.getLogger(__name__)
+
+# Statuses of a job with a report, and errors stored for it
+REPORT_STATUSES = (StatusTypes.success, StatusTypes.failure, StatusTypes.error)
+
+
+def _error_count():
+    # Correlated to each resource, so it is counted with the index on
+    # validation_error.resource_id instead of aggregating the whole table
+    return compat.scalar_subquery(model.Session.query(
+        func.count(ValidationReportError.id)
+    ).filter(
+        ValidationReportError.resource_id == model.Resource.id
+    ).correlate(model.Resource)).label(u'error_count')
+
+
+def validation_rows(resource_ids=None, package_ids=None, include_report=False):
+    u'''
+    Returns the validation status of the active resources with the given
+    ids, or of the packages with the given ids or names, in a single
+    query. Resources never validated are included, with no status.
+
+    Each row has the resource and package ids, the package name, the
+    fields of its Validation record and the number of errors stored for
+    it, plus the report columns if `include_report` is set.
+    '''
+    columns = [
+        model.Resource.id.label(u'resource_id'),
+        model.Resource.package_id,
+        model.Package.name.label(u'package_name'),
+        Validation.status,
+        Validation.created,
+        Validation.finished,
+        Validation.retries,
+        Validation.cause,
+        _error_count(),
+    ]
+    if include_report:
+        columns += [Validation.report, Validation.report_data,
+                    Validation.report_path]
+
+    query = model.Session.query(*columns).join(
+        model.Package, model.Package.id == model.Resource.package_id
+    ).outerjoin(
+        Validation, Validation.resource_id == model.Resource.id
+    ).filter(model.Resource.state == u'active')
+
+    if resource_ids is not None:
+        query = query.filter(model.Resource.id.in_(resource_ids))
+    if package_ids is not None:
+        query = query.filter(or_(model.Package.id.in_(package_ids),
+                                 model.Package.name.in_(package_ids)))
+
+    return query.order_by(model.Resource.package_id,
+                          model.Resource.position).all()
+
+
+def row_dictize(row, include_report=False):
+    out = {
+        u'resource_id': row.resource_id,
+        u'package_id': row.package_id,
+        u'status': row.status,
+        u'created': row.created.isoformat() if row.created else None,
+        u'finished': row.finished.isoformat() if row.finished else None,
+        u'retries': row.retries,
+        u'cause': row.cause,
+        # Errors are stored when a job finishes, they belong to the
+        # previous job while a new one is pending
+        u'error_count': row.error_count
+        if row.status in REPORT_STATUSES else None,
+    }
+    if include_report:
+        out[u'report'] = report_storage.load(row) if row.status else None
+    return out
+
+
+def package_summary(package_id, name, rows, include_report=False):
+    u'''
+    Returns the number of resources of a package in each validation
+    status, the total of their errors and the status of each of them.
+    '''
+    resources = [row_dictize(row, include_report) for row in rows]
+    status_counts = {}
+    for resource in resources:
+        status = resource[u'status'] or u'none'
+        status_counts[status] = status_counts.get(status, 0) + 1
+    return {
+        u'package_id': package_id,
+        u'name': name,
+        u'resources': resources,
+        u'status_counts': status_counts,
+        u'error_count': sum(resource[u'error_count'] or 0
+                            for resource in resources),
+    }
@@ -1,7 +1,13 @@
 # encoding: utf-8
 
+import datetime
+
 from werkzeug.datastructures import FileStorage
 
+from ckan.model import Session
+
+from ckanext.validation.model import Validation, ValidationReportError
+
 MOCK_COULD_BE_VALIDATED = "ckanext.validation.utils.is_resource_could_be_validated"
 MOCK_SYNC_VALIDATE = "ckanext.validation.jobs.validate"
 MOCK_ASYNC_VALIDATE = "ckanext.validation.jobs.validate"
@@ -185,3 +191,17 @@ ERROR_REPORT = {
 
 class MockFileStorage(FileStorage):
     pass
+
+
+def validated(resource_id, status='success', finished=None, report=None,
+              errors=0):
+    """Store a finished validation of a resource, with `errors` stored
+    type-error errors."""
+    finished = finished or datetime.datetime.utcnow()
+    Session.add(Validation(resource_id=resource_id, status=status,
+                           created=finished, finished=finished,
+                           report=report))
+    for _i in range(errors):
+        Session.add(ValidationReportError(resource_id=resource_id,
+                                          type='type-error'))
+    Session.commit()
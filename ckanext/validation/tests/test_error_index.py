@@ -0,0 +1,194 @@
+# encoding: utf-8
+
+import mock
+import pytest
+import ckantoolkit as tk
+
+from ckan import model
+from ckan.model import Session
+from ckan.tests.helpers import call_action, call_auth
+from ckan.tests import factories
+
+from ckanext.validation import error_index
+from ckanext.validation.jobs import run_validation_job
+from ckanext.validation.model import ValidationReportError
+
+from .helpers import INVALID_REPORT, MOCK_ASYNC_VALIDATE
+
+
+def _error(type, field=None, row=None):
+    return {'type': type, 'fieldName': field or '', 'rowNumber': row,
+            'message': 'Error of type {}'.format(type)}
+
+
+def _report(*errors):
+    return {'valid': False, 'tasks': [{'errors': list(errors)}]}
+
+
+def _errors(resource_id):
+    return Session.query(ValidationReportError).filter(
+        ValidationReportError.resource_id == resource_id).count()
+
+
+class TestRowsFromReport(object):
+
+    def test_rows(self):
+        rows = error_index.rows_from_report('res-1', _report(
+            _error('type-error', 'date', 2), _error('blank-row', row=3),
+            _error('duplicate-label', 'name')))
+
+        columns = ('resource_id', 'type', 'field', 'row_number', 'message')
+        assert [dict((c, row[c]) for c in columns) for row in rows] == [
+            {'resource_id': 'res-1', 'type': 'type-error', 'field': 'date',
+             'row_number': 2, 'message': 'Error of type type-error'},
+            {'resource_id': 'res-1', 'type': 'blank-row', 'field': None,
+             'row_number': 3, 'message': 'Error of type blank-row'},
+            {'resource_id': 'res-1', 'type': 'duplicate-label',
+             'field': 'name', 'row_number': None,
+             'message': 'Error of type duplicate-label'},
+        ]
+
+    def test_rows_details(self):
+        rows = error_index.rows_from_report('res-1', {'tasks': [
+            {'errors': []},
+            {'errors': [
+                {'type': 'type-error', 'fieldName': 'date', 'fieldNumber': 2,
+                 'rowNumber': 4, 'cell': 'x', 'cells': ['1', 'x'],
+                 'note': 'type is "date/default"'},
+                {'type': 'duplicate-label', 'fieldName': 'id',
+                 'fieldNumber': 3, 'label': 'id', 'labels': ['id', 'a', 'id']},
+            ]},
+        ]})
+
+        assert [(row['task'], row['field_number'], row['cell'], row['cells'])
+                for row in rows] == [
+            (1, 2, 'x', ['1', 'x']), (1, 3, 'id', ['id', 'a', 'id'])]
+        assert rows[0]['note'] == 'type is "date/default"'
+
+    def test_no_report(self):
+        assert error_index.rows_from_report('res-1', None) == []
+
+
+@pytest.mark.usefixtures("clean_db", "validation_setup")
+class TestErrorIndex(object):
+
+    def test_replace_errors(self):
+        error_index.replace_errors(Session, 'res-1', _report(
+            _error('type-error', 'date', 2), _error('type-error', 'date', 3)))
+        error_index.replace_errors(Session, 'res-2', _report(
+            _error('blank-row', row=2)))
+
+        assert error_index.replace_errors(Session, 'res-1', _report(
+            _error('blank-row', row=5))) == 1
+
+        assert _errors('res-1') == 1
+        assert _errors('res-2') == 1
+
+    def test_report_errors(self):
+        error_index.replace_errors(Session, 'res-1', _report(
+            _error('blank-row', row=2),
+            {'type': 'duplicate-label', 'fieldName': 'id', 'fieldNumber': 3,
+             'label': 'id', 'labels': ['id', 'a', 'id'], 'note': '',
+             'message': 'Label "id" is duplicated'}))
+        query = Session.query(ValidationReportError).order_by(
+            ValidationReportError.id)
+
+        count, errors = error_index.report_errors(query, offset=1, limit=1)
+
+        assert count == 2
+        assert errors == [(0, {
+            'type': 'duplicate-label', 'title': 'Duplicate Label',
+            'description': errors[0][1]['description'],
+            'tags': ['#table', '#header', '#label'],
+            'message': 'Label "id" is duplicated', 'note': '',
+            'fieldName': 'id', 'fieldNumber': 3,
+            'label': 'id', 'labels': ['id', 'a', 'id']})]
+
+    @mock.patch(MOCK_ASYNC_VALIDATE, return_value=INVALID_REPORT)
+    def test_job_stores_errors(self, mock_validate, resource_factory):
+        resource = resource_factory()
+
+        run_validation_job(resource)
+
+        error = Session.query(ValidationReportError).one()
+        assert error.resource_id == resource['id']
+        assert error.type == 'missing-cell'
+        assert error.field == 'd'
+        assert error.row_number == 2
+
+    @mock.patch(MOCK_ASYNC_VALIDATE, return_value=INVALID_REPORT)
+    def test_delete_removes_errors(self, mock_validate, resource_factory):
+        resource = resource_factory()
+        run_validation_job(resource)
+
+        call_action('resource_validation_delete', resource_id=resource['id'])
+
+        assert _errors(resource['id']) == 0
+
+
+@pytest.mark.usefixtures("clean_db", "validation_setup")
+class TestErrorActions(object):
+
+    def _index(self):
+        error_index.replace_errors(Session, 'res-1', _report(
+            _error('type-error', 'date', 2), _error('type-error', 'date', 3),
+            _error('type-error', 'id', 3), _error('blank-row', row=4)))
+        error_index.replace_errors(Session, 'res-2', _report(
+            _error('type-error', 'date', 2)))
+
+    def test_aggregate_by_type(self):
+        self._index()
+
+        assert call_action('validation_errors_aggregate') == [
+            {'type': 'type-error', 'count': 4, 'resources': 2},
+            {'type': 'blank-row', 'count': 1, 'resources': 1},
+        ]
+
+    def test_aggregate_by_type_and_field(self):
+        self._index()
+
+        result = call_action('validation_errors_aggregate',
+                             group_by='type,field', type='type-error')
+
+        assert result == [
+            {'type': 'type-error', 'field': 'date', 'count': 3,
+             'resources': 2},
+            {'type': 'type-error', 'field': 'id', 'count': 1,
+             'resources': 1},
+        ]
+
+    def test_aggregate_limit(self):
+        self._index()
+
+        result = call_action('validation_errors_aggregate',
+                             group_by=['resource_id'], limit=1)
+
+        assert result == [{'resource_id': 'res-1', 'count': 4,
+                           'resources': 1}]
+
+    def test_aggregate_unknown_column(self):
+        with pytest.raises(tk.ValidationError):
+            call_action('validation_errors_aggregate', group_by='message')
+
+    def test_search(self):
+        self._index()
+
+        result = call_action('validation_errors_search', field='date',
+                             limit=2)
+
+        assert result['count'] == 3
+        assert [(error['resource_id'], error['row_number'])
+                for error in result['results']] == [('res-1', 2), ('res-1', 3)]
+
+    def test_search_invalid_limit(self):
+        with pytest.raises(tk.ValidationError):
+            call_action('validation_errors_search', limit='all')
+
+    def test_sysadmins_only(self):
+        user = factories.User()
+        context = {'user': user['name'], 'model': model}
+
+        for action in ('validation_errors_aggregate',
+                       'validation_errors_search'):
+            with pytest.raises(tk.NotAuthorized):
+                call_auth(action, context=context)
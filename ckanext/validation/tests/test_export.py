@@ -0,0 +1,97 @@
+# encoding: utf-8
+
+import io
+import json
+
+import mock
+import pytest
+import ckantoolkit as tk
+
+from ckan.tests.helpers import call_action
+from ckan.tests import factories
+
+from ckanext.validation import export
+from ckanext.validation.jobs import run_validation_job
+
+from .helpers import INVALID_REPORT, MOCK_ASYNC_VALIDATE
+
+
+def _url(resource, export_format):
+    return '/dataset/{}/resource/{}/validation/errors.{}'.format(
+        resource['package_id'], resource['id'], export_format)
+
+
+@pytest.mark.usefixtures("clean_db", "validation_setup")
+class TestExport(object):
+
+    @mock.patch(MOCK_ASYNC_VALIDATE, return_value=INVALID_REPORT)
+    def test_csv(self, mock_validate, app, resource_factory):
+        resource = resource_factory()
+        run_validation_job(resource)
+
+        response = app.get(_url(resource, 'csv'))
+
+        assert response.headers['Content-Type'].startswith('text/csv')
+        lines = response.body.splitlines()
+        assert lines[0] == ','.join(export.COLUMNS)
+        errors = INVALID_REPORT['tasks'][0]['errors']
+        assert len(lines) == len(errors) + 1
+        assert lines[1].startswith('{},{}'.format(
+            resource['id'], errors[0]['type']))
+
+    @mock.patch(MOCK_ASYNC_VALIDATE, return_value=INVALID_REPORT)
+    def test_ndjson_filtered(self, mock_validate, app, resource_factory):
+        resource = resource_factory()
+        run_validation_job(resource)
+        error_type = INVALID_REPORT['tasks'][0]['errors'][0]['type']
+
+        response = app.get(_url(resource, 'ndjson'),
+                           query_string={'error_types': error_type})
+
+        errors = [json.loads(line) for line in response.body.splitlines()]
+        assert errors
+        assert set(error['type'] for error in errors) == {error_type}
+
+    @mock.patch(MOCK_ASYNC_VALIDATE, return_value=INVALID_REPORT)
+    def test_parquet(self, mock_validate, app, resource_factory):
+        parquet = pytest.importorskip('pyarrow.parquet')
+        resource = resource_factory()
+        run_validation_job(resource)
+
+        response = app.get(_url(resource, 'parquet'))
+
+        table = parquet.read_table(io.BytesIO(response.data))
+        assert table.num_rows == len(INVALID_REPORT['tasks'][0]['errors'])
+
+    def test_unknown_format(self, app):
+        resource = factories.Resource(url='https://some.url')
+
+        app.get(_url(resource, 'xml'), status=404)
+
+    @mock.patch(MOCK_ASYNC_VALIDATE, return_value=INVALID_REPORT)
+    def test_action(self, mock_validate, resource_factory):
+        resource = resource_factory()
+        run_validation_job(resource)
+
+        result = call_action('resource_validation_export',
+                             resource_id=resource['id'], format='ndjson',
+                             fields=['d'])
+
+        assert result['format'] == 'ndjson'
+        assert result['url'].split('?')[0].endswith(
+            '/validation/errors.ndjson')
+        assert 'fields=d' in result['url']
+        assert result['count'] == 1
+
+        result = call_action('resource_validation_export',
+                             resource_id=resource['id'], fields=['a'])
+
+        assert result['format'] == 'csv'
+        assert result['count'] == 0
+
+    def test_action_not_validated(self):
+        resource = factories.Resource(url='https://some.url')
+
+        with pytest.raises(tk.ObjectNotFound):
+            call_action('resource_validation_export',
+                        resource_id=resource['id'])
@@ -1,4 +1,5 @@
 import datetime
+import json
 
 import pytest
 import mock
@@ -77,6 +78,49 @@ class TestBadges(object):
         _assert_validation_badge_status(resource, 'unknown')
 
 
+class TestBadgesPrefetch(object):
+
+    def _dataset(self):
+        schema = json.dumps(SCHEMA)
+        return {
+            'id': 'some-dataset-id',
+            'extras': [{'key': 'default_data_schema', 'value': schema}],
+            'resources': [{
+                'id': 'resource-{}'.format(i),
+                'package_id': 'some-dataset-id',
+                'validation_status': 'success',
+                'align_default_schema': i % 2 == 0,
+                'schema': None if i % 2 == 0 else schema,
+            } for i in range(4)],
+        }
+
+    @mock.patch('ckanext.validation.helpers.get_default_schema')
+    def test_prefetched_default_schema(self, mock_default_schema, app):
+        dataset = self._dataset()
+
+        with app.flask_app.test_request_context():
+            h.validation_prefetch_badges(dataset)
+            badges = [h.get_validation_badge(resource, in_listing=True)
+                      for resource in dataset['resources']]
+
+        assert all('class="status success"' in badge for badge in badges)
+        assert not mock_default_schema.called
+
+    @mock.patch('ckanext.validation.helpers.get_default_schema')
+    def test_schemas_parsed_once_per_request(self, mock_default_schema, app):
+        dataset = self._dataset()
+        mock_default_schema.return_value = json.dumps(SCHEMA)
+
+        with app.flask_app.test_request_context():
+            with mock.patch('ckanext.validation.helpers.json.loads',
+                            side_effect=json.loads) as mock_loads:
+                for resource in dataset['resources']:
+                    h.get_validation_badge(resource)
+
+        mock_default_schema.assert_called_once_with('some-dataset-id')
+        assert mock_loads.call_count == 1
+
+
 class TestExtractReportFromErrors(object):
 
     def test_report_extracted(self):
@@ -0,0 +1,85 @@
+# encoding: utf-8
+
+import datetime
+
+import mock
+import pytest
+
+from ckan.model import Session
+from ckan.tests.helpers import call_action
+
+from ckanext.validation import history
+from ckanext.validation.jobs import run_validation_job
+from ckanext.validation.model import Validation, ValidationRun
+
+from .helpers import INVALID_REPORT, VALID_REPORT, MOCK_ASYNC_VALIDATE
+
+NOW = datetime.datetime(2026, 1, 1)
+
+
+def _add_runs(resource_id, days_ago):
+    for days in days_ago:
+        finished = NOW - datetime.timedelta(days=days)
+        Session.add(ValidationRun(resource_id=resource_id, status=u'success',
+                                  created=finished, finished=finished))
+    Session.commit()
+
+
+def _kept(resource_id):
+    return sorted((NOW - finished).days for finished, in Session.query(
+        ValidationRun.finished).filter(
+            ValidationRun.resource_id == resource_id))
+
+
+@pytest.mark.usefixtures("clean_db", "validation_setup")
+class TestHistory(object):
+
+    @mock.patch(MOCK_ASYNC_VALIDATE, side_effect=[INVALID_REPORT, VALID_REPORT])
+    def test_one_run_per_job(self, mock_validate, resource_factory):
+        resource = resource_factory()
+
+        run_validation_job(resource)
+        run_validation_job(resource)
+
+        runs = call_action('resource_validation_history',
+                           resource_id=resource['id'])
+        assert [run['status'] for run in runs] == ['success', 'failure']
+        assert runs[1]['errors'] == 1
+        assert runs[1]['rows'] == 1
+        assert runs[0]['digest'] != runs[1]['digest']
+
+    def test_cancelled_job_is_recorded(self, resource_factory):
+        resource = resource_factory(format='PDF')
+        Session.add(Validation(resource_id=resource['id'], status=u'created',
+                               created=datetime.datetime.utcnow()))
+        Session.commit()
+
+        call_action('resource_validation_cancel', resource_id=resource['id'])
+
+        runs = call_action('resource_validation_history',
+                           resource_id=resource['id'])
+        assert [run['status'] for run in runs] == ['cancelled']
+        assert runs[0]['digest'] is None
+
+    def test_prune_by_count(self):
+        _add_runs(u'res-1', [1, 2, 3, 4])
+        _add_runs(u'res-2', [1, 2])
+
+        assert sum(history.prune(runs=2, days=0, now=NOW)) == 2
+
+        assert _kept(u'res-1') == [1, 2]
+        assert _kept(u'res-2') == [1, 2]
+
+    def test_prune_by_age(self):
+        _add_runs(u'res-1', [1, 10, 100])
+
+        assert sum(history.prune(runs=0, days=30, now=NOW)) == 1
+
+        assert _kept(u'res-1') == [1, 10]
+
+    def test_prune_in_batches(self):
+        _add_runs(u'res-1', [1, 2, 3, 4, 5])
+
+        assert list(history.prune(runs=1, days=0, batch_size=2,
+                                  now=NOW)) == [2, 2]
+        assert _kept(u'res-1') == [1]
@@ -0,0 +1,107 @@
+# encoding: utf-8
+
+import json
+import uuid
+
+import mock
+import pytest
+
+from ckanext.validation import http_client
+from ckanext.validation import settings as s
+
+
+class TestSession(object):
+
+    def test_session_is_shared(self):
+        assert http_client.get_session() is http_client.get_session()
+
+    def test_session_with_headers_shares_pools(self):
+        session = http_client.get_session({'Authorization': 'some-key'})
+
+        assert session is not http_client.get_session()
+        assert session.headers['Authorization'] == 'some-key'
+        assert 'Authorization' not in http_client.get_session().headers
+        assert session.adapters is http_client.get_session().adapters
+
+    @pytest.mark.ckan_config('ckan.download_proxy', 'http://proxy:3128')
+    def test_proxy_is_applied(self, monkeypatch):
+        monkeypatch.setattr(http_client, '_state', {})
+
+        assert http_client.get_session().proxies == {
+            'http': 'http://proxy:3128', 'https': 'http://proxy:3128'}
+
+    def test_get_host(self):
+        assert http_client.get_host('https://example.com/a.csv') == \
+            'example.com'
+        assert http_client.get_host('/var/lib/ckan/resources/a.csv') is None
+        assert http_client.get_host(None) is None
+
+
+class TestHostLimits(object):
+
+    def test_no_limits_by_default(self):
+        limits = s.get_http_host_limits('example.com')
+
+        assert limits['concurrency'] == 0
+        assert limits['rate'] == 0
+
+    @pytest.mark.ckan_config(s.HTTP_MAX_PER_HOST_KEY, '4')
+    @pytest.mark.ckan_config(s.HTTP_HOST_LIMITS_KEY, json.dumps(
+        {'slow.example.com': {'concurrency': 1, 'rate': 0.5}}))
+    def test_per_host_limits(self):
+        assert s.get_http_host_limits('example.com')['concurrency'] == 4
+
+        limits = s.get_http_host_limits('slow.example.com')
+        assert limits['concurrency'] == 1
+        assert limits['rate'] == 0.5
+        assert limits['burst'] == 1
+
+    @pytest.mark.ckan_config(s.HTTP_HOST_LIMITS_KEY, json.dumps(
+        {'slow.example.com': {'concurrency': 1}}))
+    def test_host_limits_are_parsed_once(self):
+        s.get_http_host_limits('slow.example.com')
+
+        with mock.patch.object(s.json, 'loads') as mock_loads:
+            s.get_http_host_limits('slow.example.com')
+
+        assert not mock_loads.called
+
+    @pytest.mark.parametrize('host_limits', [
+        '{"slow.example.com": ', '["slow.example.com"]', '{"a": 1}'])
+    def test_invalid_host_limits(self, host_limits, ckan_config,
+                                 monkeypatch):
+        monkeypatch.setitem(ckan_config, s.HTTP_HOST_LIMITS_KEY, host_limits)
+
+        with pytest.raises(ValueError, match=s.HTTP_HOST_LIMITS_KEY):
+            s.get_http_limits_by_host()
+
+
+class TestHostLimiter(object):
+
+    def test_slots_are_capped(self):
+        limiter = http_client.get_limiter()
+        key = limiter._key('slots', uuid.uuid4().hex)
+
+        assert limiter._acquire_slot(keys=[key], args=[1000, 1, 'a', 60])
+        assert not limiter._acquire_slot(keys=[key], args=[1001, 1, 'b', 60])
+        # Lease of the first holder expired
+        assert limiter._acquire_slot(keys=[key], args=[1061, 1, 'b', 60])
+
+    def test_tokens_are_rate_limited(self):
+        limiter = http_client.get_limiter()
+        key = limiter._key('rate', uuid.uuid4().hex)
+
+        assert float(limiter._take_token(keys=[key], args=[1000, 1, 1])) == 0
+        assert float(limiter._take_token(keys=[key], args=[1000, 1, 1])) > 0
+        assert float(limiter._take_token(keys=[key], args=[1002, 1, 1])) == 0
+
+    def test_bucket_in_debt_is_kept_until_refilled(self):
+        limiter = http_client.get_limiter()
+        key = limiter._key('rate', uuid.uuid4().hex)
+
+        for _i in range(5):
+            wait = float(limiter._take_token(keys=[key], args=[1000, 1, 1]))
+
+        assert wait == 4
+        # 4 tokens owed and 1 to refill, at 1 per second
+        assert limiter.redis.ttl(key) >= 6
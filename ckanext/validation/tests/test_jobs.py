@@ -1,5 +1,6 @@
 # encoding: utf-8
 
+import copy
 import io
 import json
 from faker import Faker
@@ -16,10 +17,18 @@ from ckan.tests import factories
 from ckanext.validation import settings as s
 from ckanext.validation.model import Validation
 from ckanext.validation.jobs import (
+    JobBudget,
+    _queue_drained,
+    get_transient_cause,
     run_validation_job,
     uploader,
     Session,
-    requests,
+    http_client,
+)
+from ckanext.validation.validation_status_helper import (
+    ValidationStatusHelper,
+    ValidationJobCancelled,
+    ValidationJobTimeout,
 )
 from .helpers import (
     INVALID_REPORT,
@@ -51,7 +60,7 @@ class TestValidationJob(object):
     @mock.patch(MOCK_ASYNC_VALIDATE, return_value=VALID_REPORT)
     @mock.patch.object(Session, 'commit')
     @mock.patch.object(ckantoolkit, 'get_action')
-    @mock.patch.object(requests, 'Session', return_value='Some_Session')
+    @mock.patch.object(http_client, 'get_session', return_value='Some_Session')
     def test_job_run_no_schema(self, mock_requests, mock_get_action,
                                mock_commit, mock_validate, dataset):
         resource = {
@@ -70,7 +79,7 @@ class TestValidationJob(object):
     @mock.patch(MOCK_ASYNC_VALIDATE, return_value=VALID_REPORT)
     @mock.patch.object(Session, 'commit')
     @mock.patch.object(ckantoolkit, 'get_action')
-    @mock.patch.object(requests, 'Session', return_value='Some_Session')
+    @mock.patch.object(http_client, 'get_session', return_value='Some_Session')
     def test_job_run_schema(self, mock_requests, mock_get_action, mock_commit,
                             mock_validate, dataset):
         json_schema = json.dumps(SCHEMA)
@@ -97,7 +106,7 @@ class TestValidationJob(object):
                        return_value=mock_get_resource_uploader({}))
     @mock.patch.object(Session, 'commit')
     @mock.patch.object(ckantoolkit, 'get_action')
-    @mock.patch.object(requests, 'Session', return_value='Some_Session')
+    @mock.patch.object(http_client, 'get_session', return_value='Some_Session')
     def test_job_run_uploaded_file(self, mock_requests, mock_get_action,
                                    mock_commit, mock_uploader, mock_validate,
                                    dataset):
@@ -188,6 +197,39 @@ class TestValidationJob(object):
         assert res['validation_status'] == validation.status
         assert res['validation_timestamp'] == validation.finished.isoformat()
 
+    @pytest.mark.ckan_config(s.STATUS_WRITEBACK_KEY, 'direct')
+    def test_job_run_status_is_written_without_patching(self, resource_factory):
+        resource = resource_factory(do_not_validate=True)
+
+        with mock.patch.object(ckantoolkit, 'get_action',
+                               wraps=ckantoolkit.get_action) as get_action:
+            run_validation_job(resource)
+
+        assert mock.call('resource_patch') not in get_action.call_args_list
+        res = call_action('resource_show', id=resource['id'])
+        assert res['validation_status'] == 'success'
+        result = call_action('package_search',
+                             fq='vocab_validation_status:success')
+        assert [dataset['id'] for dataset in result['results']] == \
+            [resource['package_id']]
+
+    def test_job_run_status_is_patched(self, resource_factory):
+        resource = resource_factory(do_not_validate=True)
+
+        with mock.patch.object(ckantoolkit, 'get_action',
+                               wraps=ckantoolkit.get_action) as get_action:
+            run_validation_job(resource)
+
+        assert mock.call('resource_patch') in get_action.call_args_list
+
+        validation = Session.query(Validation).filter(
+            Validation.resource_id == resource['id']).one()
+
+        res = call_action('resource_show', id=resource['id'])
+
+        assert res['validation_status'] == validation.status
+        assert res['validation_timestamp'] == validation.finished.isoformat()
+
     def test_job_local_paths_are_hidden(self, resource_factory):
         """Local path for a resource file must be hidden inside report"""
         upload = MockFileStorage(io.BytesIO(INVALID_CSV), 'invalid.csv')
@@ -260,3 +302,207 @@ class TestValidationJob(object):
         assert '"valid": true' in str(validation.report)
         report = json.loads(validation.report)
         assert report["valid"] is True
+
+
+def _timeout_report():
+    report = copy.deepcopy(ERROR_REPORT)
+    error = report['tasks'][0]['errors'][0]
+    error['type'] = 'scheme-error'
+    error['note'] = "HTTPConnectionPool(host='example.com', port=80): Read timed out."
+    return report
+
+
+class TestTransientCause(object):
+
+    def test_transient_failures(self):
+        assert get_transient_cause(
+            "HTTPSConnectionPool(host='x', port=443): Read timed out.") == 'timeout'
+        assert get_transient_cause(
+            '503 Server Error: Service Unavailable for url: http://x') == 'server-error'
+        assert get_transient_cause(
+            '[Errno 104] Connection reset by peer') == 'connection-error'
+
+    def test_permanent_failures(self):
+        assert get_transient_cause('404 Client Error: Not Found for url') is None
+        assert get_transient_cause('the source is empty') is None
+        assert get_transient_cause(None) is None
+
+
+@mock.patch('ckanext.validation.jobs.Queue')
+@mock.patch('ckanext.validation.jobs.get_current_job')
+class TestQueueDrained(object):
+
+    def _job(self, mock_get_current_job, queues):
+        job = mock_get_current_job.return_value
+        job.origin = 'small'
+        job.worker_name = 'worker-1'
+        job.connection.hget.return_value = queues
+        return job
+
+    def test_all_worker_queues_are_checked(self, mock_get_current_job,
+                                           mock_queue):
+        job = self._job(mock_get_current_job, b'small,large')
+        mock_queue.side_effect = lambda name, connection: mock.Mock(
+            count={'small': 0, 'large': 2}[name])
+
+        assert not _queue_drained()
+        job.connection.hget.assert_called_once_with(
+            'rq:worker:worker-1', 'queues')
+
+    def test_drained(self, mock_get_current_job, mock_queue):
+        self._job(mock_get_current_job, b'small,large')
+        mock_queue.return_value.count = 0
+
+        assert _queue_drained()
+
+    def test_job_queue_without_worker_queues(self, mock_get_current_job,
+                                             mock_queue):
+        self._job(mock_get_current_job, None)
+        mock_queue.return_value.count = 0
+
+        assert _queue_drained()
+        mock_queue.assert_called_once_with('small', connection=mock.ANY)
+
+
+@pytest.mark.usefixtures("clean_db", "validation_setup")
+@mock.patch('ckanext.validation.jobs._in_background_job', return_value=True)
+@mock.patch('ckanext.validation.jobs.time.sleep')
+class TestTransientRetries(object):
+
+    url = 'http://example.com/file.csv'
+
+    def test_retry_recovers(self, mock_sleep, mock_in_background_job,
+                            mocked_responses):
+        mocked_responses.add(responses.GET, self.url, body=VALID_CSV)
+        resource = factories.Resource(url=self.url, format='csv')
+
+        with mock.patch(MOCK_ASYNC_VALIDATE,
+                        side_effect=[_timeout_report(), copy.deepcopy(VALID_REPORT)]) as mock_validate:
+            run_validation_job(resource)
+
+        validation = Session.query(Validation).filter(
+            Validation.resource_id == resource['id']).one()
+
+        assert validation.status == 'success'
+        assert validation.retries == 1
+        assert validation.cause == 'timeout'
+        assert mock_sleep.call_count == 1
+        # The second attempt read the copy downloaded to the spool
+        assert mock_validate.call_args_list[1][0][0].startswith('/')
+
+    @pytest.mark.ckan_config(s.RETRY_MAX_KEY, 2)
+    def test_retries_exhausted(self, mock_sleep, mock_in_background_job,
+                               mocked_responses):
+        mocked_responses.add(responses.GET, self.url, status=503)
+        resource = factories.Resource(url=self.url, format='csv')
+
+        with mock.patch(MOCK_ASYNC_VALIDATE, side_effect=lambda *args, **kwargs: _timeout_report()):
+            run_validation_job(resource)
+
+        validation = Session.query(Validation).filter(
+            Validation.resource_id == resource['id']).one()
+
+        assert validation.status == 'error'
+        assert validation.retries == 2
+        assert validation.cause == 'server-error'
+
+    @mock.patch(MOCK_ASYNC_VALIDATE, return_value=ERROR_REPORT)
+    def test_permanent_failure_is_not_retried(self, mock_validate, mock_sleep,
+                                              mock_in_background_job,
+                                              resource_factory):
+        resource = resource_factory()
+
+        run_validation_job(resource)
+
+        validation = Session.query(Validation).filter(
+            Validation.resource_id == resource['id']).one()
+
+        assert validation.status == 'error'
+        assert validation.retries == 0
+        assert validation.cause is None
+        mock_sleep.assert_not_called()
+
+    def test_not_retried_outside_a_job(self, mock_sleep,
+                                       mock_in_background_job,
+                                       mocked_responses):
+        mock_in_background_job.return_value = False
+        resource = factories.Resource(url=self.url, format='csv')
+
+        with mock.patch(MOCK_ASYNC_VALIDATE, return_value=_timeout_report()):
+            run_validation_job(resource)
+
+        validation = Session.query(Validation).filter(
+            Validation.resource_id == resource['id']).one()
+
+        assert validation.status == 'error'
+        assert validation.retries == 0
+        mock_sleep.assert_not_called()
+
+
+class TestJobBudget(object):
+
+    def test_no_limits(self):
+        budget = JobBudget('some-id')
+        budget.cancel_interval = 3600
+
+        budget.check()
+
+    def test_wall_clock_timeout(self):
+        budget = JobBudget('some-id', timeout=10)
+        budget.cancel_interval = 3600
+
+        with mock.patch('ckanext.validation.jobs.time.time',
+                        return_value=budget.started + 11):
+            with pytest.raises(ValidationJobTimeout):
+                budget.check()
+
+    def test_cpu_budget(self):
+        budget = JobBudget('some-id', cpu_budget=5)
+        budget.cancel_interval = 3600
+
+        with mock.patch('ckanext.validation.jobs.time.thread_time',
+                        return_value=budget.cpu_started + 6):
+            with pytest.raises(ValidationJobTimeout):
+                budget.check()
+
+
+@pytest.mark.usefixtures("clean_db", "validation_setup")
+class TestJobCancellation(object):
+
+    def test_cancelled_before_start(self):
+        resource = factories.Resource(url='http://example.com/file.csv', format='csv')
+        ValidationStatusHelper().requestCancel(resource['id'], 60)
+
+        with mock.patch(MOCK_ASYNC_VALIDATE) as mock_validate:
+            run_validation_job(resource)
+
+        mock_validate.assert_not_called()
+        assert not ValidationStatusHelper().isCancelRequested(resource['id'])
+
+    def test_cancelled_while_running(self):
+        resource = factories.Resource(url='http://example.com/file.csv', format='csv')
+
+        with mock.patch(MOCK_ASYNC_VALIDATE,
+                        side_effect=ValidationJobCancelled('Validation job was cancelled')):
+            run_validation_job(resource)
+
+        validation = Session.query(Validation).filter(
+            Validation.resource_id == resource['id']).one()
+
+        assert validation.status == 'cancelled'
+        assert validation.finished
+        assert validation.error == {'message': ['Validation job was cancelled']}
+
+    @pytest.mark.ckan_config(s.JOB_TIMEOUT_KEY, 1)
+    def test_timeout_while_running(self):
+        resource = factories.Resource(url='http://example.com/file.csv', format='csv')
+
+        with mock.patch(MOCK_ASYNC_VALIDATE,
+                        side_effect=ValidationJobTimeout('Validation took longer than 1s')):
+            run_validation_job(resource)
+
+        validation = Session.query(Validation).filter(
+            Validation.resource_id == resource['id']).one()
+
+        assert validation.status == 'timeout'
+        assert validation.report is None
@@ -9,14 +9,23 @@ import mock
 import six
 import pytest
 import ckantoolkit as tk
+import sqlalchemy as sa
+from sqlalchemy.exc import IntegrityError
 
 from ckan.model import Session
 from ckan import model
 from ckan.tests.helpers import call_action, call_auth
 from ckan.tests import factories
 
+from ckanext.validation import error_index
+from ckanext.validation.logic.action import _list_param
 from ckanext.validation.model import Validation
+from ckanext.validation.validation_status_helper import (
+    ValidationStatusHelper, ValidationJobAlreadyEnqueued,
+    ValidationJobAlreadyRunning, ValidationJobDoesNotExist,
+    ValidationJobNotPending)
 from .helpers import (
+    validated,
     VALID_CSV,
     INVALID_CSV,
     LATIN1_CSV,
@@ -119,6 +128,16 @@ class TestResourceValidationRun(object):
         assert validation.report is None
         assert validation.error is None
 
+    def test_one_validation_object_per_resource(self, resource_factory):
+        resource = resource_factory(format="PDF")
+
+        for _i in range(2):
+            Session.add(Validation(resource_id=resource['id'],
+                                   status='created'))
+        with pytest.raises(IntegrityError):
+            Session.commit()
+        Session.rollback()
+
 
 @pytest.mark.usefixtures("clean_db", "validation_setup")
 class TestResourceValidationShow(object):
@@ -173,6 +192,282 @@ class TestResourceValidationShow(object):
         assert validation_show['created'] == validation.created.isoformat()
         assert validation_show['finished'] == validation.finished.isoformat()
 
+    def _resource(self):
+        resource = factories.Resource(url='https://some.url')
+        errors = [
+            {'type': 'type-error', 'fieldName': 'a', 'rowNumber': 1},
+            {'type': 'type-error', 'fieldName': 'b', 'rowNumber': 2},
+            {'type': 'blank-row', 'rowNumber': 3},
+            {'type': 'type-error', 'fieldName': 'a', 'rowNumber': 4},
+        ]
+        report = {'stats': {'errors': 5}, 'tasks': [
+            {'stats': {'errors': 4}, 'errors': errors},
+            {'stats': {'errors': 1}, 'errors': [
+                {'type': 'type-error', 'fieldName': 'a', 'rowNumber': 1}]},
+        ]}
+        validated(resource['id'], 'failure', report=report)
+        error_index.replace_errors(Session, resource['id'], report)
+        return resource
+
+    def test_resource_validation_show_api_context(self):
+        resource = self._resource()
+
+        validation_show = call_action(
+            'resource_validation_show', context={'api_version': 3},
+            resource_id=resource['id'])
+
+        assert validation_show['report']['tasks'][1]['errors'][0]['type'] \
+            == 'type-error'
+
+    def test_resource_validation_show_errors_page(self):
+        resource = self._resource()
+
+        validation_show = call_action(
+            'resource_validation_show', resource_id=resource['id'],
+            errors_offset=3, errors_limit=2)
+
+        assert validation_show['errors_count'] == 5
+        tasks = validation_show['report']['tasks']
+        assert [e['rowNumber'] for e in tasks[0]['errors']] == [4]
+        assert [e['rowNumber'] for e in tasks[1]['errors']] == [1]
+        assert validation_show['report']['stats'] == {'errors': 5}
+        assert tasks[1]['errors'][0]['title'] == 'Type Error'
+        assert tasks[1]['errors'][0]['fieldName'] == 'a'
+
+    def test_resource_validation_show_errors_filtered(self):
+        resource = self._resource()
+
+        validation_show = call_action(
+            'resource_validation_show', resource_id=resource['id'],
+            error_types='type-error', fields=['a'])
+
+        assert validation_show['errors_count'] == 3
+        tasks = validation_show['report']['tasks']
+        assert [e['rowNumber'] for e in tasks[0]['errors']] == [1, 4]
+
+    def test_resource_validation_show_summary_only(self):
+        resource = self._resource()
+
+        validation_show = call_action(
+            'resource_validation_show', resource_id=resource['id'],
+            summary_only=True)
+
+        assert [task['errors'] for task in validation_show['report']['tasks']] \
+            == [[], []]
+        assert validation_show['report']['tasks'][0]['stats'] == {'errors': 4}
+
+    def test_resource_validation_show_errors_limit_invalid(self):
+        resource = self._resource()
+
+        with pytest.raises(tk.ValidationError):
+            call_action('resource_validation_show', resource_id=resource['id'],
+                        errors_limit='all')
+
+
+@pytest.mark.usefixtures("clean_db", "validation_setup")
+class TestValidationStatusHelper(object):
+
+    def _validation(self, resource_factory):
+        resource = resource_factory(format="PDF")
+        Session.add(Validation(resource_id=resource['id'],
+                               created=datetime.datetime.utcnow(),
+                               status='failure',
+                               report={'some': 'report'},
+                               error={'some': 'error'}))
+        Session.commit()
+        Session.expunge_all()
+        return resource['id']
+
+    def test_report_is_not_loaded_by_default(self, resource_factory):
+        resource_id = self._validation(resource_factory)
+
+        validation = ValidationStatusHelper().getValidationJob(
+            Session, resource_id)
+
+        assert validation.status == 'failure'
+        assert {'report', 'error'} <= sa.inspect(validation).unloaded
+        # Still there when accessed
+        assert validation.report == {'some': 'report'}
+
+    def test_report_is_loaded_with_payload(self, resource_factory):
+        resource_id = self._validation(resource_factory)
+
+        validation = ValidationStatusHelper().getValidationJob(
+            Session, resource_id, payload=True)
+
+        assert not {'report', 'error'} & sa.inspect(validation).unloaded
+
+    def test_status_only(self, resource_factory):
+        resource_id = self._validation(resource_factory)
+
+        status = ValidationStatusHelper().getValidationStatus(
+            Session, resource_id)
+
+        assert status.status == 'failure'
+        assert status.created
+        assert status.finished is None
+        assert ValidationStatusHelper().getValidationStatus(
+            Session, 'not-exists') is None
+
+    def test_create_resets_finished_job(self, resource_factory):
+        resource_id = self._validation(resource_factory)
+
+        validation = ValidationStatusHelper().createValidationJob(
+            Session, resource_id)
+
+        assert validation.status == 'created'
+        assert validation.report is None
+        assert ValidationStatusHelper().getValidationStatus(
+            Session, resource_id).status == 'created'
+
+    def test_create_pending_job(self, resource_factory):
+        resource_id = self._validation(resource_factory)
+        ValidationStatusHelper().createValidationJob(Session, resource_id)
+
+        with pytest.raises(ValidationJobAlreadyEnqueued):
+            ValidationStatusHelper().createValidationJob(Session, resource_id)
+
+    def test_status_transitions(self, resource_factory):
+        vsh = ValidationStatusHelper()
+        resource_id = self._validation(resource_factory)
+        vsh.createValidationJob(Session, resource_id)
+        loaded = vsh.getValidationJob(Session, resource_id)
+
+        vsh.updateValidationJobStatus(Session, resource_id, 'running')
+        with pytest.raises(ValidationJobAlreadyRunning):
+            vsh.updateValidationJobStatus(Session, resource_id, 'running')
+
+        validation = vsh.updateValidationJobStatus(
+            Session, resource_id, 'success', {'valid': True}, retries=1)
+        assert validation.status == 'success'
+        assert validation.finished
+        assert validation.retries == 1
+        # Records loaded before see the new values
+        assert loaded.status == 'success'
+
+        with pytest.raises(ValidationJobNotPending):
+            vsh.updateValidationJobStatus(Session, resource_id, 'timeout')
+
+    def test_update_missing_job(self):
+        with pytest.raises(ValidationJobDoesNotExist):
+            ValidationStatusHelper().updateValidationJobStatus(
+                Session, 'not-exists', 'running')
+
+
+class TestListParam(object):
+
+    @pytest.mark.parametrize('value,expected', [
+        ('a,b', ['a', 'b']),
+        ('["a", "b,c"]', ['a', 'b,c']),
+        (['a', ' b '], ['a', 'b']),
+        # Valid JSON, but field names
+        ('2020', ['2020']),
+        ('"a"', ['"a"']),
+        ('["a", 1]', ['["a"', '1]']),
+        (None, []),
+    ])
+    def test_list_param(self, value, expected):
+        assert _list_param({'fields': value}, 'fields') == expected
+
+    @pytest.mark.parametrize('value', [['a', 1], 2020, {'a': 'b'}])
+    def test_list_param_not_strings(self, value):
+        with pytest.raises(tk.ValidationError) as err:
+            _list_param({'fields': value}, 'fields')
+
+        assert 'fields' in err.value.error_dict
+
+
+@pytest.mark.usefixtures("clean_db", "validation_setup")
+class TestResourceValidationShowMany(object):
+
+    def test_param_missing(self):
+        with pytest.raises(tk.ValidationError):
+            call_action('resource_validation_show_many')
+
+    def test_show_many(self):
+        dataset = factories.Dataset()
+        validated_resource = factories.Resource(package_id=dataset['id'],
+                                                format='PDF')
+        not_validated = factories.Resource(package_id=dataset['id'],
+                                           format='PDF')
+        validated(validated_resource['id'], 'failure', errors=2)
+
+        result = call_action('resource_validation_show_many', resource_ids=[
+            validated_resource['id'], not_validated['id'], 'not-exists'])
+
+        assert set(result) == {validated_resource['id'], not_validated['id']}
+        assert result[validated_resource['id']]['status'] == 'failure'
+        assert result[validated_resource['id']]['error_count'] == 2
+        assert 'report' not in result[validated_resource['id']]
+        assert result[not_validated['id']]['status'] is None
+
+    def test_include_report(self):
+        resource = factories.Resource(format='PDF')
+        validated(resource['id'], 'success',
+                  report=json.dumps({'valid': True}))
+
+        result = call_action('resource_validation_show_many',
+                             resource_ids=resource['id'], include_report=True)
+
+        assert result[resource['id']]['report'] == {'valid': True}
+
+    def test_private_resources_are_left_out(self):
+        org = factories.Organization()
+        private = factories.Resource(package_id=factories.Dataset(
+            owner_org=org['id'], private=True)['id'], format='PDF')
+        public = factories.Resource(format='PDF')
+        user = factories.User()
+
+        result = call_action('resource_validation_show_many',
+                             context={'user': user['name'],
+                                      'ignore_auth': False},
+                             resource_ids=[private['id'], public['id']])
+
+        assert list(result) == [public['id']]
+
+
+@pytest.mark.usefixtures("clean_db", "validation_setup")
+class TestPackageValidationSummary(object):
+
+    def test_summary(self):
+        dataset = factories.Dataset()
+        failed = factories.Resource(package_id=dataset['id'], format='PDF')
+        passed = factories.Resource(package_id=dataset['id'], format='PDF')
+        factories.Resource(package_id=dataset['id'], format='PDF')
+        validated(failed['id'], 'failure', errors=3)
+        validated(passed['id'], 'success')
+
+        result = call_action('package_validation_summary', id=dataset['name'])
+
+        assert result['package_id'] == dataset['id']
+        assert result['status_counts'] == {
+            'failure': 1, 'success': 1, 'none': 1}
+        assert result['error_count'] == 3
+        assert len(result['resources']) == 3
+
+    def test_dataset_without_resources(self):
+        dataset = factories.Dataset()
+
+        result = call_action('package_validation_summary', id=dataset['id'])
+
+        assert result['resources'] == []
+
+    def test_dataset_not_found(self):
+        with pytest.raises(tk.ObjectNotFound):
+            call_action('package_validation_summary', id='not-exists')
+
+    def test_many(self):
+        first = factories.Resource(format='PDF')
+        second = factories.Resource(format='PDF')
+        validated(first['id'], 'failure', errors=1)
+
+        result = call_action('package_validation_summary', ids=[
+            first['package_id'], second['package_id'], 'not-exists'])
+
+        assert set(result) == {first['package_id'], second['package_id']}
+        assert result[first['package_id']]['error_count'] == 1
+        assert result[second['package_id']]['status_counts'] == {'none': 1}
+
 
 @pytest.mark.usefixtures("clean_db", "validation_setup")
 class TestResourceValidationDelete(object):
@@ -216,6 +511,80 @@ class TestResourceValidationDelete(object):
         assert count_after == 0
 
 
+@pytest.mark.usefixtures("clean_db", "validation_setup")
+class TestResourceValidationCancel(object):
+
+    def _validation(self, resource_id, status, created=None):
+        validation = Validation(
+            resource_id=resource_id,
+            created=created or datetime.datetime.utcnow(), status=status)
+        Session.add(validation)
+        Session.commit()
+        return validation
+
+    def test_resource_validation_cancel_param_missing(self):
+        with pytest.raises(tk.ValidationError) as err:
+            call_action('resource_validation_cancel')
+
+        assert err.value.error_dict == {'resource_id': 'Missing value'}
+
+    def test_resource_validation_cancel_not_exists(self):
+        with pytest.raises(tk.ObjectNotFound):
+            call_action('resource_validation_cancel', resource_id='not_exists')
+
+    def test_resource_validation_cancel_queued(self, resource_factory):
+        resource = resource_factory(format="PDF")
+        self._validation(resource['id'], 'created')
+
+        validation = call_action('resource_validation_cancel',
+                                 resource_id=resource['id'])
+
+        assert validation['status'] == 'cancelled'
+        assert validation['finished']
+        assert ValidationStatusHelper().isCancelRequested(resource['id'])
+
+    def test_resource_validation_cancel_running(self, resource_factory):
+        resource = resource_factory(format="PDF")
+        self._validation(resource['id'], 'running')
+
+        validation = call_action('resource_validation_cancel',
+                                 resource_id=resource['id'])
+
+        # The worker marks it as cancelled once it stops
+        assert validation['status'] == 'running'
+        assert ValidationStatusHelper().isCancelRequested(resource['id'])
+
+    def test_resource_validation_cancel_running_dead_worker(
+            self, resource_factory):
+        resource = resource_factory(format="PDF")
+        self._validation(resource['id'], 'running',
+                         created=datetime.datetime.utcnow()
+                         - datetime.timedelta(hours=2))
+
+        validation = call_action('resource_validation_cancel',
+                                 resource_id=resource['id'])
+
+        assert validation['status'] == 'cancelled'
+        assert validation['finished']
+
+    def test_resource_validation_cancel_finished(self, resource_factory):
+        resource = resource_factory(format="PDF")
+        self._validation(resource['id'], 'success')
+
+        with pytest.raises(tk.ValidationError):
+            call_action('resource_validation_cancel',
+                        resource_id=resource['id'])
+
+    def test_new_validation_clears_cancel_request(self, resource_factory):
+        resource = resource_factory(format="PDF")
+        self._validation(resource['id'], 'created')
+        call_action('resource_validation_cancel', resource_id=resource['id'])
+
+        ValidationStatusHelper().createValidationJob(Session, resource['id'])
+
+        assert not ValidationStatusHelper().isCancelRequested(resource['id'])
+
+
 @pytest.mark.usefixtures("clean_db", "validation_setup")
 class TestResourceValidationOnCreate(object):
 
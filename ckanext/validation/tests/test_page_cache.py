@@ -0,0 +1,86 @@
+# encoding: utf-8
+
+import mock
+import pytest
+
+from ckan.lib.redis import connect_to_redis
+from ckan.tests import factories
+
+from ckanext.validation import page_cache, settings as s
+
+from .helpers import validated
+
+
+@pytest.fixture
+def clean_page_cache():
+    conn = connect_to_redis()
+    for key in conn.scan_iter(page_cache.FRAGMENT_KEY.format(u'*')):
+        conn.delete(key)
+
+
+def _report(status='failure'):
+    return {'valid': status == 'success', 'stats': {'seconds': 1},
+            'tasks': []}
+
+
+def _url(resource, page='validation'):
+    url = '/dataset/{}/resource/{}/validation'.format(
+        resource['package_id'], resource['id'])
+    return url + '/report.json' if page == 'report' else url
+
+
+@pytest.mark.usefixtures("clean_db", "validation_setup", "clean_page_cache")
+class TestValidationPageCaching(object):
+
+    def test_not_modified(self, app):
+        resource = factories.Resource(url='https://some.url')
+        validated(resource['id'], 'failure', report=_report())
+
+        response = app.get(_url(resource))
+        etag = response.headers['ETag']
+
+        response = app.get(_url(resource), headers={'If-None-Match': etag},
+                           status=304)
+        assert response.headers['ETag'] == etag
+
+    def test_etag_changes_after_validation(self, app):
+        resource = factories.Resource(url='https://some.url')
+        validated(resource['id'], 'failure', report=_report())
+        etag = app.get(_url(resource)).headers['ETag']
+
+        validated(resource['id'], 'success', report=_report('success'))
+
+        response = app.get(_url(resource), headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        assert response.headers['ETag'] != etag
+
+    def test_report_not_modified(self, app):
+        resource = factories.Resource(url='https://some.url')
+        validated(resource['id'], 'failure', report=_report())
+
+        etag = app.get(_url(resource, 'report')).headers['ETag']
+
+        app.get(_url(resource, 'report'), headers={'If-None-Match': etag},
+                status=304)
+
+    @pytest.mark.ckan_config(s.REPORT_PAGE_CACHE_KEY, 60)
+    def test_report_section_is_cached(self, app):
+        resource = factories.Resource(url='https://some.url',
+                                      name='cached-resource')
+        validated(resource['id'], 'failure', report=_report())
+        app.get(_url(resource))
+
+        with mock.patch('ckanext.validation.common.render_snippet') \
+                as mock_render:
+            response = app.get(_url(resource))
+
+        assert not mock_render.called
+        assert 'cached-resource' in response.body
+
+    def test_report_section_not_cached_by_default(self, app):
+        resource = factories.Resource(url='https://some.url')
+        validated(resource['id'], 'failure', report=_report())
+        app.get(_url(resource))
+
+        assert not list(connect_to_redis().scan_iter(
+            page_cache.FRAGMENT_KEY.format(u'*')))
@@ -0,0 +1,138 @@
+# encoding: utf-8
+
+import mock
+import pytest
+import ckantoolkit as tk
+
+from ckan import model
+from ckan.model import Session
+from ckan.tests.helpers import call_action, call_auth
+from ckan.tests import factories
+
+from ckanext.validation import pipeline, settings as s
+from ckanext.validation.jobs import run_validation_job
+from ckanext.validation.model import Validation
+
+from .helpers import VALID_REPORT, MOCK_ASYNC_VALIDATE
+from .test_interfaces import TestPlugin
+
+OBSERVER = u'test_validation_plugin'
+
+
+def _statuses(resource_id):
+    return dict((status['observer'], status['status'])
+                for status in call_action('resource_validation_deliveries',
+                                          resource_id=resource_id))
+
+
+@pytest.mark.usefixtures("clean_db", "validation_setup")
+@mock.patch(MOCK_ASYNC_VALIDATE, return_value=VALID_REPORT)
+class TestSyncPipeline(object):
+
+    def test_report_is_delivered(self, mock_validate, resource_factory):
+        resource = resource_factory(do_not_validate=True)
+
+        with mock.patch.object(TestPlugin, 'receive_validation_report') \
+                as mock_receive:
+            run_validation_job(resource)
+
+        report = mock_receive.call_args[0][0]
+        assert report['resource_id'] == resource['id']
+        assert report['status'] == 'success'
+        assert _statuses(resource['id']) == {OBSERVER: pipeline.DELIVERED}
+
+    def test_observer_failure_is_raised(self, mock_validate, resource_factory):
+        resource = resource_factory(do_not_validate=True)
+
+        with mock.patch.object(TestPlugin, 'receive_validation_report',
+                               side_effect=ValueError('Loader down')):
+            with pytest.raises(ValueError):
+                run_validation_job(resource)
+
+        status = call_action('resource_validation_deliveries',
+                             resource_id=resource['id'])[0]
+        assert status['status'] == pipeline.FAILED
+        assert status['error'] == 'Loader down'
+
+
+@pytest.mark.usefixtures("clean_db", "validation_setup")
+@pytest.mark.ckan_config(s.PIPELINE_MODE_KEY, s.ASYNC_MODE)
+@pytest.mark.ckan_config(s.PIPELINE_QUEUE_KEY, 'pipeline')
+@pytest.mark.ckan_config(
+    s.PIPELINE_OBSERVER_TIMEOUT_KEY.format(OBSERVER), 30)
+@mock.patch(MOCK_ASYNC_VALIDATE, return_value=VALID_REPORT)
+class TestAsyncPipeline(object):
+
+    def _run(self, resource):
+        with mock.patch.object(tk, 'enqueue_job') as mock_enqueue, \
+                mock.patch.object(TestPlugin, 'receive_validation_report') \
+                as mock_receive:
+            run_validation_job(resource)
+        assert not mock_receive.called
+        return mock_enqueue.call_args[1]
+
+    def test_report_is_enqueued(self, mock_validate, resource_factory):
+        resource = resource_factory(do_not_validate=True)
+
+        job = self._run(resource)
+
+        assert job['fn'] == pipeline.deliver
+        assert job['queue'] == 'pipeline'
+        assert job['kwargs']['observer'] == OBSERVER
+        assert job['rq_kwargs']['job_timeout'] == 30
+        assert _statuses(resource['id']) == {OBSERVER: pipeline.QUEUED}
+
+    def test_report_is_delivered_by_job(self, mock_validate, resource_factory):
+        resource = resource_factory(do_not_validate=True)
+        job = self._run(resource)
+
+        with mock.patch.object(TestPlugin, 'receive_validation_report') \
+                as mock_receive:
+            pipeline.deliver(**job['kwargs'])
+
+        assert mock_receive.call_args[0][0]['finished'] == \
+            job['kwargs']['finished']
+        assert _statuses(resource['id']) == {OBSERVER: pipeline.DELIVERED}
+
+    def test_old_report_is_superseded(self, mock_validate, resource_factory):
+        resource = resource_factory(do_not_validate=True)
+        old_job = self._run(resource)
+        new_job = self._run(resource)
+
+        with mock.patch.object(TestPlugin, 'receive_validation_report') \
+                as mock_receive:
+            pipeline.deliver(**old_job['kwargs'])
+
+        assert not mock_receive.called
+        # The status is the one of the newer report, still to be delivered
+        status = call_action('resource_validation_deliveries',
+                             resource_id=resource['id'])[0]
+        assert status['status'] == pipeline.QUEUED
+        assert status['finished'] == new_job['kwargs']['finished']
+
+    def test_report_is_superseded_by_new_job(self, mock_validate,
+                                             resource_factory):
+        resource = resource_factory(do_not_validate=True)
+        job = self._run(resource)
+        # A new validation of the resource is pending
+        Session.query(Validation).filter(
+            Validation.resource_id == resource['id']).update(
+                {'status': 'created', 'finished': None})
+        Session.commit()
+
+        with mock.patch.object(TestPlugin, 'receive_validation_report') \
+                as mock_receive:
+            pipeline.deliver(**job['kwargs'])
+
+        assert not mock_receive.called
+        assert _statuses(resource['id']) == {OBSERVER: pipeline.SUPERSEDED}
+
+
+@pytest.mark.usefixtures("clean_db")
+def test_deliveries_sysadmins_only():
+    user = factories.User()
+
+    with pytest.raises(tk.NotAuthorized):
+        call_auth('resource_validation_deliveries',
+                  context={'user': user['name'], 'model': model},
+                  resource_id='some-id')
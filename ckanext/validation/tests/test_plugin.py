@@ -260,3 +260,33 @@ class TestPackageControllerHooksUpdate(object):
         call_action('package_update', {}, **dataset)
 
         _assert_validation_enqueued(mock_enqueue, resource1['id'])
+
+
+@pytest.mark.usefixtures("clean_db", "validation_setup")
+@pytest.mark.ckan_config(s.ASYNC_CREATE_KEY, True)
+@pytest.mark.ckan_config(s.SIZE_CLASSES_KEY, True)
+@pytest.mark.ckan_config(s.SIZE_MEDIUM_KEY, 1000)
+@pytest.mark.ckan_config(s.SIZE_LARGE_KEY, 10000)
+@mock.patch(helpers.MOCK_ENQUEUE_JOB)
+class TestSizeClassQueues(object):
+
+    def test_small_upload(self, mock_enqueue, resource_factory):
+        resource = resource_factory()
+
+        _assert_validation_enqueued(mock_enqueue, resource['id'])
+        assert mock_enqueue.call_args[1]['queue'] == 'validation-small'
+        assert mock_enqueue.call_args[1]['kwargs']['size_class'] == 'small'
+
+    def test_large_url(self, mock_enqueue, resource_factory):
+        resource = resource_factory(url='http://some.data', url_type=None,
+                                    upload=None, size=20000)
+
+        _assert_validation_enqueued(mock_enqueue, resource['id'])
+        assert mock_enqueue.call_args[1]['queue'] == 'validation-large'
+
+    @pytest.mark.ckan_config(s.SIZE_CLASS_TIMEOUT_KEY.format('large'), 3600)
+    def test_size_class_timeout(self, mock_enqueue, resource_factory):
+        resource_factory(url='http://some.data', url_type=None, upload=None,
+                         size=20000)
+
+        assert mock_enqueue.call_args[1]['rq_kwargs']['job_timeout'] > 3600
@@ -0,0 +1,136 @@
+# encoding: utf-8
+
+import os
+import time
+
+import mock
+import pytest
+import requests
+import responses
+
+from ckan.tests import factories
+
+from ckanext.validation import prefetch
+from ckanext.validation import settings as s
+from ckanext.validation.jobs import run_validation_job
+
+from .helpers import VALID_CSV, VALID_REPORT, MOCK_ASYNC_VALIDATE
+
+URL = 'http://example.com/some/file.csv'
+
+
+@pytest.fixture
+def spool_dir(monkeypatch, ckan_config, tmpdir):
+    monkeypatch.setitem(ckan_config, s.SPOOL_DIR_KEY, str(tmpdir))
+    return str(tmpdir)
+
+
+@pytest.mark.usefixtures("spool_dir")
+class TestSpool(object):
+
+    def test_spool_path_keeps_extension(self):
+        assert prefetch.spool_path('res-id', URL).endswith('.csv')
+        assert os.path.basename(
+            prefetch.spool_path('res-id', URL)).startswith('res-id-')
+
+    def test_spool_path_changes_with_url(self):
+        assert prefetch.spool_path('res-id', URL) != \
+            prefetch.spool_path('res-id', URL + '?v=2')
+
+    def test_take_missing(self):
+        assert prefetch.take('res-id', URL) is None
+
+    def test_download_and_take(self, mocked_responses):
+        mocked_responses.add(responses.GET, URL, body=VALID_CSV)
+        path = prefetch.spool_path('res-id', URL)
+
+        prefetch.download(URL, path, timeout=5)
+
+        assert prefetch.take('res-id', URL) == path
+        with open(path, 'rb') as f:
+            assert f.read() == VALID_CSV
+
+    def test_take_ignores_old_copies(self, mocked_responses):
+        mocked_responses.add(responses.GET, URL, body=VALID_CSV)
+        path = prefetch.spool_path('res-id', URL)
+        prefetch.download(URL, path, timeout=5)
+
+        old = time.time() - prefetch.SPOOL_MAX_AGE - 1
+        os.utime(path, (old, old))
+
+        assert prefetch.take('res-id', URL) is None
+
+    def test_failed_download_leaves_nothing(self, mocked_responses,
+                                            spool_dir):
+        mocked_responses.add(responses.GET, URL, status=503)
+        path = prefetch.spool_path('res-id', URL)
+
+        with pytest.raises(requests.HTTPError):
+            prefetch.download(URL, path, timeout=5)
+
+        assert os.listdir(spool_dir) == []
+
+    def test_prefetcher_downloads_submitted_sources(self, mocked_responses):
+        mocked_responses.add(responses.GET, URL, body=VALID_CSV)
+        prefetcher = prefetch.Prefetcher(depth=2)
+        prefetcher.start()
+        try:
+            prefetcher.submit([('res-id', URL)])
+            for _i in range(50):
+                if prefetch.take('res-id', URL):
+                    break
+                time.sleep(0.1)
+        finally:
+            prefetcher.stop()
+
+        assert prefetch.take('res-id', URL)
+        assert not prefetch.is_running()
+
+    def test_prefetcher_fetches_a_source_once(self):
+        prefetcher = prefetch.Prefetcher(depth=2)
+        with mock.patch('asyncio.run_coroutine_threadsafe') as mock_schedule:
+            prefetcher.submit([('res-id', URL), ('res-id', URL)])
+
+        assert mock_schedule.call_count == 1
+        mock_schedule.call_args[0][0].close()
+        prefetcher.loop.close()
+        prefetcher.executor.shutdown()
+
+
+@pytest.mark.usefixtures("clean_db", "validation_setup", "spool_dir")
+class TestPrefetchedSources(object):
+
+    def test_remote_sources_skips_uploads(self, resource_factory):
+        uploaded = resource_factory()
+        linked = factories.Resource(url=URL, format='csv')
+
+        assert prefetch.remote_sources([uploaded['id'], linked['id']]) == [
+            (linked['id'], URL)]
+
+    @mock.patch('ckanext.validation.prefetch.is_running', return_value=True)
+    @mock.patch(MOCK_ASYNC_VALIDATE, return_value=VALID_REPORT)
+    def test_job_uses_and_discards_spooled_source(self, mock_validate,
+                                                  mock_running,
+                                                  mocked_responses):
+        mocked_responses.add(responses.GET, URL, body=VALID_CSV)
+        resource = factories.Resource(url=URL, format='csv')
+        path = prefetch.spool_path(resource['id'], URL)
+        prefetch.download(URL, path, timeout=5)
+
+        run_validation_job(resource)
+
+        assert mock_validate.call_args[0][0] == path
+        assert not os.path.exists(path)
+
+    @mock.patch(MOCK_ASYNC_VALIDATE, return_value=VALID_REPORT)
+    def test_job_without_prefetcher_ignores_spool(self, mock_validate,
+                                                  mocked_responses):
+        mocked_responses.add(responses.GET, URL, body=VALID_CSV)
+        resource = factories.Resource(url=URL, format='csv')
+        path = prefetch.spool_path(resource['id'], URL)
+        prefetch.download(URL, path, timeout=5)
+
+        run_validation_job(resource)
+
+        assert mock_validate.call_args[0][0] == URL
+        assert os.path.exists(path)
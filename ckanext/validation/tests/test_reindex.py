@@ -0,0 +1,122 @@
+# encoding: utf-8
+
+import mock
+import pytest
+
+from ckan.lib import search
+from ckan.lib.redis import connect_to_redis
+from ckan.tests.helpers import call_action
+from ckan.tests import factories
+
+from ckanext.validation import reindex, settings as s
+from ckanext.validation.jobs import run_validation_job
+
+
+@pytest.fixture
+def clean_reindex():
+    connect_to_redis().delete(reindex.PENDING_KEY, reindex.COUNTERS_KEY)
+
+
+def _indexed(package_ids):
+    return len(package_ids), []
+
+
+@pytest.mark.usefixtures("clean_reindex")
+@pytest.mark.ckan_config(s.REINDEX_WINDOW_KEY, 10)
+class TestReindexCoalescer(object):
+
+    @mock.patch.object(reindex, 'reindex', side_effect=_indexed)
+    def test_touches_are_coalesced(self, mock_reindex):
+        for i in range(3):
+            reindex.touch(u'dataset-1', now=100 + i)
+        reindex.touch(u'dataset-2', now=101)
+
+        assert reindex.flush(now=105) == 0
+        assert reindex.flush(now=110) == 1
+        mock_reindex.assert_called_once_with([u'dataset-1'])
+
+        assert reindex.get_counters() == {
+            u'pending': 1, u'reindexed': 1, u'avoided': 2}
+
+    @mock.patch.object(reindex, 'reindex', side_effect=_indexed)
+    def test_flush_everything(self, mock_reindex):
+        reindex.touch(u'dataset-1')
+        reindex.touch(u'dataset-2')
+
+        assert reindex.flush(everything=True) == 2
+        assert reindex.flush(everything=True) == 0
+
+        assert reindex.get_counters()[u'pending'] == 0
+
+    @pytest.mark.ckan_config(s.REINDEX_WINDOW_KEY, 0)
+    @mock.patch.object(reindex, 'reindex', side_effect=_indexed)
+    def test_no_window(self, mock_reindex):
+        reindex.touch(u'dataset-1')
+
+        mock_reindex.assert_called_once_with([u'dataset-1'])
+        assert reindex.get_counters()[u'pending'] == 0
+
+    @mock.patch.object(reindex, 'reindex',
+                       return_value=(1, [u'dataset-2']))
+    def test_failed_are_retried(self, mock_reindex):
+        reindex.touch(u'dataset-1', now=100)
+        reindex.touch(u'dataset-2', now=101)
+
+        assert reindex.flush(now=120) == 1
+
+        conn = connect_to_redis()
+        assert conn.zrange(reindex.PENDING_KEY, 0, -1, withscores=True) \
+            == [(b'dataset-2', 101)]
+
+    @mock.patch.object(reindex, 'reindex', side_effect=RuntimeError)
+    def test_claimed_are_kept_on_error(self, mock_reindex):
+        reindex.touch(u'dataset-1', now=100)
+
+        with pytest.raises(RuntimeError):
+            reindex.flush(now=120)
+
+        assert reindex.get_counters()[u'pending'] == 1
+
+    @pytest.mark.ckan_config(s.REINDEX_WINDOW_KEY, 0)
+    @mock.patch.object(reindex, 'reindex', return_value=(0, [u'dataset-1']))
+    def test_no_window_failed_are_retried(self, mock_reindex):
+        reindex.touch(u'dataset-1')
+
+        assert reindex.get_counters()[u'pending'] == 1
+
+
+@pytest.mark.usefixtures("clean_db", "validation_setup")
+class TestReindex(object):
+
+    @mock.patch('ckan.lib.search.index.PackageSearchIndex.commit',
+                side_effect=search.SearchIndexError(u'Solr is down'))
+    def test_commit_error(self, mock_commit):
+        dataset = factories.Dataset()
+
+        assert reindex.reindex([dataset['id'], u'missing']) \
+            == (0, [dataset['id']])
+
+
+@pytest.mark.usefixtures("clean_db", "validation_setup", "clean_reindex")
+@pytest.mark.ckan_config(s.REINDEX_WINDOW_KEY, 10)
+@pytest.mark.ckan_config(s.STATUS_WRITEBACK_KEY, 'direct')
+class TestReindexAfterValidation(object):
+
+    def test_dataset_is_reindexed_once(self, resource_factory):
+        dataset = factories.Dataset()
+        resources = [resource_factory(package_id=dataset['id'],
+                                      do_not_validate=True)
+                     for i in range(3)]
+
+        with mock.patch('ckanext.validation.jobs._queue_drained',
+                        side_effect=[False, False, True]), \
+                mock.patch.object(reindex, 'reindex',
+                                  wraps=reindex.reindex) as mock_reindex:
+            for resource in resources:
+                run_validation_job(resource)
+
+        mock_reindex.assert_called_once_with([dataset['id']])
+        assert reindex.get_counters()[u'avoided'] == 2
+        result = call_action('package_search',
+                             fq='vocab_validation_status:success')
+        assert result['count'] == 1
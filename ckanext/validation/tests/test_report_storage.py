@@ -0,0 +1,298 @@
+# encoding: utf-8
+
+import datetime
+import json
+
+import mock
+import pytest
+
+from ckan.model import Session
+from ckan.tests.helpers import call_action
+from ckan.tests import factories
+
+from ckanext.validation import report_storage
+from ckanext.validation import settings as s
+from ckanext.validation.jobs import run_validation_job
+from ckanext.validation.model import Validation
+
+from .helpers import INVALID_REPORT, MOCK_ASYNC_VALIDATE
+
+REPORT = {'valid': False, 'tasks': [{'errors': [{'type': 'blank-row'}] * 100}]}
+
+
+class TestCodecs(object):
+
+    def test_gzip(self):
+        data = report_storage.compress(json.dumps(REPORT), 'gzip')
+
+        assert data.startswith(report_storage.GZIP_MAGIC)
+        assert len(data) < len(json.dumps(REPORT))
+        assert json.loads(report_storage.decompress(data)) == REPORT
+
+    def test_zstd(self):
+        pytest.importorskip('zstandard')
+        data = report_storage.compress(json.dumps(REPORT), 'zstd')
+
+        assert data.startswith(report_storage.ZSTD_MAGIC)
+        assert json.loads(report_storage.decompress(data)) == REPORT
+
+    def test_unknown_format(self):
+        with pytest.raises(ValueError):
+            report_storage.decompress(b'{"valid": true}')
+
+
+class TestStore(object):
+
+    def test_store_as_text(self):
+        validation = mock.Mock(report=None, report_data=None, report_path=None)
+
+        report_storage.store(validation, json.dumps(REPORT), codec='none')
+
+        assert validation.report == json.dumps(REPORT)
+        assert validation.report_data is None
+        assert report_storage.load(validation) == REPORT
+
+    def test_store_compressed(self):
+        validation = mock.Mock(report=None, report_data=None, report_path=None)
+
+        report_storage.store(validation, REPORT, codec='gzip')
+
+        assert validation.report is None
+        assert validation.report_data
+        assert report_storage.load(validation) == REPORT
+
+    def test_load_text(self):
+        validation = mock.Mock(report=None, report_data=None, report_path=None)
+
+        report_storage.store(validation, REPORT, codec='gzip')
+
+        assert json.loads(report_storage.load_text(validation)) == REPORT
+
+    def test_dumps_without_orjson(self):
+        with mock.patch.object(report_storage, '_orjson', return_value=None):
+            text = report_storage.dumps(REPORT)
+
+            assert text == json.dumps(REPORT)
+            assert report_storage.loads(text) == REPORT
+
+    def test_dumps_with_orjson(self):
+        pytest.importorskip('orjson')
+
+        assert json.loads(report_storage.dumps(REPORT)) == REPORT
+
+    def test_no_report(self):
+        validation = mock.Mock(report=None, report_data=None, report_path=None)
+
+        report_storage.store(validation, None, codec='gzip')
+
+        assert report_storage.load(validation) is None
+
+    @pytest.mark.ckan_config(s.REPORT_COMPRESSION_KEY, 'lz4')
+    def test_unknown_codec_setting(self):
+        with pytest.raises(ValueError):
+            s.get_report_compression()
+
+
+def _stored_validation(report):
+    resource = factories.Resource(format='PDF')
+    timestamp = datetime.datetime.utcnow()
+    validation = Validation(resource_id=resource['id'],
+                            created=timestamp,
+                            finished=timestamp,
+                            status='failure',
+                            report=json.dumps(report))
+    Session.add(validation)
+    Session.commit()
+    return resource['id']
+
+
+@pytest.mark.usefixtures("clean_db", "validation_setup")
+class TestCompressedReports(object):
+
+    @pytest.mark.ckan_config(s.REPORT_COMPRESSION_KEY, 'gzip')
+    @mock.patch(MOCK_ASYNC_VALIDATE, return_value=INVALID_REPORT)
+    def test_job_stores_compressed_report(self, mock_validate,
+                                          resource_factory):
+        resource = resource_factory()
+
+        run_validation_job(resource)
+
+        validation = Session.query(Validation).filter(
+            Validation.resource_id == resource['id']).one()
+        assert validation.report is None
+        assert validation.report_data
+
+        validation_show = call_action('resource_validation_show',
+                                      resource_id=resource['id'])
+        assert validation_show['status'] == 'failure'
+        assert validation_show['report']['valid'] is False
+
+    def test_compress_existing(self):
+        resource_id = _stored_validation(REPORT)
+
+        batches = list(report_storage.compress_existing('gzip'))
+
+        assert batches == [1]
+        validation = Session.query(Validation).filter(
+            Validation.resource_id == resource_id).one()
+        assert validation.report is None
+        assert report_storage.load(validation) == REPORT
+        # Nothing left to do when run again
+        assert list(report_storage.compress_existing('gzip')) == []
+
+    def test_compress_existing_needs_a_codec(self):
+        with pytest.raises(ValueError):
+            list(report_storage.compress_existing())
+
+    def test_benchmark(self):
+        _stored_validation(REPORT)
+
+        results = report_storage.benchmark(rounds=1)
+
+        by_format = {result['format']: result for result in results}
+        assert by_format['gzip']['reports'] == 1
+        assert by_format['gzip']['bytes'] < by_format['none']['bytes']
+        # Nothing was changed
+        validation = Session.query(Validation).one()
+        assert validation.report_data is None
+        assert report_storage.load(validation) == REPORT
+
+
+@pytest.fixture
+def offload_path(tmp_path, ckan_config, monkeypatch):
+    monkeypatch.setitem(ckan_config, s.REPORT_OFFLOAD_SIZE_KEY, 1000)
+    monkeypatch.setitem(ckan_config, s.REPORT_OFFLOAD_PATH_KEY, str(tmp_path))
+    return tmp_path
+
+
+class TestOffload(object):
+
+    def test_small_reports_stay_in_the_record(self, offload_path):
+        validation = mock.Mock(report=None, report_data=None, report_path=None)
+
+        report_storage.store(validation, {'valid': True}, codec='none')
+
+        assert validation.report_path is None
+        assert report_storage.load(validation) == {'valid': True}
+
+    @pytest.mark.parametrize('codec', ['none', 'gzip'])
+    def test_large_reports_are_offloaded(self, offload_path, codec):
+        validation = mock.Mock(resource_id='some-resource-id', report=None,
+                               report_data=None, report_path=None)
+
+        report_storage.store(validation, REPORT, codec=codec)
+
+        assert validation.report_path
+        assert (offload_path / validation.report_path).is_file()
+        summary = report_storage.load(validation, summary=True)
+        assert len(summary['tasks'][0]['errors']) == \
+            report_storage.SUMMARY_ERRORS
+        assert report_storage.load(validation) == REPORT
+        assert json.loads(b''.join(
+            report_storage.iter_body(validation.report_path))) == REPORT
+
+    def test_previous_file_is_removed(self, offload_path):
+        validation = mock.Mock(resource_id='some-resource-id', report=None,
+                               report_data=None, report_path=None)
+        report_storage.store(validation, REPORT, codec='gzip')
+        first_path = validation.report_path
+
+        report_storage.store(validation, None)
+
+        assert validation.report_path is None
+        assert not (offload_path / first_path).exists()
+
+    def test_missing_file_falls_back_to_summary(self, offload_path):
+        validation = mock.Mock(resource_id='some-resource-id', report=None,
+                               report_data=None, report_path=None)
+        report_storage.store(validation, REPORT, codec='gzip')
+        (offload_path / validation.report_path).unlink()
+
+        assert report_storage.load(validation) == \
+            report_storage.summarize(REPORT)
+
+    @mock.patch.object(report_storage, '_zstandard', return_value=None)
+    def test_zstd_without_zstandard_falls_back_to_summary(
+            self, mock_zstandard, offload_path):
+        validation = mock.Mock(resource_id='some-resource-id', report=None,
+                               report_data=None, report_path=None)
+        report_storage.store(validation, REPORT, codec='none')
+        (offload_path / validation.report_path).write_bytes(
+            report_storage.ZSTD_MAGIC + b'data')
+
+        assert report_storage.load(validation) == \
+            report_storage.summarize(REPORT)
+
+
+@pytest.mark.usefixtures("clean_db", "validation_setup")
+class TestOffloadedReports(object):
+
+    @mock.patch(MOCK_ASYNC_VALIDATE, return_value=INVALID_REPORT)
+    def test_show_and_report_page(self, mock_validate, offload_path, app,
+                                  resource_factory, monkeypatch, ckan_config):
+        monkeypatch.setitem(ckan_config, s.REPORT_OFFLOAD_SIZE_KEY, 10)
+        resource = resource_factory()
+        run_validation_job(resource)
+
+        validation_show = call_action('resource_validation_show',
+                                      resource_id=resource['id'])
+        assert validation_show['report_offloaded'] is True
+        assert validation_show['report']['valid'] is False
+
+        response = app.get('/dataset/{}/resource/{}/validation/report.json'.format(
+            resource['package_id'], resource['id']))
+        assert json.loads(response.body) == validation_show['report']
+
+    @mock.patch(MOCK_ASYNC_VALIDATE, return_value=INVALID_REPORT)
+    def test_report_page_without_zstandard(self, mock_validate, offload_path,
+                                           app, resource_factory, monkeypatch,
+                                           ckan_config):
+        monkeypatch.setitem(ckan_config, s.REPORT_OFFLOAD_SIZE_KEY, 10)
+        resource = resource_factory()
+        run_validation_job(resource)
+        validation = Session.query(Validation).filter(
+            Validation.resource_id == resource['id']).one()
+        (offload_path / validation.report_path).write_bytes(
+            report_storage.ZSTD_MAGIC + b'data')
+
+        with mock.patch.object(report_storage, '_zstandard',
+                               return_value=None):
+            response = app.get(
+                '/dataset/{}/resource/{}/validation/report.json'.format(
+                    resource['package_id'], resource['id']))
+            validation_show = call_action('resource_validation_show',
+                                          resource_id=resource['id'])
+
+        assert json.loads(response.body) == report_storage.load(
+            validation, summary=True)
+        assert validation_show['report'] == json.loads(response.body)
+
+    @mock.patch(MOCK_ASYNC_VALIDATE, return_value=INVALID_REPORT)
+    def test_api_sends_report_as_stored(self, mock_validate, offload_path,
+                                        app, resource_factory, monkeypatch,
+                                        ckan_config):
+        monkeypatch.setitem(ckan_config, s.REPORT_OFFLOAD_SIZE_KEY, 10)
+        resource = resource_factory()
+        run_validation_job(resource)
+
+        with mock.patch.object(report_storage, 'loads') as mock_loads:
+            response = app.get('/api/action/resource_validation_show',
+                               params={'resource_id': resource['id']})
+
+        assert not mock_loads.called
+        result = json.loads(response.body)['result']
+        assert result['report'] == call_action(
+            'resource_validation_show', resource_id=resource['id'])['report']
+
+    @mock.patch(MOCK_ASYNC_VALIDATE, return_value=INVALID_REPORT)
+    def test_delete_removes_file(self, mock_validate, offload_path,
+                                 resource_factory, monkeypatch, ckan_config):
+        monkeypatch.setitem(ckan_config, s.REPORT_OFFLOAD_SIZE_KEY, 10)
+        resource = resource_factory()
+        run_validation_job(resource)
+        report_path = Session.query(Validation.report_path).filter(
+            Validation.resource_id == resource['id']).scalar()
+
+        call_action('resource_validation_delete', resource_id=resource['id'])
+
+        assert not (offload_path / report_path).exists()
@@ -0,0 +1,147 @@
+# encoding: utf-8
+
+import datetime
+import json
+
+import mock
+import pytest
+
+from ckan.tests import factories
+
+from ckanext.validation import scheduler
+from ckanext.validation import settings as s
+
+from .helpers import validated
+
+DAY = 24 * 60 * 60
+
+
+def _resource(days_ago, status='success', **kwargs):
+    resource = factories.Resource(
+        url='http://example.com/file.csv', format=kwargs.pop('format', 'csv'),
+        **kwargs)
+    validated(resource['id'], status, finished=datetime.datetime.utcnow()
+              - datetime.timedelta(days=days_ago))
+    return resource
+
+
+def _due_ids(limit=10):
+    return [resource_id for resource_id, _package_id, _overdue
+            in scheduler.stale_resources(limit)]
+
+
+@pytest.mark.usefixtures("clean_db", "validation_setup")
+class TestStaleResources(object):
+
+    def test_most_stale_first(self):
+        fresh = _resource(1)
+        stale = _resource(8)
+        staler = _resource(30, status='failure')
+
+        assert _due_ids() == [staler['id'], stale['id']]
+        assert fresh['id'] not in _due_ids()
+
+    def test_queued_resources_are_skipped(self):
+        _resource(30, status='created')
+        _resource(30, status='running')
+
+        assert _due_ids() == []
+
+    def test_exclude(self):
+        stale = _resource(8)
+        excluded = _resource(9)
+
+        assert [resource_id for resource_id, _package_id, _overdue
+                in scheduler.stale_resources(10, exclude={excluded['id']})] \
+            == [stale['id']]
+
+    def test_limit(self):
+        _resource(8)
+        _resource(9)
+
+        assert len(_due_ids(limit=1)) == 1
+
+    @pytest.mark.ckan_config(s.SCHEDULER_POLICIES_KEY, json.dumps(
+        {'format': {'XLSX': DAY}}))
+    def test_format_policy(self):
+        xlsx = _resource(2, format='xlsx')
+        csv = _resource(2)
+
+        assert _due_ids() == [xlsx['id']]
+        assert csv['id'] not in _due_ids()
+
+    def test_organization_policy(self, ckan_config, monkeypatch):
+        org = factories.Organization()
+        dataset = factories.Dataset(owner_org=org['id'])
+        monkeypatch.setitem(ckan_config, s.SCHEDULER_POLICIES_KEY, json.dumps(
+            {'organization': {org['name']: DAY}}))
+
+        in_org = _resource(2, package_id=dataset['id'])
+        _resource(2)
+
+        assert _due_ids() == [in_org['id']]
+
+    @pytest.mark.ckan_config(s.SCHEDULER_POLICIES_KEY, json.dumps(
+        {'source': {'url': 30 * DAY}, 'format': {'csv': DAY}}))
+    def test_shortest_ttl_applies(self):
+        resource = _resource(2)
+
+        assert _due_ids() == [resource['id']]
+
+
+@mock.patch('ckanext.validation.scheduler.time.sleep')
+@mock.patch('ckanext.validation.scheduler._enqueue')
+@mock.patch('ckanext.validation.scheduler.stale_resources')
+class TestRun(object):
+
+    def test_burst_stops_when_none_due(self, mock_stale, mock_enqueue,
+                                       mock_sleep):
+        mock_stale.side_effect = [
+            [('res-1', 'pkg', 20.0), ('res-2', 'pkg', 10.0)], []]
+
+        scheduler.run(rate=60, burst=True)
+
+        assert mock_enqueue.call_args_list == [
+            mock.call('res-1', 'pkg'), mock.call('res-2', 'pkg')]
+
+    def test_burst_stops_when_none_enqueued(self, mock_stale, mock_enqueue,
+                                            mock_sleep):
+        mock_stale.return_value = [('res-1', 'pkg', 20.0)]
+        mock_enqueue.return_value = False
+
+        scheduler.run(rate=60, burst=True)
+
+        assert mock_enqueue.call_count == 1
+
+    def test_failed_are_not_tried_again(self, mock_stale, mock_enqueue,
+                                        mock_sleep):
+        mock_stale.side_effect = [
+            [('res-1', 'pkg', 20.0), ('res-2', 'pkg', 10.0)],
+            [('res-3', 'pkg', 5.0)], []]
+        mock_enqueue.side_effect = [False, True, True]
+
+        scheduler.run(rate=60, burst=True)
+
+        assert mock_stale.call_args_list[1][1]['exclude'] == {'res-1'}
+
+    @pytest.mark.parametrize('rate', [0, -1])
+    def test_invalid_rate(self, mock_stale, mock_enqueue, mock_sleep, rate):
+        with pytest.raises(ValueError):
+            scheduler.run(rate=rate, burst=True)
+
+    def test_jobs_are_spread(self, mock_stale, mock_enqueue, mock_sleep):
+        mock_stale.side_effect = [[('res-1', 'pkg', 20.0)], []]
+
+        scheduler.run(rate=6, burst=True)
+
+        # One job every 10 seconds
+        assert mock_sleep.call_args[0][0] == pytest.approx(10, abs=1)
+
+    @pytest.mark.ckan_config(s.SCHEDULER_INTERVAL_KEY, 600)
+    def test_batch_size_follows_rate(self, mock_stale, mock_enqueue,
+                                     mock_sleep):
+        mock_stale.return_value = []
+
+        scheduler.run(rate=30, burst=True)
+
+        assert mock_stale.call_args[0][0] == 300
@@ -0,0 +1,95 @@
+# encoding: utf-8
+
+import pytest
+import ckantoolkit as tk
+
+from ckan import model
+from ckan.model import Session
+from ckan.tests.helpers import call_action, call_auth
+from ckan.tests import factories
+
+from ckanext.validation import stats
+from ckanext.validation.model import Validation
+
+from .helpers import validated
+
+
+@pytest.mark.usefixtures("clean_db", "validation_setup")
+class TestStats(object):
+
+    def _resources(self):
+        org = factories.Organization()
+        dataset = factories.Dataset(owner_org=org['id'])
+        validated(factories.Resource(package_id=dataset['id'], format='CSV',
+                                     size=100)['id'], 'failure')
+        validated(factories.Resource(package_id=dataset['id'], format='csv',
+                                     size=50)['id'], 'failure')
+        factories.Resource(package_id=dataset['id'], format='xlsx')
+        # Not a format that is validated
+        factories.Resource(package_id=dataset['id'], format='PDF')
+        validated(factories.Resource(format='CSV')['id'], 'success')
+        return org
+
+    def test_refresh(self):
+        org = self._resources()
+
+        assert stats.refresh() == 4
+
+        result = call_action('validation_stats')
+        assert result['last_updated']
+        assert result['totals'] == {'failure': 2, 'success': 1, 'none': 1}
+        assert {'organization': org['name'], 'format': 'csv',
+                'status': 'failure', 'count': 2, 'bytes': 150} \
+            in result['stats']
+
+    def test_refresh_replaces_stats(self):
+        self._resources()
+        stats.refresh()
+        Session.query(Validation).delete()
+        Session.commit()
+
+        stats.refresh()
+
+        assert call_action('validation_stats')['totals'] == {'none': 4}
+
+    def test_filters(self):
+        org = self._resources()
+        stats.refresh()
+
+        result = call_action('validation_stats', organization=org['name'],
+                             format='CSV')
+
+        assert result['totals'] == {'failure': 2}
+
+    def test_no_stats(self):
+        result = call_action('validation_stats')
+
+        assert result == {'last_updated': None, 'totals': {}, 'stats': []}
+
+    def test_sysadmins_only(self):
+        user = factories.User()
+
+        with pytest.raises(tk.NotAuthorized):
+            call_auth('validation_stats',
+                      context={'user': user['name'], 'model': model})
+
+
+@pytest.mark.usefixtures("clean_db", "validation_setup")
+class TestStatsPage(object):
+
+    def test_page(self, app):
+        validated(factories.Resource(format='CSV')['id'], 'success')
+        stats.refresh()
+        sysadmin = factories.Sysadmin()
+
+        response = app.get('/ckan-admin/validation', extra_environ={
+            'REMOTE_USER': sysadmin['name']})
+
+        assert 'Validation statistics' in response.body
+        assert 'success' in response.body
+
+    def test_page_sysadmins_only(self, app):
+        user = factories.User()
+
+        app.get('/ckan-admin/validation', status=403, extra_environ={
+            'REMOTE_USER': user['name']})
@@ -0,0 +1,103 @@
+# encoding: utf-8
+
+import datetime
+import json
+
+import mock
+import pytest
+
+from ckan.model import Session
+from ckan.tests import factories
+
+from ckanext.validation import settings as s, status_events
+from ckanext.validation.model import Validation
+from ckanext.validation.validation_status_helper import (
+    StatusTypes, ValidationStatusHelper)
+
+
+def _events(chunks):
+    return [json.loads(chunk.split(u'data: ')[1])
+            for chunk in chunks if chunk.startswith(u'event: status')]
+
+
+def _message(status, finished=None):
+    return {'type': 'message', 'data': json.dumps({
+        'resource_id': 'some-id', 'status': status, 'finished': finished})}
+
+
+class TestStream(object):
+
+    def test_stops_at_final_status(self):
+        pubsub = mock.Mock()
+        pubsub.get_message.side_effect = [
+            _message('created'), None, _message('running'),
+            _message('success', '2024-01-01T00:00:00'), _message('created')]
+        current = status_events.status_event('some-id', None)
+
+        events = _events(status_events.stream(pubsub, current, 60))
+
+        assert [event['status'] for event in events] == \
+            [None, 'created', 'running', 'success']
+        pubsub.close.assert_called_once_with()
+
+    def test_current_status_not_sent_twice(self):
+        pubsub = mock.Mock()
+        pubsub.get_message.side_effect = [
+            _message('running'), _message('failure', '2024-01-01T00:00:00')]
+        current = {'resource_id': 'some-id', 'status': 'running',
+                   'finished': None}
+
+        events = _events(status_events.stream(pubsub, current, 60))
+
+        assert [event['status'] for event in events] == ['running', 'failure']
+
+    def test_timeout(self):
+        pubsub = mock.Mock()
+        pubsub.get_message.return_value = None
+        current = {'resource_id': 'some-id', 'status': 'running',
+                   'finished': None}
+
+        chunks = list(status_events.stream(pubsub, current, 0))
+
+        assert len(_events(chunks)) == 1
+        pubsub.close.assert_called_once_with()
+
+
+@pytest.mark.usefixtures("clean_db", "validation_setup")
+class TestStatusEvents(object):
+
+    def test_status_changes_are_published(self):
+        resource = factories.Resource(url='https://some.url')
+        pubsub = status_events.subscribe(resource['id'])
+        helper = ValidationStatusHelper()
+
+        helper.createValidationJob(Session, resource['id'])
+        helper.updateValidationJobStatus(Session, resource['id'],
+                                         StatusTypes.running)
+
+        messages = [pubsub.get_message(timeout=1) for i in range(2)]
+        pubsub.close()
+        assert [json.loads(message['data'])['status']
+                for message in messages] == ['created', 'running']
+
+    def test_endpoint(self, app):
+        resource = factories.Resource(url='https://some.url')
+        timestamp = datetime.datetime.utcnow()
+        Session.add(Validation(resource_id=resource['id'], status='success',
+                               created=timestamp, finished=timestamp))
+        Session.commit()
+
+        response = app.get('/dataset/{}/resource/{}/validation/events'.format(
+            resource['package_id'], resource['id']))
+
+        assert response.headers['Content-Type'].startswith('text/event-stream')
+        events = _events(response.body.split('\n\n'))
+        assert events == [{'resource_id': resource['id'], 'status': 'success',
+                           'finished': timestamp.isoformat()}]
+
+    @pytest.mark.ckan_config(s.STATUS_EVENTS_TIMEOUT_KEY, 0)
+    def test_endpoint_disabled(self, app):
+        resource = factories.Resource(url='https://some.url')
+
+        app.get('/dataset/{}/resource/{}/validation/events'.format(
+            resource['package_id'], resource['id']), status=404)
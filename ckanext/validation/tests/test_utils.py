@@ -131,3 +131,46 @@ class TestProcessingSchemaFields(object):
         result = utils.process_schema_fields(data_dict)
         assert not result['schema']
         _assert_schema_inputs_cleared(data_dict)
+
+
+class TestSizeClasses(object):
+
+    def test_disabled_by_default(self):
+
+        assert utils.get_size_class({'size': 10}) is None
+
+    @change_config(s.SIZE_CLASSES_KEY, True)
+    @change_config(s.SIZE_MEDIUM_KEY, 100)
+    @change_config(s.SIZE_LARGE_KEY, 1000)
+    def test_size_classes(self):
+
+        assert utils.get_size_class({'size': 10}) == 'small'
+        assert utils.get_size_class({'size': 100}) == 'medium'
+        assert utils.get_size_class({'size': '5000'}) == 'large'
+
+    @change_config(s.SIZE_CLASSES_KEY, True)
+    def test_unknown_size(self):
+
+        assert utils.get_size_class({'url': 'http://example.com/file.csv'}) \
+            == 'medium'
+
+    @change_config(s.SIZE_CLASSES_KEY, True)
+    @change_config(s.SIZE_UNKNOWN_CLASS_KEY, 'large')
+    def test_unknown_size_class(self):
+
+        assert utils.get_size_class({'size': None}) == 'large'
+
+    @change_config(s.SIZE_CLASSES_KEY, True)
+    def test_queue_per_size_class(self):
+
+        assert s.get_queue_name('large') == 'validation-large'
+
+    @change_config(s.SIZE_CLASSES_KEY, True)
+    @change_config(s.QUEUE_KEY, 'bulk')
+    @change_config(s.JOB_TIMEOUT_KEY, 60)
+    @change_config(s.SIZE_CLASS_TIMEOUT_KEY.format('large'), 3600)
+    def test_size_class_overrides(self):
+
+        assert s.get_queue_name('small') == 'bulk-small'
+        assert s.get_job_options('small')['timeout'] == 60
+        assert s.get_job_options('large')['timeout'] == 3600
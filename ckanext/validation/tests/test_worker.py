@@ -0,0 +1,122 @@
+# encoding: utf-8
+
+import mock
+import pytest
+import responses
+import rq
+
+from ckan.lib import jobs as ckan_jobs
+
+from ckanext.validation import worker
+from ckanext.validation import settings as s
+from ckanext.validation.jobs import SchemaCache
+
+from .helpers import SCHEMA
+
+SCHEMA_URL = 'http://example.com/schema.json'
+
+
+class TestSchemaCache(object):
+
+    def test_disabled_by_default(self, mocked_responses):
+        mocked_responses.add(responses.GET, SCHEMA_URL, json=SCHEMA)
+        cache = SchemaCache()
+
+        assert cache.get(SCHEMA_URL) == SCHEMA
+        assert cache.get(SCHEMA_URL) == SCHEMA
+        assert len(mocked_responses.calls) == 2
+
+    def test_enabled_fetches_once(self, mocked_responses):
+        mocked_responses.add(responses.GET, SCHEMA_URL, json=SCHEMA)
+        cache = SchemaCache()
+        cache.enable(300)
+
+        assert cache.get(SCHEMA_URL) == SCHEMA
+        assert cache.get(SCHEMA_URL) == SCHEMA
+        assert len(mocked_responses.calls) == 1
+
+    def test_returns_copies(self, mocked_responses):
+        mocked_responses.add(responses.GET, SCHEMA_URL, json=SCHEMA)
+        cache = SchemaCache()
+        cache.enable(300)
+
+        cache.get(SCHEMA_URL)['fields'] = []
+
+        assert cache.get(SCHEMA_URL) == SCHEMA
+
+    def test_expired_entries_are_fetched_again(self, mocked_responses):
+        mocked_responses.add(responses.GET, SCHEMA_URL, json=SCHEMA)
+        cache = SchemaCache()
+        cache.enable(300)
+
+        with mock.patch('ckanext.validation.jobs.time.time', return_value=0):
+            cache.get(SCHEMA_URL)
+        with mock.patch('ckanext.validation.jobs.time.time', return_value=301):
+            cache.get(SCHEMA_URL)
+
+        assert len(mocked_responses.calls) == 2
+
+
+@mock.patch.object(ckan_jobs.Worker, 'perform_job', return_value=True)
+class TestValidationWorker(object):
+
+    def test_recycles_after_max_jobs(self, mock_perform_job):
+        validation_worker = worker.ValidationWorker(['default'], max_jobs=2)
+
+        validation_worker.perform_job(mock.Mock(), mock.Mock())
+        assert not validation_worker.recycle
+
+        validation_worker.perform_job(mock.Mock(), mock.Mock())
+        assert validation_worker.recycle
+        assert validation_worker._stop_requested
+
+    @mock.patch('ckanext.validation.worker._max_rss_mb', return_value=2048)
+    def test_recycles_over_max_memory(self, mock_rss, mock_perform_job):
+        validation_worker = worker.ValidationWorker(['default'],
+                                                    max_memory=1024)
+
+        validation_worker.perform_job(mock.Mock(), mock.Mock())
+
+        assert validation_worker.recycle
+
+    @mock.patch('ckanext.validation.worker._max_rss_mb', return_value=2048)
+    def test_no_limits(self, mock_rss, mock_perform_job):
+        validation_worker = worker.ValidationWorker(['default'])
+
+        for _i in range(10):
+            validation_worker.perform_job(mock.Mock(), mock.Mock())
+
+        assert not validation_worker.recycle
+
+    def test_recycles_after_failed_job(self, mock_perform_job):
+        mock_perform_job.side_effect = ValueError
+        validation_worker = worker.ValidationWorker(['default'], max_jobs=1)
+
+        with pytest.raises(ValueError):
+            validation_worker.perform_job(mock.Mock(), mock.Mock())
+
+        assert validation_worker.recycle
+
+
+class TestReindexFlush(object):
+
+    @pytest.mark.ckan_config(s.REINDEX_WINDOW_KEY, 10)
+    @mock.patch('ckanext.validation.worker.reindex.flush')
+    def test_flush_once_per_window(self, mock_flush):
+        validation_worker = worker.ValidationWorker(['default'])
+        validation_worker.last_reindex_flush -= 11
+
+        validation_worker.flush_reindex()
+        validation_worker.flush_reindex()
+
+        mock_flush.assert_called_once_with()
+
+    @pytest.mark.ckan_config(s.REINDEX_WINDOW_KEY, 10)
+    @mock.patch.object(rq.Worker, 'dequeue_job_and_maintain_ttl')
+    def test_idle_worker_wakes_up(self, mock_dequeue):
+        validation_worker = worker.ValidationWorker(['default'])
+
+        validation_worker.dequeue_job_and_maintain_ttl(405)
+        validation_worker.dequeue_job_and_maintain_ttl(None)
+
+        assert [c[0][0] for c in mock_dequeue.call_args_list] == [10, None]
@@ -16,12 +16,18 @@ import ckantoolkit as tk
 from requests.exceptions import RequestException
 from six import string_types
 
+try:
+    # The JSON library CKAN sends API responses with
+    from simplejson import RawJSON
+except ImportError:
+    RawJSON = None
+
 import ckan.plugins as plugins
 import ckan.lib.uploader as uploader
 from ckan import model
 
-from . import settings as s, jobs
-from .interfaces import IDataValidation, IPipeValidation
+from . import settings as s, jobs, pipeline, report_storage
+from .interfaces import IDataValidation
 from .validation_status_helper import ValidationStatusHelper, StatusTypes
 from .validators import resource_schema_validator
 
@@ -213,6 +219,44 @@ def _get_uploaded_resource_path(resource_data):
     return path
 
 
+def get_source_size(resource_data):
+    """Returns the size in bytes of the source of a resource, as stored in
+    its metadata or, for files uploaded to the local storage, on disk.
+    Returns None if it is not known."""
+    try:
+        size = int(resource_data.get('size') or 0)
+    except (TypeError, ValueError):
+        size = 0
+    if size > 0:
+        return size
+
+    if resource_data.get('url_type') == 'upload':
+        upload = uploader.get_resource_uploader(resource_data)
+        if isinstance(upload, uploader.ResourceUpload):
+            try:
+                return os.path.getsize(upload.get_path(resource_data['id']))
+            except OSError:
+                pass
+    return None
+
+
+def get_size_class(resource_data):
+    """Returns the size class (`small`, `medium` or `large`) of the source
+    of a resource, or None if jobs are not queued by size."""
+    size_classes = s.get_size_classes()
+    if not size_classes:
+        return None
+
+    size = get_source_size(resource_data)
+    if size is None:
+        return size_classes['unknown']
+    if size >= size_classes['large']:
+        return 'large'
+    if size >= size_classes['medium']:
+        return 'medium'
+    return 'small'
+
+
 def _get_session(resource_data):
     dataset = tk.get_action('package_show')({
         'user': get_site_user()['name']
@@ -365,11 +409,10 @@ def create_success_validation_job(resource_id):
     a success validation record."""
     vsh = ValidationStatusHelper()
 
-    record = vsh.createValidationJob(model.Session, resource_id)
-    record = vsh.updateValidationJobStatus(session=model.Session,
-                                           resource_id=resource_id,
-                                           status=StatusTypes.success,
-                                           validationRecord=record)
+    vsh.createValidationJob(model.Session, resource_id)
+    vsh.updateValidationJobStatus(session=model.Session,
+                                  resource_id=resource_id,
+                                  status=StatusTypes.success)
 
 
 def get_resource_validation_options(resource_data):
@@ -409,16 +452,28 @@ def is_uploaded_file(upload):
                       uploader.ALLOWED_UPLOAD_TYPES) and upload.filename
 
 
-def validation_dictize(validation):
-    report = validation.report
-    if not isinstance(report, dict):
-        report = json.loads(str(report))
+def validation_dictize(validation, summary=False, report=None, raw=False):
+    u'''
+    Returns a Validation record as a dict. The report is loaded from the
+    record unless already given as `report`, and if `raw` is set, it is
+    the stored JSON text of the report wrapped to be sent as is in the
+    JSON of an API response.
+    '''
+    if report is None:
+        if raw and RawJSON is not None:
+            text = report_storage.load_text(validation, summary=summary)
+            report = RawJSON(text) if text is not None else None
+        else:
+            report = report_storage.load(validation, summary=summary)
     out = {
         'id': validation.id,
         'resource_id': validation.resource_id,
         'status': validation.status,
         'report': report,
+        'report_offloaded': bool(validation.report_path),
         'error': validation.error,
+        'retries': validation.retries,
+        'cause': validation.cause,
     }
     out['created'] = (validation.created.isoformat()
                       if validation.created else None)
@@ -429,11 +484,4 @@ def validation_dictize(validation):
 
 
 def send_validation_report(validation_report):
-    for observer in plugins.PluginImplementations(IPipeValidation):
-        try:
-            observer.receive_validation_report(validation_report)
-        except Exception as ex:
-            log.exception(ex)
-            # We reraise all exceptions so they are obvious there
-            # is something wrong
-            raise
+    pipeline.dispatch(validation_report)
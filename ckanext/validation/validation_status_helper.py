@@ -1,10 +1,16 @@
 # encoding: utf-8
 
 import datetime
+import json
 import logging
 
-from ckan.model import Session
-from ckanext.validation import model
+import sqlalchemy as sa
+from ckan.model import types as _types
+from ckanext.validation import model, report_storage, error_index, history
+from ckanext.validation.compat import scalar_subquery
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import undefer_group
+from sqlalchemy.orm.util import identity_key
 from sqlalchemy.orm.exc import NoResultFound
 
 log = logging.getLogger(__name__)
@@ -12,6 +18,15 @@ log = logging.getLogger(__name__)
 REDIS_PREFIX = 'ckanext-validation:'
 
 
+def redis_connection():
+    u'''
+    Returns a connection to the Redis of the site, where the keys of the
+    extension are prefixed with `REDIS_PREFIX`.
+    '''
+    from ckan.lib.redis import connect_to_redis
+    return connect_to_redis()
+
+
 class StatusTypes:
     # could be Enum but keeping it system for now
     created = u'created'  # Job created and put onto queue
@@ -19,6 +34,17 @@ class StatusTypes:
     success = u'success'  # Validation Successful and report attached
     failure = u'failure'  # Validation Failed and report attached
     error = u'error'  # Validation Job could not create validation report
+    cancelled = u'cancelled'  # Validation Job was cancelled before finishing
+    timeout = u'timeout'  # Validation Job went over its time budget
+
+
+# How long a created or running job is considered pending, and its
+# worker alive. Older ones can be run again, or cancelled straight away
+PENDING_WINDOW = datetime.timedelta(hours=1)
+
+# Statuses of a job that is over, with a finished timestamp
+FINAL_STATUSES = (StatusTypes.success, StatusTypes.failure, StatusTypes.error,
+                  StatusTypes.cancelled, StatusTypes.timeout)
 
 
 class ValidationStatusHelper:
@@ -29,6 +55,8 @@ class ValidationStatusHelper:
     success: Validation Successful and report attached
     failure: Validation Failed and report attached
     error: Validation Job could not create validation report
+    cancelled: Validation Job was cancelled before finishing
+    timeout: Validation Job went over its time budget
 
     This class is to help ensure we don't enqueue validation jobs when a job is enqueued in the last hour
     and to stop worker threads from working on jobs which are pending (in progress).
@@ -37,30 +65,126 @@ class ValidationStatusHelper:
     * Ensure validation job/report is not reset multiple times.
     * To not re-enqueue if job is in 'created','running' for last hour (can't differentiate on running timestamp)
     * Allow job to be enqueued if in 'created','running' if over 1 hour old.
-    * Allow validation job to be re-queued in all other states i.e. ('success', 'failure', 'error')
+    * Allow validation job to be re-queued in all other states i.e. ('success', 'failure', 'error', 'cancelled', 'timeout')
     """
 
-    def getValidationJob(self, session=None, resource_id=None):
-        # type: (object, Session, str) -> model.Validation
+    def _redis(self):
+        return redis_connection()
+
+    def _cancelKey(self, resource_id):
+        return u'{}cancel:{}'.format(REDIS_PREFIX, resource_id)
+
+    def requestCancel(self, resource_id, ttl):
+        # type: (object, str, int) -> None
+        """
+        Flag the job of a resource to be cancelled. A queued job will not
+        start and a running one stops at its next budget check.
+        The flag outlives the job in the queue by no more than `ttl` seconds.
+        """
+        self._redis().set(self._cancelKey(resource_id), 1, ex=ttl)
+
+    def isCancelRequested(self, resource_id):
+        # type: (object, str) -> bool
+        return bool(self._redis().exists(self._cancelKey(resource_id)))
+
+    def clearCancelRequest(self, resource_id):
+        # type: (object, str) -> None
+        self._redis().delete(self._cancelKey(resource_id))
+
+    def statusChannel(self, resource_id):
+        return u'{}status:{}'.format(REDIS_PREFIX, resource_id)
+
+    def publishStatus(self, validationRecord):
+        # type: (object, model.Validation) -> None
+        """
+        Publish the new status of the job of a resource on its Redis
+        channel, for the clients following it (see `status_events`).
+        A failure to publish is logged, the status is stored anyway.
+        """
+        finished = validationRecord.finished
+        event = {
+            u'resource_id': validationRecord.resource_id,
+            u'status': validationRecord.status,
+            u'finished': finished.isoformat() if finished else None,
+        }
+        try:
+            self._redis().publish(
+                self.statusChannel(validationRecord.resource_id),
+                json.dumps(event))
+        except Exception as e:
+            log.warning("Could not publish the validation status of %s: %s",
+                        validationRecord.resource_id, e)
+
+    def getValidationJob(self, session=None, resource_id=None, payload=False):
+        # type: (object, Session, str, bool) -> model.Validation
         """
         Gets Validation record for resource if exists
 
+        The report and error are not loaded until accessed, unless
+        `payload` is set.
+
         :param self:
         :param resource_id:
+        :param payload: load the report and error in the same query
         :return Validation: Validation record or None
         """
         log.debug("getValidationJob: %s", resource_id)
+        query = session.query(model.Validation).filter(
+            model.Validation.resource_id == resource_id).order_by(model.Validation.created.desc())
+        if payload:
+            query = query.options(undefer_group('payload'))
         try:
-            return session.query(model.Validation).filter(
-                model.Validation.resource_id == resource_id).order_by(model.Validation.created.desc()).one()
+            return query.one()
         except NoResultFound:
             return None
 
+    def getValidationStatus(self, session=None, resource_id=None):
+        # type: (object, Session, str) -> object
+        """
+        Gets the id, status, created and finished timestamps of the
+        Validation record for resource if exists, without loading the record
+
+        :param self:
+        :param resource_id:
+        :return: row with id, status, created and finished or None
+        """
+        log.debug("getValidationStatus: %s", resource_id)
+        return session.query(
+            model.Validation.id, model.Validation.status,
+            model.Validation.created, model.Validation.finished
+        ).filter(model.Validation.resource_id == resource_id).first()
+
     def deleteValidationJob(self, session=None, validationRecord=None):
         # type: (object, Session, model.Validation) -> None
+        report_path = validationRecord.report_path
+        error_index.delete_errors(session, validationRecord.resource_id)
         session.delete(validationRecord)
         session.commit()
         session.flush()
+        if report_path:
+            report_storage.delete_body(report_path)
+
+    def _pendingSince(self, table, now):
+        # A job created or running in the last hour is still pending
+        return sa.and_(
+            table.c.status.in_((StatusTypes.created, StatusTypes.running)),
+            table.c.created > now - PENDING_WINDOW)
+
+    def _detachedRecord(self, result, row, values):
+        # The record as just written, built from the values sent and the
+        # columns returned, without reading it back. It is not added to
+        # the session.
+        columns = dict(zip(result.keys(), row))
+        previous_path = columns.pop('previous_report_path', None)
+        columns.update(values)
+        return model.Validation(**columns), previous_path
+
+    def _expireLoaded(self, session, record_id):
+        # The record was written without the ORM, a copy of it loaded
+        # before would keep the old values
+        loaded = session.identity_map.get(identity_key(model.Validation, record_id))
+        if loaded is not None:
+            session.expire(loaded)
 
     def createValidationJob(self, session=None, resource_id=None, validationRecord=None):
         # type: (object, Session, str) -> model.Validation
@@ -74,75 +198,154 @@ class ValidationStatusHelper:
         Else: (object exists and is in final state(success, failure, error))
             reset record to clean state with status 'created', created with timestamp now
 
+        This is done in a single INSERT ... ON CONFLICT DO UPDATE statement,
+        so concurrent requests can't both create a job.
 
         :param self:
         :param string resource_id: resource_id of job
-        :return Validation record
+        :param validationRecord: not used, kept for compatibility
+        :return Validation record, detached from the session
         :throws ValidationJobAlreadyEnqueued exception
 
         '''
         log.debug("createValidationJob: %s", resource_id)
-        if validationRecord is None:
-            validationRecord = self.getValidationJob(session, resource_id)
-
-        if validationRecord is not None:
-            status = validationRecord.status
-            if status in (StatusTypes.running, StatusTypes.created) and self.getHoursSince(validationRecord.created) < 1:
-                error_message = "Validation Job already in pending state: {} on resource: {} created on (gmt): {} data: {}"\
-                    .format(validationRecord.status, resource_id, validationRecord.created.isoformat(), validationRecord)
-                log.error(error_message)
-                raise ValidationJobAlreadyEnqueued(error_message)
-
-        if validationRecord is None:
-            validationRecord = model.Validation(resource_id=resource_id)
-
-        validationRecord.finished = None
-        validationRecord.report = None
-        validationRecord.error = None
-        validationRecord.created = datetime.datetime.utcnow()
-        validationRecord.status = StatusTypes.created
-
-        session.add(validationRecord)
+        table = model.Validation.__table__
+        now = datetime.datetime.utcnow()
+        values = {
+            'status': StatusTypes.created,
+            'created': now,
+            'finished': None,
+            'report': None,
+            'report_data': None,
+            'report_path': None,
+            'error': None,
+            'retries': 0,
+            'cause': None,
+        }
+        # Locked so the path of the report being replaced is the last one
+        previous = session.query(table.c.report_path).filter(
+            table.c.resource_id == resource_id).with_for_update().cte('previous')
+        statement = pg_insert(table).values(
+            id=_types.make_uuid(), resource_id=resource_id, **values
+        ).on_conflict_do_update(
+            index_elements=[table.c.resource_id],
+            set_=values,
+            where=sa.not_(self._pendingSince(table, now)),
+        ).returning(
+            table.c.id, table.c.resource_id,
+            scalar_subquery(session.query(previous.c.report_path)).label('previous_report_path'))
+
+        result = session.execute(statement)
+        row = result.first()
+        if row is None:
+            session.rollback()
+            error_message = "Validation Job already in pending state on resource: {}".format(resource_id)
+            log.error(error_message)
+            raise ValidationJobAlreadyEnqueued(error_message)
+        validationRecord, previous_path = self._detachedRecord(result, row, values)
         session.commit()
-        session.flush()
+        self._expireLoaded(session, validationRecord.id)
+
+        # A new job must not be stopped by a request to cancel the last one
+        self.clearCancelRequest(resource_id)
+        self.publishStatus(validationRecord)
+        if previous_path:
+            report_storage.delete_body(previous_path)
         return validationRecord
 
-    def updateValidationJobStatus(self, session=None, resource_id=None, status=None, report=None, error=None, validationRecord=None):
-        # type: (object, Session, str, str, object, object) -> model.Validation
+    def updateValidationJobStatus(self, session=None, resource_id=None, status=None, report=None, error=None, validationRecord=None,
+                                  retries=None, cause=None):
+        # type: (object, Session, str, str, object, object, object, int, str) -> model.Validation
         """
         If report or error is attached, update finished to be now
+
+        The record is updated in a single conditional UPDATE statement:
+        a job can only start running if it is not already running since
+        less than an hour, and only a created or running job can reach a
+        final status, so concurrent workers can't both run the same job.
+
         :param self:
         :param session Session
         :param resource_id:
         :param status:
-        :param report:
+        :param report: report dict or its JSON text
         :param error:
-        :return:
+        :param validationRecord: not used, kept for compatibility
+        :param retries: times the source was retried, left as is if None
+        :param cause: last transient failure, left as is if None
+        :return Validation record, detached from the session
+        :throws ValidationJobDoesNotExist, ValidationJobAlreadyRunning or
+            ValidationJobNotPending exception
         """
         log.debug("updateValidationJobStatus: %s status: %s", resource_id, status)
-        if validationRecord is None:
-            validationRecord = self.getValidationJob(session, resource_id)
+        table = model.Validation.__table__
+        now = datetime.datetime.utcnow()
+
+        # Set the report columns on a record that is not in the session
+        stored = model.Validation(resource_id=resource_id, report_path=None)
+        report_text = report_storage.store(stored, report)
+        values = {
+            'status': status,
+            'report': stored.report,
+            'report_data': stored.report_data,
+            'report_path': stored.report_path,
+            'error': error,
+        }
+        if retries is not None:
+            values['retries'] = retries
+        if cause is not None:
+            values['cause'] = cause
+        if status in FINAL_STATUSES:
+            values['finished'] = now
+            allowed = table.c.status.in_((StatusTypes.created, StatusTypes.running))
+        elif status == StatusTypes.running:
+            allowed = sa.not_(sa.and_(
+                table.c.status == StatusTypes.running,
+                table.c.created > now - PENDING_WINDOW))
+        else:
+            allowed = sa.true()
+
+        # Locked so the path of the report being replaced is the last one
+        previous = session.query(table.c.id, table.c.report_path).filter(
+            table.c.resource_id == resource_id).with_for_update().subquery('previous')
+        statement = table.update().where(
+            table.c.id == previous.c.id
+        ).where(allowed).values(**values).returning(
+            table.c.id, table.c.resource_id, table.c.created, table.c.finished,
+            table.c.retries, table.c.cause,
+            previous.c.report_path.label('previous_report_path'))
+
+        result = session.execute(statement)
+        row = result.first()
+        if row is None:
+            session.rollback()
+            if stored.report_path:
+                report_storage.delete_body(stored.report_path)
+            self._raiseNotUpdated(session, resource_id, status)
+        validationRecord, previous_path = self._detachedRecord(result, row, values)
+
+        if status in FINAL_STATUSES:
+            # Keep a row of the outcome, the record is reset by the next job
+            session.add(history.new_run(validationRecord, report, report_text))
+        session.commit()
+        self._expireLoaded(session, validationRecord.id)
+        self.publishStatus(validationRecord)
 
-        if validationRecord is None:
+        if previous_path and previous_path != validationRecord.report_path:
+            report_storage.delete_body(previous_path)
+        return validationRecord
+
+    def _raiseNotUpdated(self, session, resource_id, status):
+        # Only read when the update did not happen, to tell why
+        current = self.getValidationStatus(session, resource_id)
+        if current is None:
             log.error("record not found to update statues: %s", resource_id)
             raise ValidationJobDoesNotExist()
-
-        # Handle already running status in in last hour
-        if status == StatusTypes.running and validationRecord.status == status:
-            if self.getHoursSince(validationRecord.created) < 1:
-                raise ValidationJobAlreadyRunning()
-
-        validationRecord.status = status
-        validationRecord.report = report
-        validationRecord.error = error
-        if status in (StatusTypes.success, StatusTypes.failure, StatusTypes.error):
-            validationRecord.finished = datetime.datetime.utcnow()
-
-        Session.add(validationRecord)
-        Session.commit()
-        # Flush so other transactions are not waiting
-        Session.flush()
-        return validationRecord
+        if status == StatusTypes.running:
+            raise ValidationJobAlreadyRunning()
+        raise ValidationJobNotPending(
+            "Validation Job on resource {} is {}, can't set it to {}".format(
+                resource_id, current.status, status))
 
     def getHoursSince(self, created):
         return (datetime.datetime.utcnow() - created).total_seconds() / (60 * 60)
@@ -158,3 +361,15 @@ class ValidationJobDoesNotExist(Exception):
 
 class ValidationJobAlreadyRunning(Exception):
     """A Validation Job is Already Running."""
+
+
+class ValidationJobNotPending(Exception):
+    """A Validation Job is not created or running anymore."""
+
+
+class ValidationJobCancelled(Exception):
+    """A Validation Job was cancelled."""
+
+
+class ValidationJobTimeout(Exception):
+    """A Validation Job went over its time budget."""
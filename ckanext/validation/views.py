@@ -9,6 +9,33 @@ validation = Blueprint(u'validation', __name__)
 validation.add_url_rule(
     u'/dataset/<id>/resource/<resource_id>/validation', 'read', methods=('GET',), view_func=common.validation
 )
+validation.add_url_rule(
+    u'/dataset/<id>/resource/<resource_id>/validation/report.json', 'report', methods=('GET',),
+    view_func=common.validation_report
+)
+validation.add_url_rule(
+    u'/dataset/<id>/resource/<resource_id>/validation/errors.<format>', 'export', methods=('GET',),
+    view_func=common.validation_export
+)
+validation.add_url_rule(
+    u'/dataset/<id>/resource/<resource_id>/validation/events', 'events', methods=('GET',),
+    view_func=common.validation_events
+)
+
+# Take over the generic API routes for resource_validation_show
+validation.add_url_rule(
+    u'/api/action/resource_validation_show', 'api_show',
+    methods=('GET', 'POST'), view_func=common.validation_show_api
+)
+validation.add_url_rule(
+    u'/api/<int(min=3, max=3):ver>/action/resource_validation_show',
+    'api_show_version', methods=('GET', 'POST'),
+    view_func=common.validation_show_api
+)
+
+validation.add_url_rule(
+    u'/ckan-admin/validation', 'stats', methods=('GET',), view_func=common.validation_stats
+)
 
 
 def get_blueprints():
@@ -3,12 +3,70 @@
 ckan.module('validation-report', function (jQuery) {
   return {
     options: {
-      report: null
+      report: null,
+      reportUrl: null,
+      // Reports are fetched from `resource_validation_show` a page of
+      // errors at a time
+      apiUrl: null,
+      resourceId: null,
+      pageSize: 100
     },
     initialize: function() {
       let element = document.getElementById('report')
       let report = this.options.report
+      if (!report && this.options.apiUrl) {
+        this.offset = 0
+        this.pager = jQuery('#report-pager')
+        this.pager.on('click', '[data-page]', jQuery.proxy(this._onPage, this))
+        this._load()
+        return
+      }
+      if (!report && this.options.reportUrl) {
+        // Large reports are not embedded in the page
+        jQuery.getJSON(this.options.reportUrl, function (report) {
+          frictionlessComponents.render(frictionlessComponents.Report, { report }, element)
+        })
+        return
+      }
       frictionlessComponents.render(frictionlessComponents.Report, { report }, element)
+    },
+    _load: function () {
+      let element = document.getElementById('report')
+      jQuery.getJSON(this.options.apiUrl, {
+        resource_id: this.options.resourceId,
+        errors_offset: this.offset,
+        errors_limit: this.options.pageSize
+      }, jQuery.proxy(function (data) {
+        let result = data.result
+        frictionlessComponents.render(frictionlessComponents.Report, { report: result.report }, element)
+        this._updatePager(result.errors_count)
+      }, this))
+    },
+    _updatePager: function (count) {
+      let pageSize = this.options.pageSize
+      this.count = count
+      if (count <= pageSize) {
+        this.pager.hide()
+        return
+      }
+      this.pager.find('.validation-report-pager-info').text(
+        this._('Errors %(from)s to %(to)s of %(count)s', {
+          from: this.offset + 1,
+          to: Math.min(this.offset + pageSize, count),
+          count: count
+        }))
+      this.pager.find('[data-page="previous"]').prop('disabled', this.offset === 0)
+      this.pager.find('[data-page="next"]').prop('disabled', this.offset + pageSize >= count)
+      this.pager.show()
+    },
+    _onPage: function (event) {
+      let pageSize = this.options.pageSize
+      if (jQuery(event.currentTarget).data('page') === 'next') {
+        this.offset = Math.min(this.offset + pageSize, this.count - 1)
+      } else {
+        this.offset = Math.max(this.offset - pageSize, 0)
+      }
+      this._load()
     }
   }
 });
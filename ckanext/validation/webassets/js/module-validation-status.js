@@ -0,0 +1,36 @@
+"use strict";
+
+/* Follows the status of the validation job of a resource, pushed by the
+ * server as it changes, and reloads the page once the job is over.
+ *
+ * url - URL of the validation status events of the resource
+ * status - status of the job when the page was rendered
+ */
+ckan.module('validation-status', function (jQuery) {
+  const FINAL_STATUSES = ['success', 'failure', 'error', 'cancelled', 'timeout']
+
+  return {
+    options: {
+      url: null,
+      status: null
+    },
+    initialize: function() {
+      if (!window.EventSource || !this.options.url) {
+        return
+      }
+      let status = this.options.status
+      let source = new EventSource(this.options.url)
+      source.addEventListener('status', function (event) {
+        let data = JSON.parse(event.data)
+        if (FINAL_STATUSES.indexOf(data.status) === -1) {
+          return
+        }
+        // The server stops sending once the job is over
+        source.close()
+        if (data.status !== status) {
+          window.location.reload()
+        }
+      })
+    }
+  }
+});
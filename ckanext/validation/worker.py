@@ -0,0 +1,236 @@
+# encoding: utf-8
+
+import logging
+import multiprocessing
+import os
+import resource
+import signal
+import sys
+import time
+
+import rq
+from six import string_types
+
+from ckan.lib import jobs as ckan_jobs
+from ckan.model import meta
+
+from ckanext.validation import settings as s, jobs, prefetch, reindex
+
+log = logging.getLogger(__name__)
+
+# Exit code used by a worker process that stopped to be recycled, as
+# opposed to one that stopped because it was asked to or ran out of jobs.
+RECYCLE_EXIT_CODE = 75
+
+_JOB_FUNC_NAME = u'{}.{}'.format(
+    jobs.run_validation_job.__module__, jobs.run_validation_job.__name__)
+
+
+def preload():
+    u'''
+    Warm up a worker process before it picks up its first job.
+
+    Frictionless loads its format plugins, detectors and parsers lazily,
+    so a tiny inline validation is run to get them imported. Remote
+    schemas start being cached from here on.
+    '''
+    jobs.validate([[u'id'], [u'1']])
+    jobs.schema_cache.enable(s.get_schema_cache_ttl())
+
+
+def _max_rss_mb():
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+class ValidationWorker(ckan_jobs.Worker, rq.SimpleWorker):
+    u'''
+    Background jobs worker that runs validation jobs in its own process
+    instead of forking a work horse for each of them, so imported modules,
+    the database connection pool and the HTTP and schema caches are kept
+    between jobs.
+
+    The worker stops after `max_jobs` jobs or once its memory usage goes
+    over `max_memory` megabytes, so the pool can replace it with a fresh
+    process.
+    '''
+
+    def __init__(self, queues=None, max_jobs=0, max_memory=0,
+                 prefetcher=None, **kwargs):
+        super(ValidationWorker, self).__init__(queues, **kwargs)
+        self.max_jobs = max_jobs
+        self.max_memory = max_memory
+        self.prefetcher = prefetcher
+        self.jobs_performed = 0
+        self.recycle = False
+        self.last_reindex_flush = time.time()
+
+    def execute_job(self, job, queue):
+        if self.prefetcher:
+            self.prefetch_upcoming(queue)
+        # Nothing is forked, so unlike `ckan.lib.jobs.Worker` there is no
+        # need to dispose of the database engine before every job.
+        return rq.SimpleWorker.execute_job(self, job, queue)
+
+    def prefetch_upcoming(self, queue):
+        u'''
+        Hand the sources of the next jobs waiting in `queue` over to the
+        prefetcher, so they download while the current job is validated.
+        '''
+        try:
+            resource_ids = []
+            for job in queue.get_jobs(0, self.prefetcher.depth):
+                if job and job.func_name == _JOB_FUNC_NAME:
+                    resource_id = job.kwargs.get(u'resource')
+                    if isinstance(resource_id, string_types):
+                        resource_ids.append(resource_id)
+            self.prefetcher.submit(prefetch.remote_sources(resource_ids))
+        except Exception as e:
+            # Prefetching is an optimisation, never fail a job over it
+            log.warning(u'Could not prefetch upcoming sources: %s', e)
+
+    def dequeue_job_and_maintain_ttl(self, timeout, *args, **kwargs):
+        window = s.get_reindex_window()
+        if timeout is not None and window:
+            # Wake up while idle to flush the reindexes that become due,
+            # RQ sends a heartbeat each time
+            timeout = min(timeout, max(1, window))
+        return super(ValidationWorker, self).dequeue_job_and_maintain_ttl(
+            timeout, *args, **kwargs)
+
+    def heartbeat(self, *args, **kwargs):
+        result = super(ValidationWorker, self).heartbeat(*args, **kwargs)
+        self.flush_reindex()
+        return result
+
+    def flush_reindex(self):
+        u'''
+        Reindex the datasets whose window is over, at most once per
+        window, so they are not left stale when no job finishes.
+        '''
+        window = s.get_reindex_window()
+        if not window or time.time() - self.last_reindex_flush < window:
+            return
+        self.last_reindex_flush = time.time()
+        try:
+            reindex.flush()
+        except Exception as e:
+            log.warning(u'Could not flush the pending reindexes: %s', e)
+
+    def perform_job(self, job, queue):
+        try:
+            return super(ValidationWorker, self).perform_job(job, queue)
+        finally:
+            self.jobs_performed += 1
+            if self.max_jobs and self.jobs_performed >= self.max_jobs:
+                log.info(u'Worker %s performed %s jobs, recycling',
+                         self.key, self.jobs_performed)
+                self.recycle = True
+            elif self.max_memory and _max_rss_mb() > self.max_memory:
+                log.info(u'Worker %s is using over %s MB, recycling',
+                         self.key, self.max_memory)
+                self.recycle = True
+            if self.recycle:
+                self._stop_requested = True
+
+
+def _work(queues, max_jobs, max_memory, burst):
+    # Leave the parent's process group, so a Ctrl+C in the terminal reaches
+    # the pool only once, through `run`, and jobs get a warm shutdown.
+    os.setpgrp()
+
+    # The connections in the pool belong to the parent process
+    meta.Session.remove()
+    meta.engine.dispose()
+
+    preload()
+
+    prefetcher = None
+    prefetch_options = s.get_prefetch_options()
+    if prefetch_options[u'depth'] > 0:
+        prefetcher = prefetch.Prefetcher(**prefetch_options)
+        prefetcher.start()
+
+    worker = ValidationWorker(
+        queues, max_jobs=max_jobs, max_memory=max_memory,
+        prefetcher=prefetcher)
+    try:
+        worker.work(burst=burst)
+    finally:
+        if prefetcher:
+            prefetcher.stop()
+        try:
+            reindex.flush(everything=True)
+        except Exception as e:
+            log.warning(u'Could not flush the pending reindexes: %s', e)
+
+    if worker.recycle:
+        sys.exit(RECYCLE_EXIT_CODE)
+
+
+def _default_queues(size_class=None):
+    if size_class:
+        return [s.get_queue_name(size_class)]
+    if s.get_size_classes():
+        # Smaller jobs first, RQ takes jobs from the queues in order
+        return [s.get_queue_name(size) for size in s.SIZE_CLASSES]
+    return [s.get_queue_name() or ckan_jobs.DEFAULT_QUEUE_NAME]
+
+
+def run(queues=None, processes=None, max_jobs=None, max_memory=None,
+        burst=False, size_class=None):
+    u'''
+    Start a pool of validation worker processes listening on `queues`
+    (by default the validation queue, or the queue of `size_class`) and
+    keep it at full size, replacing processes as they get recycled, until
+    interrupted.
+    '''
+    options = s.get_worker_options(size_class)
+    if processes is None:
+        processes = options[u'processes']
+    if max_jobs is None:
+        max_jobs = options[u'max_jobs']
+    if max_memory is None:
+        max_memory = options[u'max_memory']
+    queues = list(queues or _default_queues(size_class))
+
+    # Fork explicitly, child processes need the configuration and the
+    # application context already loaded in this one
+    context = multiprocessing.get_context(u'fork')
+    pool = {}
+    stopping = []
+
+    def _spawn(slot):
+        process = context.Process(
+            target=_work, args=(queues, max_jobs, max_memory, burst),
+            name=u'validation-worker-{}'.format(slot))
+        process.start()
+        pool[slot] = process
+        log.info(u'Started validation worker process %s (pid %s) on %s',
+                 slot, process.pid, u', '.join(queues))
+
+    def _stop(signum, frame):
+        # A first signal lets running jobs finish, a second one kills them
+        stopping.append(signum)
+        for process in pool.values():
+            if process.is_alive():
+                process.terminate()
+
+    signal.signal(signal.SIGINT, _stop)
+    signal.signal(signal.SIGTERM, _stop)
+
+    for slot in range(max(processes, 1)):
+        _spawn(slot)
+
+    while pool:
+        for slot, process in list(pool.items()):
+            if process.is_alive():
+                continue
+            process.join()
+            del pool[slot]
+            if not stopping and (
+                    not burst or process.exitcode == RECYCLE_EXIT_CODE):
+                _spawn(slot)
+        time.sleep(1)
+
+    log.info(u'Validation workers stopped')
@@ -0,0 +1,100 @@
+# encoding: utf-8
+
+import datetime
+import logging
+
+from sqlalchemy.orm.util import identity_key
+
+import ckantoolkit as tk
+
+from ckan import model
+
+from ckanext.validation import reindex, settings
+
+log = logging.getLogger(__name__)
+
+
+def write_status(resource_id, status, timestamp):
+    u'''
+    Stores the status of the last validation of a resource in its
+    `validation_status` and `validation_timestamp` fields, and queues
+    the reindex of its dataset so it can be searched by status.
+
+    By default `resource_patch` is called, which reindexes the dataset
+    by itself. With `ckanext.validation.status_writeback` set to
+    `direct`, the fields are written directly to the resource table
+    instead, which does not run `package_update`, its validation and the
+    plugin hooks.
+
+    Returns the id of the dataset of the resource, or None if it does
+    not exist anymore.
+    '''
+    fields = {
+        u'validation_status': status,
+        u'validation_timestamp': timestamp.isoformat(),
+    }
+    if settings.get_status_writeback() == u'patch':
+        return _patch(resource_id, fields)
+
+    package_id = write_fields(model.Session, resource_id, fields)
+    if package_id:
+        reindex.touch(package_id)
+    return package_id
+
+
+def write_fields(session, resource_id, fields):
+    u'''
+    Sets extra fields of an active resource with plain UPDATE statements
+    and commits them. The modified date of the resource and its dataset
+    is updated as `resource_patch` would, but nothing is reindexed.
+
+    The row of the resource is locked while its extras are merged, so
+    fields changed by a concurrent edit are not lost.
+
+    Returns the id of the dataset of the resource, or None if it does
+    not exist or is deleted.
+    '''
+    resource = model.resource_table
+    row = session.query(
+        resource.c.package_id, resource.c.extras
+    ).filter(
+        resource.c.id == resource_id,
+        resource.c.state == u'active',
+    ).with_for_update().first()
+    if row is None:
+        return None
+
+    extras = dict(row.extras or {})
+    extras.update(fields)
+    now = datetime.datetime.utcnow()
+    session.execute(resource.update().where(
+        resource.c.id == resource_id
+    ).values(extras=extras, metadata_modified=now))
+    session.execute(model.package_table.update().where(
+        model.package_table.c.id == row.package_id
+    ).values(metadata_modified=now))
+    session.commit()
+
+    # Written without the ORM, so the changes are not seen by the
+    # domain object observers, and copies loaded before are out of date
+    for entity, entity_id in ((model.Resource, resource_id),
+                              (model.Package, row.package_id)):
+        loaded = session.identity_map.get(identity_key(entity, entity_id))
+        if loaded is not None:
+            session.expire(loaded)
+    return row.package_id
+
+
+def _patch(resource_id, fields):
+    site_user = tk.get_action(u'get_site_user')({u'ignore_auth': True})
+    data_dict = dict(fields, id=resource_id)
+    try:
+        resource = tk.get_action(u'resource_patch')(
+            {u'ignore_auth': True,
+             u'user': site_user[u'name'],
+             # Stops the plugin from validating the resource again
+             u'_validation_performed': True},
+            data_dict)
+    except tk.ObjectNotFound:
+        return None
+    return resource[u'package_id']